@@ -1,15 +1,26 @@
+import asyncio
+from contextlib import aclosing
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 import pandas as pd
 
 from app.services.llm_service_factory import LLMServiceFactory
+from app.utils.prepared_dataset import PreparedDataset, prepare_inputs
+from app.utils.prompt_budget import PromptBudget, PromptSection, prompt_budget_metrics
+from app.utils.reasoning_utils import strip_reasoning
 
 import os
 from app.services.config_service import ConfigService
 
+# 控制推理的生成参数，只有支持的模型才会发送
+THINKING_KEYS = ("enable_thinking", "thinking_budget")
+
 class BaseAgent(ABC):
     """基础代理类，所有专用代理都应继承自此类"""
     
+    # 提示词中每个数据集的schema信息包含的字段，取自PreparedDataset.schema
+    SCHEMA_FIELDS = ("columns", "row_count")
+    
     def __init__(self, agent_id: Optional[str] = None, service_type: Optional[str] = None, model: Optional[str] = None):
         # 获取配置服务实例
         self.config_service = ConfigService()
@@ -42,7 +53,7 @@ class BaseAgent(ABC):
                 self.service_type = default_config.get('config', {}).get('service_type')
             else:
                 self.service_type = self.config_service.get_config_value('llm.service_type')
-                
+        
         if self.model is None:
             if agent_config and agent_config.get('config', {}).get('model'):
                 self.model = agent_config.get('config', {}).get('model')
@@ -59,6 +70,137 @@ class BaseAgent(ABC):
         self._update_llm_service()
         return self.llm_service
     
+    def _get_llm_options(self) -> Dict[str, Any]:
+        """
+        获取当前代理调用LLM时附加的参数，包括用于调用指标统计的agent_id和来自代理配置的参数
+        
+        支持的配置项：
+            cache: 为false时该代理的调用不使用响应缓存
+            generation: 生成参数，见_get_generation_profile
+        """
+        agent_config = self.config_service.get_agent_config(self.agent_id) or {}
+        options = self._get_generation_profile()
+        options['agent_id'] = self.agent_id
+        if agent_config.get('config', {}).get('cache') is False:
+            options['use_cache'] = False
+        return options
+    
+    def _get_generation_profile(self) -> Dict[str, Any]:
+        """
+        获取当前代理的生成参数，来自代理配置的generation，如max_tokens、stop、temperature
+        
+        enable_thinking和thinking_budget只对llm.generation.thinking_models中列出的模型（按名称前缀匹配）发送，
+        其他模型不支持关闭推理或限制推理长度，只能通过max_tokens限制总输出
+        """
+        agent_config = self.config_service.get_agent_config(self.agent_id) or {}
+        profile = dict(agent_config.get('config', {}).get('generation') or {})
+        thinking_models = self.config_service.get_config_value('llm.generation.thinking_models', [])
+        if not any((self.model or '').startswith(prefix) for prefix in thinking_models):
+            for key in THINKING_KEYS:
+                profile.pop(key, None)
+        return profile
+    
+    def _get_prompt_budget(self) -> Optional[PromptBudget]:
+        """
+        根据当前模型的上下文窗口创建提示词预算，配置llm.prompt_budget.enabled为false时返回None
+        
+        上下文窗口来自llm.context_windows，未配置的模型使用其中的default；输出预留优先使用代理的max_tokens
+        """
+        if not self.config_service.get_config_value('llm.prompt_budget.enabled', True):
+            return None
+        context_windows = self.config_service.get_config_value('llm.context_windows', {})
+        # 代理配置了输出上限时按上限预留，否则使用全局的预留值
+        output_reserve_tokens = (self._get_generation_profile().get('max_tokens')
+                                 or self.config_service.get_config_value('llm.prompt_budget.output_reserve_tokens', 4096))
+        return PromptBudget(
+            context_window=context_windows.get(self.model) or context_windows.get('default', 32768),
+            output_reserve_tokens=output_reserve_tokens,
+            safety_margin=self.config_service.get_config_value('llm.prompt_budget.safety_margin', 0.1),
+            section_shares=self.config_service.get_config_value('llm.prompt_budget.section_shares')
+        )
+    
+    def _fit_prompt(self, sections: List[PromptSection],
+                    build_messages: Callable[[Dict[str, str]], List[Dict[str, str]]]) -> List[Dict[str, str]]:
+        """
+        在上下文预算内为各提示词片段选择降级级别并构建消息，预算报告保存在last_prompt_report中
+        
+        Args:
+            sections: 按重要性从高到低排列的可降级片段
+            build_messages: 根据{片段名称: 渲染文本}构建消息列表的函数
+        
+        Returns:
+            消息列表
+        """
+        budget = self._get_prompt_budget()
+        if budget is None:
+            self.last_prompt_report = None
+            return build_messages({section.name: section.render(0) for section in sections})
+        
+        messages, report = budget.fit(sections, build_messages)
+        prompt_budget_metrics.record(self.agent_id, report)
+        self.last_prompt_report = report
+        return messages
+    
+    def _chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """使用当前代理的配置调用LLM"""
+        options = self._get_llm_options()
+        options.update(kwargs)
+        return self.get_llm_service().chat_completion(messages=messages, **options)
+    
+    async def _achat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """使用当前代理的配置异步调用LLM"""
+        options = self._get_llm_options()
+        options.update(kwargs)
+        return await self.get_llm_service().achat_completion(messages=messages, **options)
+    
+    def _chat_completion_batch(self, messages_list: List[List[Dict[str, str]]], max_parallel: Optional[int] = None, **kwargs) -> List[Dict[str, Any]]:
+        """
+        使用当前代理的配置并发执行多个互不依赖的LLM调用
+        
+        Args:
+            messages_list: 每个调用的消息列表
+            max_parallel: 最大并发数，为None时使用配置llm.batch.max_parallel
+            **kwargs: 所有调用共用的参数
+        
+        Returns:
+            与messages_list顺序一致的结果列表，格式见BaseLLMService.chat_completion_batch
+        """
+        options = self._get_llm_options()
+        options.update(kwargs)
+        requests = [dict(options, messages=messages) for messages in messages_list]
+        return self.get_llm_service().chat_completion_batch(requests, max_parallel=max_parallel or self._get_batch_parallelism())
+    
+    async def _achat_completion_batch(self, messages_list: List[List[Dict[str, str]]], max_parallel: Optional[int] = None, **kwargs) -> List[Dict[str, Any]]:
+        """使用当前代理的配置异步并发执行多个互不依赖的LLM调用，参数和返回值与_chat_completion_batch一致"""
+        options = self._get_llm_options()
+        options.update(kwargs)
+        requests = [dict(options, messages=messages) for messages in messages_list]
+        return await self.get_llm_service().achat_completion_batch(requests, max_parallel=max_parallel or self._get_batch_parallelism())
+    
+    def _get_batch_parallelism(self) -> int:
+        return self.config_service.get_config_value('llm.batch.max_parallel', 4)
+    
+    def _prepare_inputs(self, inputs: List[Any]) -> List[PreparedDataset]:
+        """
+        将输入转换为准备好的数据集列表，请求流水线准备好的数据集直接使用
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径、DataFrame或PreparedDataset
+        
+        Returns:
+            准备好的数据集列表，内容相同的数据集复用已经计算的数据集信息
+        """
+        return prepare_inputs(inputs)
+    
+    def _get_schema_info(self, dataset: PreparedDataset) -> Dict[str, Any]:
+        """获取数据集的schema信息，只包含SCHEMA_FIELDS中的字段"""
+        return {field: dataset.schema[field] for field in self.SCHEMA_FIELDS}
+    
+    @staticmethod
+    def _response_content(response: Dict[str, Any]) -> str:
+        """获取LLM响应的回答内容，去除混在content中的<think>推理块"""
+        return strip_reasoning(response['choices'][0]['message'].get('content'))
+    
     @abstractmethod
     def execute(self, df: pd.DataFrame, prompt: str) -> Any:
         """
@@ -67,7 +209,7 @@ class BaseAgent(ABC):
         Args:
             df: 输入的DataFrame数据
             prompt: 用户需求描述
-            
+        
         Returns:
             执行结果
         """
@@ -81,4 +223,84 @@ class BaseAgent(ABC):
     
     def execute(self, inputs, prompt):
         """执行代理任务"""
-        raise NotImplementedError("子类必须实现此方法")
\ No newline at end of file
+        raise NotImplementedError("子类必须实现此方法")
+    
+    async def aexecute(self, inputs, prompt):
+        """异步执行代理任务，默认在线程池中执行同步的execute，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.execute, inputs, prompt)
+    
+    async def agenerate(self, inputs, prompt) -> Dict[str, Any]:
+        """
+        只执行生成阶段：构建提示信息并调用LLM，不产生执行代码、写文件等副作用
+        
+        结果交给afinish完成后续处理。推测执行只运行这一阶段，意图不一致时直接丢弃结果
+        
+        Returns:
+            生成结果，包含LLM响应和后续处理需要的数据
+        """
+        raise NotImplementedError(f"{self.__class__.__name__}不支持分阶段执行")
+    
+    async def afinish(self, generation: Dict[str, Any]) -> Any:
+        """
+        根据agenerate的生成结果完成后续处理，返回与aexecute相同的结果
+        
+        Args:
+            generation: agenerate的返回值
+        """
+        raise NotImplementedError(f"{self.__class__.__name__}不支持分阶段执行")
+    
+    def build_generation(self, inputs: List[Any], prompt: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        由外部得到的LLM响应构建afinish需要的生成结果，用于融合路由等由其他调用完成生成的场景
+        
+        Args:
+            inputs: 代理输入
+            prompt: 用户需求
+            response: 只包含本代理输出的LLM响应
+        
+        Returns:
+            与agenerate格式一致的生成结果
+        """
+        return {"response": response}
+    
+    @classmethod
+    def supports_staged_execution(cls) -> bool:
+        """是否实现了agenerate和afinish"""
+        return cls.agenerate is not BaseAgent.agenerate and cls.afinish is not BaseAgent.afinish
+    
+    async def astream(self, inputs, prompt) -> AsyncIterator[Dict[str, Any]]:
+        """
+        异步流式执行代理任务，逐个产生执行事件
+        
+        事件格式：
+            {"type": "stage", "stage": "codegen", "status": "start" | "end"}  执行阶段
+            {"type": "token", "content": "..."}                               生成内容片段
+            {"type": "reasoning", "content": "..."}                           推理内容片段
+            {"type": "result", "result": ...}                                 最终结果，总是最后一个事件
+        
+        默认实现不产生中间事件，只在aexecute完成后产生最终结果
+        """
+        yield {"type": "result", "result": await self.aexecute(inputs, prompt)}
+    
+    async def _astream_completion(self, messages: List[Dict[str, str]], chunks: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式调用LLM，将增量内容转换为token/reasoning事件
+        
+        Args:
+            messages: 消息列表
+            chunks: 用于收集原始数据块的列表，调用方可据此合并出完整结果
+        """
+        async with aclosing(self.get_llm_service().astream_chat_completion(messages=messages, **self._get_llm_options())) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if delta.get("reasoning_content"):
+                        yield {"type": "reasoning", "content": delta["reasoning_content"]}
+                    if delta.get("content"):
+                        yield {"type": "token", "content": delta["content"]}
+    
+    @staticmethod
+    def _stage_event(stage: str, status: str) -> Dict[str, Any]:
+        """构建执行阶段事件"""
+        return {"type": "stage", "stage": stage, "status": status}
@@ -1,21 +1,52 @@
-import os
-import tempfile
-import importlib.util
-from typing import Any, Dict, Optional, List, Union, Tuple
-import json
+import time
+import asyncio
+import traceback
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Optional, List, Union, Tuple
 import re
 import pandas as pd
 
 from app.agents.base_agent import BaseAgent
-from app.utils.data_loader import DataLoader
+from app.services.code_cache import build_code_key, get_code_cache
+from app.services.code_sandbox import (RemoteTraceback, SandboxTimeoutError, SandboxWorkerError, get_sandbox,
+                                       profile_analysis_code, run_analysis_code)
+from app.utils.code_compiler import FORBIDDEN_CALLS, FORBIDDEN_MODULES, CodeCheckError, compile_analysis_code
+from app.utils.code_profiler import profiling_requested
+from app.utils.code_repair import build_repair_messages, code_repair_stats, compact_traceback, relevant_columns
+from app.utils.pandas_idioms import SlowIdiom, build_rewrite_messages, estimate_seconds, find_slow_idioms, slow_idiom_stats
+from app.utils.prepared_dataset import PreparedDataset, schema_fingerprint
+from app.utils.prompt_budget import schema_section
+from app.utils.prompt_assembly import assemble_messages
+from app.utils.token_utils import estimate_message_tokens
+from app.utils.logger import setup_logger
+
+logger = setup_logger("data_analysis_agent")
 
 class DataAnalysisAgent(BaseAgent):
     """数据分析代理，用于生成和执行数据分析代码"""
     
+    # 静态系统指令，所有请求共享这一前缀
+    # 代码执行前的检查禁止的模块和函数与code_compiler中的定义保持一致
+    SYSTEM_PROMPT = f"""你是一个数据分析专家，可以生成Python代码来分析数据。请仅返回可执行的Python代码，不要包含任何解释。注意要结合输入数据schema，和输入数据完美适配，不要有bug
+
+请基于用户提供的数据信息和分析需求生成一个完整的Python函数，函数名为'analyze_data'，接收一个包含多个pandas DataFrame的列表参数'dfs'，
+返回一个字典，其中键为分析结果的简要描述，值为对应的DataFrame结果。
+
+代码只能处理传入的数据，不能读写文件或访问网络。禁止导入以下模块：{", ".join(sorted(FORBIDDEN_MODULES))}；
+禁止调用以下函数：{", ".join(sorted(FORBIDDEN_CALLS))}。
+
+示例返回格式：
+{{
+    "基本统计信息": df_stats,
+    "分类统计": df_category_stats,
+    ...
+}}"""
+    
     def __init__(self, service_type: Optional[str] = None, model: Optional[str] = None):
         # 调用基类初始化，传入agent_id
         super().__init__(agent_id="data_analysis", service_type=service_type, model=model)
         self.generated_code = ""  # 添加一个属性来存储生成的代码
+        self.execution_profile = None  # 要求剖析时最近一次执行代码的逐行剖析结果
         
     # 示例修改
     def execute(self, inputs: List[Any], analysis_requirement: str) -> Dict[str, pd.DataFrame]:
@@ -29,134 +60,344 @@ class DataAnalysisAgent(BaseAgent):
         Returns:
             包含多个分析结果DataFrame的字典，键为描述，值为DataFrame
         """
-        # 1. 处理输入，转换为DataFrame列表
-        dfs, df_names = self._process_inputs(inputs)
-        
-        # 2. 获取所有DataFrame的schema信息
-        schema_infos = [self._get_schema_info(df) for df in dfs]
-        
-        # 3. 构建提示信息
-        messages = [
-            {
-                "role": "system",
-                "content": "你是一个数据分析专家，可以生成Python代码来分析数据。请仅返回可执行的Python代码，不要包含任何解释。注意要结合输入数据schema，和输入数据完美适配，不要有bug"
-            },
-            {
-                "role": "user",
-                "content": f"""
-基于以下信息生成Python代码：
-
-1. 数据信息：
-{json.dumps(list(zip(df_names, schema_infos)), ensure_ascii=False, indent=2)}
-
-2. 分析需求：
-{analysis_requirement}
-
-请生成一个完整的Python函数，函数名为'analyze_data'，接收一个包含多个pandas DataFrame的列表参数'dfs'，
-返回一个字典，其中键为分析结果的简要描述，值为对应的DataFrame结果。
-
-示例返回格式：
-{{
-    "基本统计信息": df_stats,
-    "分类统计": df_category_stats,
-    ...
-}}
-"""
-            }
-        ]
+        generation = self._prepare_generation(inputs, analysis_requirement)
+        options = {}
+        if "code" in generation:
+            try:
+                return self._run_cached_code(generation)
+            except Exception as e:
+                self._invalidate_code(generation, e)
+                # 同样的提示信息在响应缓存中对应的正是刚刚失败的代码
+                options["use_cache"] = False
         
         # 4. 调用LLM生成代码
-        response = self.get_llm_service().chat_completion(messages=messages)
-        raw_content = response['choices'][0]['message']['content']
+        generation["response"] = self._chat_completion(generation["messages"], **options)
+        return self._run_and_cache(generation)
+    
+    async def aexecute(self, inputs: List[Any], analysis_requirement: str) -> Dict[str, pd.DataFrame]:
+        """
+        异步执行数据分析任务，数据处理和代码执行在线程池中进行，不阻塞事件循环
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径或DataFrame
+            analysis_requirement: 数据分析需求描述
+            
+        Returns:
+            包含多个分析结果DataFrame的字典，键为描述，值为DataFrame
+        """
+        async with aclosing(self.astream(inputs, analysis_requirement)) as events:
+            async for event in events:
+                if event["type"] == "result":
+                    return event["result"]
+    
+    async def astream(self, inputs: List[Any], analysis_requirement: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        异步流式执行数据分析任务，依次产生代码生成(codegen)和代码执行(exec)阶段事件，最后产生分析结果
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径或DataFrame
+            analysis_requirement: 数据分析需求描述
+        """
+        yield self._stage_event("codegen", "start")
+        generation = await self.agenerate(inputs, analysis_requirement)
+        yield self._stage_event("codegen", "end")
+        
+        yield self._stage_event("exec", "start")
+        result = await self.afinish(generation)
+        yield self._stage_event("exec", "end")
         
+        yield {"type": "result", "result": result}
+    
+    async def agenerate(self, inputs: List[Any], analysis_requirement: str) -> Dict[str, Any]:
+        """生成分析代码但不执行，代码缓存命中时不调用LLM"""
+        generation = await asyncio.to_thread(self._prepare_generation, inputs, analysis_requirement)
+        if "code" not in generation:
+            generation["response"] = await self._achat_completion(generation["messages"])
+        return generation
+    
+    async def afinish(self, generation: Dict[str, Any]) -> Dict[str, Any]:
+        """在线程池中执行生成的分析代码，缓存的代码在新数据上执行失败时跳过响应缓存重新生成"""
+        if "code" in generation:
+            try:
+                return await asyncio.to_thread(self._run_cached_code, generation)
+            except Exception as e:
+                self._invalidate_code(generation, e)
+                generation = dict(generation, response=await self._achat_completion(generation["messages"], use_cache=False))
+        return await asyncio.to_thread(self._run_and_cache, generation)
+    
+    def build_generation(self, inputs: List[Any], prompt: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """由外部得到的LLM响应构建生成结果，附带执行代码需要的DataFrame，代码执行成功后同样写入代码缓存"""
+        datasets = self._prepare_inputs(inputs)
+        return {
+            "response": response,
+            "dfs": [dataset.frame for dataset in datasets],
+            "cache_key": self._code_cache_key(datasets, prompt),
+            "requirement": prompt
+        }
+    
+    def _prepare_generation(self, inputs: List[Any], analysis_requirement: str) -> Dict[str, Any]:
+        """
+        处理输入、构建代码生成的提示信息并查找代码缓存
+        
+        缓存键由输入数据集的schema指纹（列名和列类型）和规范化后的需求计算，与数据内容无关，
+        同一需求在刷新后的数据上可以直接执行之前生成的代码
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径或DataFrame
+            analysis_requirement: 数据分析需求描述
+        
+        Returns:
+            {"dfs", "messages", "cache_key", "requirement"}，缓存命中时还包含code
+        """
+        datasets = self._prepare_inputs(inputs)
+        dfs, messages = self._prepare_messages(datasets, analysis_requirement)
+        generation = {
+            "dfs": dfs,
+            "messages": messages,
+            "cache_key": self._code_cache_key(datasets, analysis_requirement),
+            "requirement": analysis_requirement
+        }
+        cache = get_code_cache()
+        if cache is not None and generation["cache_key"]:
+            code = cache.get(generation["cache_key"])
+            if code is not None:
+                generation["code"] = code
+        return generation
+    
+    @staticmethod
+    def _code_cache_key(datasets: List[PreparedDataset], analysis_requirement: str) -> Optional[str]:
+        """计算代码缓存键，未启用代码缓存时返回None"""
+        if get_code_cache() is None:
+            return None
+        return build_code_key(schema_fingerprint(datasets), analysis_requirement)
+    
+    def _run_cached_code(self, generation: Dict[str, Any]) -> Dict[str, Any]:
+        """执行缓存中的代码，在当前数据上执行失败时先按错误信息修复，修复后的代码替换原来的缓存"""
+        result = self._run_with_repair(generation, generation["code"], lint=False)
+        if self.generated_code != generation["code"]:
+            self._cache_code(generation)
+        return result
+    
+    def _run_and_cache(self, generation: Dict[str, Any]) -> Dict[str, Any]:
+        """执行LLM生成的代码，执行失败时按错误信息修复，执行成功后写入代码缓存"""
         # 使用正则表达式提取代码块
-        self.generated_code = self._extract_code_from_response(raw_content)
+        code = self._extract_code_from_response(self._response_content(generation["response"]))
+        result = self._run_with_repair(generation, code, lint=True)
+        self._cache_code(generation)
+        return result
+    
+    def _cache_code(self, generation: Dict[str, Any]):
+        """把执行成功的代码写入代码缓存"""
+        cache = get_code_cache()
+        if cache is not None and generation.get("cache_key"):
+            cache.put(generation["cache_key"], self.generated_code, generation.get("requirement", ""))
+    
+    def _run_with_repair(self, generation: Dict[str, Any], code: str, lint: bool) -> Dict[str, Any]:
+        """
+        执行分析代码，执行失败时把出错的代码、压缩后的错误信息和相关列发给LLM增量修复，
+        最多修复analysis.repair.max_attempts次，超时和工作进程异常退出不修复
         
-        # 5. 创建临时Python模块并执行代码
-        with tempfile.NamedTemporaryFile(suffix='.py', mode='w', delete=False) as temp_file:
-            temp_file.write(self.generated_code)
-            temp_module_path = temp_file.name
+        Args:
+            generation: 生成结果，包含dfs、requirement，代码生成的提示信息messages用于估算完整重新生成的token数
+            code: 分析代码
+            lint: 是否检查低效写法，LLM新生成和修复的代码需要检查
+            
+        Returns:
+            分析结果字典，键为描述，值为按列组织的数据；执行成功的代码保存在generated_code中
+        """
+        max_attempts = self.config_service.get_config_value('analysis.repair.max_attempts', 2)
+        attempts = 0
+        while True:
+            self.generated_code = code
+            try:
+                if lint:
+                    result = self._execute_generated_code(code, generation["dfs"])
+                else:
+                    result = self._execute_code(code, generation["dfs"])
+            except (SandboxTimeoutError, SandboxWorkerError):
+                if attempts:
+                    code_repair_stats.record_outcome(False)
+                raise
+            except Exception as e:
+                if attempts >= max_attempts:
+                    if attempts:
+                        code_repair_stats.record_outcome(False)
+                    raise
+                attempts += 1
+                logger.warning(f"分析代码执行失败，第{attempts}次按错误信息修复: {str(e)}")
+                try:
+                    code = self._repair_code(generation, code, e)
+                except Exception as repair_error:
+                    code_repair_stats.record_outcome(False)
+                    raise e from repair_error
+                lint = True
+                continue
+            if attempts:
+                code_repair_stats.record_outcome(True)
+            return result
+    
+    def _repair_code(self, generation: Dict[str, Any], code: str, error: Exception) -> str:
+        """
+        请求LLM修复出错的代码，系统指令与代码生成相同以复用服务端的前缀缓存，修复调用不使用响应缓存
         
-        try:
-            # 导入临时模块
-            spec = importlib.util.spec_from_file_location("temp_analysis", temp_module_path)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
+        Args:
+            generation: 生成结果
+            code: 出错的分析代码
+            error: 执行时的异常，沙箱中的异常堆栈在__cause__中
             
-            # 执行分析
-            result = module.analyze_data(dfs)
+        Returns:
+            修复后的代码
+        """
+        cause = error.__cause__
+        traceback_text = cause.tb if isinstance(cause, RemoteTraceback) else "".join(traceback.format_exception(error))
+        error_text = compact_traceback(traceback_text)
+        messages = build_repair_messages(self.SYSTEM_PROMPT, generation.get("requirement", ""), code, error_text,
+                                         relevant_columns(code, error_text, generation["dfs"]))
+        # 同样的错误代码会得到同样的修复提示，不使用响应缓存，避免重复返回已经失败的修复
+        response = self._chat_completion(messages, use_cache=False)
+        
+        # 修复调用和完整重新生成的提示词token数使用同一估算方法，保证两者可比；
+        # 由外部响应构建的生成结果没有代码生成的提示信息，不计入对比
+        repair_tokens = estimate_message_tokens(messages)
+        regeneration_tokens = estimate_message_tokens(generation["messages"]) if generation.get("messages") else None
+        code_repair_stats.record_call(repair_tokens, regeneration_tokens)
+        return self._extract_code_from_response(self._response_content(response))
+    
+    @staticmethod
+    def _invalidate_code(generation: Dict[str, Any], error: Exception):
+        """删除在当前数据上执行失败的缓存代码"""
+        logger.warning(f"缓存的分析代码执行失败，重新生成: {str(error)}")
+        cache = get_code_cache()
+        if cache is not None:
+            cache.invalidate(generation["cache_key"])
+    
+    def _prepare_messages(self, inputs: List[Any], analysis_requirement: str) -> Tuple[List[pd.DataFrame], List[Dict[str, str]]]:
+        """
+        处理输入并构建代码生成的提示信息
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径或DataFrame
+            analysis_requirement: 数据分析需求描述
             
-            # 确保返回的是字典，且值都是DataFrame
-            if not isinstance(result, dict):
-                raise TypeError("分析函数必须返回字典类型的结果")
-            final_result = {}
-            for key, value in result.items():
-                if not isinstance(value, pd.DataFrame):
-                    raise TypeError(f"分析结果'{key}'必须是DataFrame类型")
-                else:
-                    final_result[key]=value.to_dict(orient='list')
-            return final_result
-        finally:
-            # 清理临时文件
-            os.unlink(temp_module_path)
+        Returns:
+            (DataFrame列表, 提示信息)
+        """
+        # 1. 处理输入，转换为准备好的数据集列表，请求流水线准备好的数据集直接使用
+        datasets = self._prepare_inputs(inputs)
+        dfs = [dataset.frame for dataset in datasets]
+        df_names = [dataset.name for dataset in datasets]
+        
+        # 2. 获取所有DataFrame的schema信息
+        schema_infos = [self._get_schema_info(dataset) for dataset in datasets]
+        
+        # 3. 在上下文预算内构建提示信息
+        messages = self._fit_prompt(
+            [schema_section(df_names, schema_infos)],
+            lambda sections: self._build_messages(sections, analysis_requirement)
+        )
+        return dfs, messages
     
-    def _process_inputs(self, inputs: List[Any]) -> Tuple[List[pd.DataFrame], List[str]]:
+    def _build_messages(self, sections: Dict[str, str], analysis_requirement: str) -> List[Dict[str, str]]:
+        """根据预算后的提示词片段构建代码生成的提示信息，静态指令在前、数据信息其次、分析需求最后"""
+        return assemble_messages(
+            self.SYSTEM_PROMPT,
+            [("数据信息", sections["schema"])],
+            "分析需求",
+            analysis_requirement
+        )
+    
+    def _execute_generated_code(self, code: str, dfs: List[pd.DataFrame]) -> Dict[str, Any]:
         """
-        处理输入对象，转换为DataFrame列表
+        执行LLM新生成的代码，检查其中的低效pandas写法并记录估算耗时和实际耗时
+        
+        配置analysis.slow_idioms.rewrite为true且估算耗时不低于rewrite_min_estimated_seconds时，先请求LLM改写为向量化实现，
+        改写结果没有通过检查或执行失败时使用原始代码。执行成功的代码（包括改写后的代码）保存在generated_code中
         
         Args:
-            inputs: 输入对象列表
+            code: 分析代码
+            dfs: 输入的DataFrame列表
             
         Returns:
-            (DataFrame列表, DataFrame名称列表)
-        """
-        dfs = []
-        df_names = []
-        
-        for i, input_obj in enumerate(inputs):
-            if isinstance(input_obj, pd.DataFrame):
-                # 如果输入是DataFrame，直接添加
-                dfs.append(input_obj)
-                df_names.append(f"df_{i}")
-            elif isinstance(input_obj, str):
-                # 如果输入是字符串，尝试作为文件路径加载
+            分析结果字典，键为描述，值为按列组织的数据
+        """
+        if not self.config_service.get_config_value('analysis.slow_idioms.enabled', True):
+            return self._execute_code(code, dfs)
+        idioms = find_slow_idioms(code)
+        slow_idiom_stats.record_check(idioms)
+        if not idioms:
+            return self._execute_code(code, dfs)
+        
+        row_count = sum(len(df) for df in dfs)
+        estimated = estimate_seconds(idioms, row_count)
+        logger.info(f"分析代码存在低效写法，估算耗时{estimated:.2f}秒: " + "；".join(f"第{idiom.lineno}行{idiom.message}" for idiom in idioms))
+        
+        outcome = "flagged"
+        min_seconds = self.config_service.get_config_value('analysis.slow_idioms.rewrite_min_estimated_seconds', 2.0)
+        if self.config_service.get_config_value('analysis.slow_idioms.rewrite', False) and estimated >= min_seconds:
+            rewritten = self._rewrite_slow_code(code, idioms)
+            if rewritten is None:
+                outcome = "rewrite_rejected"
+            else:
+                start = time.perf_counter()
                 try:
-                    data_loader = DataLoader(input_obj)
-                    df = data_loader.load_data()
-                    dfs.append(df)
-                    
-                    # 使用文件名作为DataFrame名称
-                    file_name = os.path.basename(input_obj)
-                    base_name = os.path.splitext(file_name)[0]
-                    df_names.append(base_name)
+                    result = self._execute_code(rewritten, dfs)
                 except Exception as e:
-                    raise ValueError(f"无法从路径加载数据: {input_obj}, 错误: {str(e)}")
-            else:
-                raise TypeError(f"不支持的输入类型: {type(input_obj)}")
-                
-        if not dfs:
-            raise ValueError("没有有效的输入数据")
-            
-        return dfs, df_names
+                    logger.warning(f"改写后的分析代码执行失败，使用原始代码: {str(e)}")
+                    outcome = "rewrite_failed"
+                else:
+                    self.generated_code = rewritten
+                    slow_idiom_stats.record_run(idioms, row_count, estimated, time.perf_counter() - start, "rewritten")
+                    return result
+        
+        start = time.perf_counter()
+        result = self._execute_code(code, dfs)
+        slow_idiom_stats.record_run(idioms, row_count, estimated, time.perf_counter() - start, outcome)
+        return result
     
-    def _get_schema_info(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def _rewrite_slow_code(self, code: str, idioms: List[SlowIdiom]) -> Optional[str]:
         """
-        获取DataFrame的schema信息
+        请求LLM把低效写法改写为向量化实现，提示信息只包含代码和问题列表
+        
+        Returns:
+            改写后的代码；调用失败、没有通过编译检查或低效写法没有减少时返回None
+        """
+        try:
+            response = self._chat_completion(build_rewrite_messages(code, idioms))
+        except Exception as e:
+            logger.warning(f"请求向量化改写失败: {str(e)}")
+            return None
+        rewritten = self._extract_code_from_response(self._response_content(response))
+        try:
+            compile_analysis_code(rewritten)
+        except CodeCheckError as e:
+            logger.warning(f"改写后的分析代码没有通过检查: {str(e)}")
+            return None
+        if len(find_slow_idioms(rewritten)) >= len(idioms):
+            return None
+        return rewritten
+    
+    def _execute_code(self, code: str, dfs: List[pd.DataFrame]) -> Dict[str, Any]:
+        """
+        执行分析代码中的analyze_data函数
         
         Args:
-            df: 输入的DataFrame
+            code: 分析代码
+            dfs: 输入的DataFrame列表
             
         Returns:
-            包含schema信息的字典
-        """
-        schema_info = {
-            "columns": {
-                col: str(df[col].dtype) 
-                for col in df.columns
-            },
-            "row_count": len(df)
-        }
-        return schema_info
+            分析结果字典，键为描述，值为按列组织的数据
+        """
+        # 5. 执行前检查语法和导入，检查不通过时不再传输数据
+        compile_analysis_code(code)
+        
+        # 6. 在沙箱的工作进程中执行代码，未启用沙箱时在当前进程中执行；要求剖析时记录逐行耗时和内存
+        sandbox = get_sandbox()
+        self.execution_profile = None
+        if profiling_requested() or self.config_service.get_config_value('analysis.profiling.enabled', False):
+            result, self.execution_profile = sandbox.run_profiled(code, dfs) if sandbox is not None else profile_analysis_code(code, dfs)
+        else:
+            result = sandbox.run(code, dfs) if sandbox is not None else run_analysis_code(code, dfs)
+        return {key: value.to_dict(orient='list') for key, value in result.items()}
     
     def _extract_code_from_response(self, response_text: str) -> str:
         """
@@ -184,4 +425,4 @@ class DataAnalysisAgent(BaseAgent):
             return max(function_matches, key=len)
         
         # 方法3: 如果上述方法都失败，直接返回原始文本
-        return response_text
\ No newline at end of file
+        return response_text
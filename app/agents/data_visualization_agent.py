@@ -1,19 +1,41 @@
 import os
+import asyncio
 import tempfile
 import importlib.util
-from typing import Any, Dict, Optional, List, Union, Tuple
-import json
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Optional, List, Union, Tuple
 import re
 import pandas as pd
 import uuid
 
 from app.agents.base_agent import BaseAgent
 from app.utils.json_utils import JSONEncoder
+from app.utils.prompt_budget import schema_section, records_section
+from app.utils.prompt_assembly import assemble_messages
 
 
 class DataVisualizationAgent(BaseAgent):
     """数据可视化代理，用于生成基于ECharts的可视化HTML页面"""
     
+    # 静态系统指令，所有请求共享这一前缀
+    SYSTEM_PROMPT = """你是一个数据可视化专家，可以生成基于ECharts的可视化代码。
+请仅返回完整的HTML页面代码，包含必要的ECharts库引用和数据处理逻辑。
+确保生成的代码能够直接在浏览器中运行，不需要额外的依赖。
+请使用提供的完整数据集进行可视化，不要限制数据量。
+
+请基于用户提供的数据信息、数据和可视化需求生成一个完整的HTML页面，使用ECharts库实现可视化。页面应包含：
+1. 必要的HTML结构
+2. ECharts库的引用
+3. 数据处理逻辑
+4. 图表配置和渲染代码
+
+注意：
+- 页面应该是自包含的，不需要额外的依赖
+- 确保代码能够处理提供的数据格式
+- 根据可视化需求选择合适的图表类型
+- 添加适当的标题、图例和交互功能
+- 使用提供的完整数据集，不要限制只使用部分数据"""
+    
     def __init__(self, service_type: Optional[str] = None, model: Optional[str] = None):
         # 调用基类初始化，传入agent_id
         super().__init__(agent_id="data_visualization", service_type=service_type, model=model)
@@ -29,60 +51,84 @@ class DataVisualizationAgent(BaseAgent):
         Returns:
             生成的HTML页面内容
         """
-        # 1. 处理输入，转换为DataFrame列表
-        dfs, df_names = self._process_inputs(inputs)
-        
-        # 2. 获取所有DataFrame的schema信息和完整数据
-        schema_infos = []
-        full_data = []
-        
-        for i, df in enumerate(dfs):
-            schema_infos.append(self._get_schema_info(df))
-            # 使用完整数据而非样本数据
-            full_data.append(df.to_dict(orient='records'))
-        
-        # 3. 构建提示信息
-        messages = [
-            {
-                "role": "system",
-                "content": """你是一个数据可视化专家，可以生成基于ECharts的可视化代码。
-请仅返回完整的HTML页面代码，包含必要的ECharts库引用和数据处理逻辑。
-确保生成的代码能够直接在浏览器中运行，不需要额外的依赖。
-请使用提供的完整数据集进行可视化，不要限制数据量。"""
-            },
-            {
-                "role": "user",
-                "content": f"""
-基于以下信息生成数据可视化HTML页面：
-
-1. 数据信息：
-{json.dumps(list(zip(df_names, schema_infos)), ensure_ascii=False, indent=2,cls=JSONEncoder)}
-
-2. 完整数据：
-{json.dumps(list(zip(df_names, full_data)), ensure_ascii=False, indent=2,cls=JSONEncoder)}
-
-3. 可视化需求：
-{visualization_requirement}
-
-请生成一个完整的HTML页面，使用ECharts库实现可视化。页面应包含：
-1. 必要的HTML结构
-2. ECharts库的引用
-3. 数据处理逻辑
-4. 图表配置和渲染代码
-
-注意：
-- 页面应该是自包含的，不需要额外的依赖
-- 确保代码能够处理提供的数据格式
-- 根据可视化需求选择合适的图表类型
-- 添加适当的标题、图例和交互功能
-- 使用提供的完整数据集，不要限制只使用部分数据
-"""
-            }
-        ]
+        messages = self._prepare_messages(inputs, visualization_requirement)
         
         # 4. 调用LLM生成代码
-        response = self.get_llm_service().chat_completion(messages=messages)
-        raw_content = response['choices'][0]['message']['content']
+        response = self._chat_completion(messages)
+        return self._save_response(response)
+    
+    async def aexecute(self, inputs: List[Any], visualization_requirement: str) -> str:
+        """
+        异步执行数据可视化任务，数据序列化和文件写入在线程池中进行，不阻塞事件循环
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径或DataFrame
+            visualization_requirement: 数据可视化需求描述
+            
+        Returns:
+            生成的HTML页面内容
+        """
+        async with aclosing(self.astream(inputs, visualization_requirement)) as events:
+            async for event in events:
+                if event["type"] == "result":
+                    return event["result"]
+    
+    async def astream(self, inputs: List[Any], visualization_requirement: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        异步流式执行数据可视化任务，依次产生代码生成(codegen)和页面保存(exec)阶段事件，最后产生HTML文件路径
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径或DataFrame
+            visualization_requirement: 数据可视化需求描述
+        """
+        yield self._stage_event("codegen", "start")
+        generation = await self.agenerate(inputs, visualization_requirement)
+        yield self._stage_event("codegen", "end")
+        
+        yield self._stage_event("exec", "start")
+        output_path = await self.afinish(generation)
+        yield self._stage_event("exec", "end")
+        
+        yield {"type": "result", "result": output_path}
+    
+    async def agenerate(self, inputs: List[Any], visualization_requirement: str) -> Dict[str, Any]:
+        """生成可视化HTML但不保存"""
+        messages = await asyncio.to_thread(self._prepare_messages, inputs, visualization_requirement)
+        return {"response": await self._achat_completion(messages)}
+    
+    async def afinish(self, generation: Dict[str, Any]) -> str:
+        """在线程池中保存生成的HTML页面，返回文件路径"""
+        return await asyncio.to_thread(self._save_response, generation["response"])
+    
+    def _prepare_messages(self, inputs: List[Any], visualization_requirement: str) -> List[Dict[str, str]]:
+        """处理输入并构建可视化代码生成的提示信息"""
+        # 1. 处理输入，转换为准备好的数据集列表，请求流水线准备好的数据集直接使用
+        datasets = self._prepare_inputs(inputs)
+        dfs = [dataset.frame for dataset in datasets]
+        df_names = [dataset.name for dataset in datasets]
+        
+        # 2. 获取所有DataFrame的schema信息
+        schema_infos = [self._get_schema_info(dataset) for dataset in datasets]
+        
+        # 3. 在上下文预算内构建提示信息，优先使用完整数据，超出预算时只展示前若干行
+        messages = self._fit_prompt(
+            [schema_section(df_names, schema_infos), records_section(df_names, dfs)],
+            lambda sections: self._build_messages(sections, visualization_requirement)
+        )
+        return messages
+    
+    def _build_messages(self, sections: Dict[str, str], visualization_requirement: str) -> List[Dict[str, str]]:
+        """根据预算后的提示词片段构建可视化代码生成的提示信息，静态指令在前、数据块其次、可视化需求最后"""
+        return assemble_messages(
+            self.SYSTEM_PROMPT,
+            [("数据信息", sections["schema"]), ("完整数据", sections["sample"])],
+            "可视化需求",
+            visualization_requirement
+        )
+    
+    def _save_response(self, response: Dict[str, Any]) -> str:
+        """从LLM响应中提取HTML代码并保存到文件"""
+        raw_content = self._response_content(response)
         
         # 5. 提取HTML代码
         html_code = self._extract_html_from_response(raw_content)
@@ -93,47 +139,6 @@ class DataVisualizationAgent(BaseAgent):
         
         return output_path
     
-    def _process_inputs(self, inputs: List[Any]) -> Tuple[List[pd.DataFrame], List[str]]:
-        """处理输入对象，转换为DataFrame列表"""
-        from app.utils.data_loader import DataLoader
-        
-        dfs = []
-        df_names = []
-        
-        for i, input_obj in enumerate(inputs):
-            if isinstance(input_obj, pd.DataFrame):
-                dfs.append(input_obj)
-                df_names.append(f"df_{i}")
-            elif isinstance(input_obj, str):
-                try:
-                    data_loader = DataLoader(input_obj)
-                    df = data_loader.load_data()
-                    dfs.append(df)
-                    
-                    file_name = os.path.basename(input_obj)
-                    base_name = os.path.splitext(file_name)[0]
-                    df_names.append(base_name)
-                except Exception as e:
-                    raise ValueError(f"无法从路径加载数据: {input_obj}, 错误: {str(e)}")
-            else:
-                raise TypeError(f"不支持的输入类型: {type(input_obj)}")
-                
-        if not dfs:
-            raise ValueError("没有有效的输入数据")
-            
-        return dfs, df_names
-    
-    def _get_schema_info(self, df: pd.DataFrame) -> Dict[str, Any]:
-        """获取DataFrame的schema信息"""
-        schema_info = {
-            "columns": {
-                col: str(df[col].dtype) 
-                for col in df.columns
-            },
-            "row_count": len(df)
-        }
-        return schema_info
-    
     def _get_sample_data(self, df: pd.DataFrame, sample_rows: int = 5) -> Dict[str, List]:
         """获取DataFrame的样本数据"""
         return df.head(sample_rows).to_dict(orient='list')
@@ -204,4 +209,4 @@ class DataVisualizationAgent(BaseAgent):
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(html_code)
         
-        return file_path
\ No newline at end of file
+        return file_path
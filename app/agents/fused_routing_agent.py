@@ -0,0 +1,177 @@
+import re
+import json
+import asyncio
+import threading
+from typing import Any, Dict, Optional, List
+
+from app.agents.base_agent import BaseAgent
+from app.agents.user_intent_agent import UserIntentAgent
+from app.agents.data_analysis_agent import DataAnalysisAgent
+from app.agents.data_visualization_agent import DataVisualizationAgent
+from app.agents.data_analysis_plan_agent import DataAnalysisPlanAgent
+from app.agents.data_analysis_conclusion_agent import DataAnalysisConclusionAgent
+from app.utils.prompt_budget import schema_section, stats_section, records_section
+from app.utils.prompt_assembly import assemble_messages
+from app.utils.token_utils import estimate_message_tokens
+
+# 信封头部，包含识别出的任务类型，之后是该任务的输出
+ROUTE_PATTERN = re.compile(r'<route>\s*(\{[\s\S]*?\})\s*</route>')
+
+
+class FusedRoutingStats:
+    """融合路由统计：信封有效、信封无效和因提示词过长未调用的次数，后两种情况回退到两次调用"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._stats = {"accepted": 0, "rejected": 0, "skipped": 0}
+    
+    def record(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+        
+        Returns:
+            计数和accept_rate（信封有效次数/实际调用次数）
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        calls = stats["accepted"] + stats["rejected"]
+        stats["accept_rate"] = stats["accepted"] / calls if calls else None
+        return stats
+
+
+fused_routing_stats = FusedRoutingStats()
+
+
+class FusedRoutingAgent(BaseAgent):
+    """
+    融合路由代理：一次LLM调用同时识别用户意图并生成对应代理的输出
+    
+    输出以<route>信封开头，信封中的JSON给出任务类型，之后是该任务的输出，格式与对应代理的输出一致。
+    本代理只负责校验信封，执行代码、保存文件等后续处理仍由对应代理的afinish完成。
+    提示词需要同时包含所有任务用到的数据块，超过intent.fused.max_prompt_tokens时不调用LLM，由调用方回退到两次调用
+    """
+    
+    # 各任务的输出要求直接复用专用代理的系统指令，保持两种模式的生成内容一致
+    SYSTEM_PROMPT = f"""你是一个数据分析助手。请先判断用户需求属于以下哪一类任务，再直接完成该任务。
+
+输出格式：
+第一行输出<route>{{"agent_type": "任务类型", "confidence": 0到1之间的置信度, "explanation": "简短解释"}}</route>
+从第二行开始输出该任务要求的内容，不要输出其他任务的内容。
+
+## data_analysis - 数据分析任务：执行数据分析、统计计算、相关性分析、聚类分析等
+{DataAnalysisAgent.SYSTEM_PROMPT}
+
+## data_visualization - 数据可视化任务：生成图表、绘制可视化效果等
+{DataVisualizationAgent.SYSTEM_PROMPT}
+
+## data_analysis_plan - 数据分析方案：生成数据分析方案、分析思路、分析步骤等
+{DataAnalysisPlanAgent.SYSTEM_PROMPT}
+
+## data_analysis_conclusion - 数据分析结论：生成数据分析结论、见解、洞察、趋势总结等
+{DataAnalysisConclusionAgent.SYSTEM_PROMPT}"""
+    
+    SCHEMA_FIELDS = ("columns", "row_count", "sample_data")
+    
+    def __init__(self, service_type: Optional[str] = None, model: Optional[str] = None):
+        # 调用基类初始化，传入agent_id
+        super().__init__(agent_id="fused_routing", service_type=service_type, model=model)
+    
+    def execute(self, inputs: List[Any], user_prompt: str) -> Optional[Dict[str, Any]]:
+        """
+        执行融合路由
+        
+        Args:
+            inputs: 输入对象列表，可以是文件路径、DataFrame或PreparedDataset
+            user_prompt: 用户输入的提示文本
+        
+        Returns:
+            {"intent": 意图识别结果, "response": 只包含任务输出的LLM响应}，提示词过长或信封无效时返回None
+        """
+        messages = self._prepare_messages(inputs, user_prompt)
+        if not self._within_limit(messages):
+            return None
+        return self._parse_envelope(self._chat_completion(messages), user_prompt)
+    
+    async def aexecute(self, inputs: List[Any], user_prompt: str) -> Optional[Dict[str, Any]]:
+        """异步执行融合路由，参数和返回值与execute一致"""
+        messages = await asyncio.to_thread(self._prepare_messages, inputs, user_prompt)
+        if not self._within_limit(messages):
+            return None
+        return self._parse_envelope(await self._achat_completion(messages), user_prompt)
+    
+    def _within_limit(self, messages: List[Dict[str, str]]) -> bool:
+        """提示词是否在intent.fused.max_prompt_tokens以内，超出时记为skipped"""
+        max_tokens = self.config_service.get_config_value('intent.fused.max_prompt_tokens', 16000)
+        if estimate_message_tokens(messages) <= max_tokens:
+            return True
+        fused_routing_stats.record("skipped")
+        return False
+    
+    def _prepare_messages(self, inputs: List[Any], user_prompt: str) -> List[Dict[str, str]]:
+        """构建融合路由的提示信息，数据块包含各任务需要的schema、统计摘要和数据"""
+        datasets = self._prepare_inputs(inputs)
+        dfs = [dataset.frame for dataset in datasets]
+        df_names = [dataset.name for dataset in datasets]
+        schema_infos = [self._get_schema_info(dataset) for dataset in datasets]
+        stat_summaries = [dataset.profile.statistical_summary() for dataset in datasets]
+        
+        # 在上下文预算内构建提示信息，数据最先降级，其次是统计摘要
+        return self._fit_prompt(
+            [schema_section(df_names, schema_infos), stats_section(df_names, stat_summaries), records_section(df_names, dfs)],
+            lambda sections: self._build_messages(sections, user_prompt)
+        )
+    
+    def _build_messages(self, sections: Dict[str, str], user_prompt: str) -> List[Dict[str, str]]:
+        """根据预算后的提示词片段构建提示信息，静态指令在前、数据块其次、用户需求最后"""
+        return assemble_messages(
+            self.SYSTEM_PROMPT,
+            [("数据信息", sections["schema"]), ("统计摘要", sections["stats"]), ("完整数据", sections["sample"])],
+            "用户需求",
+            user_prompt
+        )
+    
+    def _parse_envelope(self, response: Dict[str, Any], user_prompt: str) -> Optional[Dict[str, Any]]:
+        """
+        校验LLM返回的信封，拆分出意图识别结果和任务输出
+        
+        信封缺失、JSON无效、任务类型未知或没有任务输出时返回None
+        """
+        content = self._response_content(response)
+        match = ROUTE_PATTERN.search(content)
+        header = None
+        if match:
+            try:
+                header = json.loads(match.group(1))
+            except json.JSONDecodeError:
+                header = None
+        body = content[match.end():].strip() if match else ""
+        if not isinstance(header, dict) or header.get("agent_type") not in UserIntentAgent.AGENT_TYPES or not body:
+            fused_routing_stats.record("rejected")
+            return None
+        fused_routing_stats.record("accepted")
+        
+        try:
+            confidence = float(header.get("confidence", 0.0))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        choice = response["choices"][0]
+        return {
+            "intent": {
+                "agent_type": header["agent_type"],
+                "confidence": confidence,
+                "explanation": header.get("explanation", ""),
+                "source": "fused",
+                "user_prompt": user_prompt
+            },
+            # 替换回答内容为任务输出，对应代理按自己的LLM响应处理
+            "response": dict(response, choices=[dict(choice, message=dict(choice["message"], content=body))])
+        }
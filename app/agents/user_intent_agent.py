@@ -1,64 +1,51 @@
+import os
 import re
+import threading
 from typing import Any, Dict, Optional, List, Tuple
 
 from app.agents.base_agent import BaseAgent
+from app.services.config_service import ConfigService
+from app.services.intent_classifier import LocalIntentClassifier
+from app.utils.prompt_budget import text_section
+from app.utils.prompt_assembly import assemble_messages
+from app.utils.file_utils import get_project_root
 
 class UserIntentAgent(BaseAgent):
     """用户意图识别代理，用于识别用户输入并确定需要调用的代理类型"""
     
-    # 已开发的代理类型
+    # 已开发的代理类型，keywords同时用于规则匹配备选方案和本地分类器，
+    # local_keywords是只用于本地分类器的补充关键词，不改变规则匹配按keywords数量归一化的得分
     AGENT_TYPES = {
         "data_analysis": {
             "name": "数据分析代理",
             "description": "执行数据分析任务，生成分析结果",
-            "keywords": ["分析", "统计", "计算", "相关性", "聚类", "回归", "预测", "分组", "汇总", "平均", "求和"]
+            "keywords": ["分析", "统计", "计算", "相关性", "聚类", "回归", "预测", "分组", "汇总", "平均", "求和"],
+            "local_keywords": ["占比", "排名", "对比", "增长率", "筛选", "最高", "最低"]
         },
         "data_visualization": {
             "name": "数据可视化代理",
             "description": "生成数据可视化图表，创建可视化HTML页面",
-            "keywords": ["可视化", "图表", "绘制", "画图", "柱状图", "折线图", "饼图", "散点图", "热力图", "展示"]
+            "keywords": ["可视化", "图表", "绘制", "画图", "柱状图", "折线图", "饼图", "散点图", "热力图", "展示"],
+            "local_keywords": ["趋势图", "分布图", "直方图", "雷达图", "画出", "画个", "画一个"]
         },
         "data_analysis_plan": {
             "name": "数据分析方案生成代理",
             "description": "根据数据信息和分析需求，生成合适的数据分析方案",
-            "keywords": ["方案", "计划", "建议", "步骤", "流程", "思路", "策略", "规划", "设计", "指导"]
+            "keywords": ["方案", "计划", "建议", "步骤", "流程", "思路", "策略", "规划", "设计", "指导"],
+            "local_keywords": ["分析方案", "分析思路", "分析步骤", "分析框架", "分析方法", "怎么分析", "如何分析", "哪些分析"]
         },
         "data_analysis_conclusion": {
             "name": "数据分析结论代理",
             "description": "根据数据生成分析结论和见解",
-            "keywords": ["结论", "见解", "洞察", "发现", "总结", "趋势", "特点", "规律", "意义", "启示", "解读"]
+            "keywords": ["结论", "见解", "洞察", "发现", "总结", "趋势", "特点", "规律", "意义", "启示", "解读"],
+            "local_keywords": ["分析结论", "结论和建议", "说明了什么", "反映出"]
         }
     }
     
-    def __init__(self, service_type: Optional[str] = None, model: Optional[str] = None):
-        # 调用基类初始化，传入agent_id
-        super().__init__(agent_id="user_intent", service_type=service_type, model=model)
-    
-    def execute(self, inputs: List[Any], user_prompt: str) -> Dict[str, Any]:
-        """
-        执行用户意图识别
-        
-        Args:
-            inputs: 输入对象列表（在意图识别阶段不使用）
-            user_prompt: 用户输入的提示文本
-            
-        Returns:
-            包含识别结果的字典
-        """
-        # 构建提示信息
-        messages = [
-            {
-                "role": "system",
-                "content": """你是一个用户意图识别专家，能够准确理解用户的需求并分类。
+    # 静态系统指令，所有请求共享这一前缀
+    SYSTEM_PROMPT = """你是一个用户意图识别专家，能够准确理解用户的需求并分类。
 请分析用户输入，判断用户想要执行的是数据分析任务、数据可视化任务、数据分析方案还是数据分析结论。
-只返回一个JSON格式的结果，包含agent_type和confidence字段。"""
-            },
-            {
-                "role": "user",
-                "content": f"""
-请分析以下用户输入，判断用户想要执行的任务类型：
-
-用户输入: "{user_prompt}"
+只返回一个JSON格式的结果，包含agent_type和confidence字段。
 
 可选的任务类型:
 1. data_analysis - 数据分析任务：执行数据分析、统计计算、相关性分析、聚类分析等
@@ -71,14 +58,119 @@ class UserIntentAgent(BaseAgent):
 2. confidence: 置信度，0到1之间的小数
 3. explanation: 简短解释为什么选择这个任务类型
 
-只返回JSON格式的结果，不要有其他文字。
-"""
-            }
-        ]
+只返回JSON格式的结果，不要有其他文字。"""
+    
+    # 本地意图分类器，所有实例共享，相关配置变化时重建
+    _local_classifier: Optional[LocalIntentClassifier] = None
+    _local_classifier_key: Optional[Tuple] = None
+    _local_classifier_lock = threading.Lock()
+    
+    def __init__(self, service_type: Optional[str] = None, model: Optional[str] = None):
+        # 调用基类初始化，传入agent_id
+        super().__init__(agent_id="user_intent", service_type=service_type, model=model)
+    
+    def execute(self, inputs: List[Any], user_prompt: str, local_prediction: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        执行用户意图识别
+        
+        Args:
+            inputs: 输入对象列表（在意图识别阶段不使用）
+            user_prompt: 用户输入的提示文本
+            local_prediction: 调用方已经得到的本地分类结果，为None时由本地分类器预测
+        
+        Returns:
+            包含识别结果的字典
+        """
+        result = self.local_intent(user_prompt, local_prediction)
+        if result:
+            return result
         
-        # 调用LLM进行意图识别
-        response = self.get_llm_service().chat_completion(messages=messages)
-        raw_content = response['choices'][0]['message']['content']
+        messages = self._build_messages(user_prompt)
+        
+        # 本地置信度不足时调用LLM进行意图识别
+        response = self._chat_completion(messages)
+        return self._parse_response(response, user_prompt)
+    
+    async def aexecute(self, inputs: List[Any], user_prompt: str, local_prediction: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        异步执行用户意图识别，等待LLM响应期间不阻塞事件循环
+        
+        Args:
+            inputs: 输入对象列表（在意图识别阶段不使用）
+            user_prompt: 用户输入的提示文本
+            local_prediction: 调用方已经得到的本地分类结果，为None时由本地分类器预测
+        
+        Returns:
+            包含识别结果的字典
+        """
+        result = self.local_intent(user_prompt, local_prediction)
+        if result:
+            return result
+        
+        messages = self._build_messages(user_prompt)
+        response = await self._achat_completion(messages)
+        return self._parse_response(response, user_prompt)
+    
+    @classmethod
+    def get_local_classifier(cls) -> Optional[LocalIntentClassifier]:
+        """
+        获取本地意图分类器，配置intent.local_classifier.enabled为false时返回None，相对的model_path基于项目根目录
+        
+        Returns:
+            共享的本地意图分类器
+        """
+        settings = ConfigService().get_config_value('intent.local_classifier', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        calibration = settings.get('calibration')
+        model_path = settings.get('model_path')
+        if model_path and not os.path.isabs(model_path):
+            model_path = os.path.join(get_project_root(), model_path)
+        key = (tuple(calibration) if calibration else None, model_path, settings.get('model_weight', 0.5))
+        with cls._local_classifier_lock:
+            if cls._local_classifier is None or cls._local_classifier_key != key:
+                cls._local_classifier = LocalIntentClassifier(cls.AGENT_TYPES, calibration=key[0], model_path=key[1], model_weight=key[2])
+                cls._local_classifier_key = key
+            return cls._local_classifier
+    
+    def local_intent(self, user_prompt: str, prediction: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        使用本地分类器识别意图，置信度达到阈值时直接返回结果，不调用LLM
+        
+        Args:
+            user_prompt: 用户输入的提示文本
+            prediction: 已经得到的本地分类结果
+        
+        Returns:
+            识别结果，本地置信度不足或未启用本地分类器时返回None
+        """
+        classifier = self.get_local_classifier()
+        if classifier is None:
+            return None
+        prediction = prediction or classifier.predict(user_prompt)
+        threshold = self.config_service.get_config_value('intent.local_classifier.threshold', 0.8)
+        if prediction['confidence'] < threshold:
+            return None
+        classifier.record_accepted()
+        return {
+            "agent_type": prediction['agent_type'],
+            "confidence": prediction['confidence'],
+            "explanation": prediction['explanation'],
+            "source": "local",
+            "user_prompt": user_prompt
+        }
+    
+    def _build_messages(self, user_prompt: str) -> List[Dict[str, str]]:
+        """在上下文预算内构建意图识别的提示信息，超长的用户输入会被截断"""
+        return self._fit_prompt([text_section("question", user_prompt)], self._render_messages)
+    
+    def _render_messages(self, sections: Dict[str, str]) -> List[Dict[str, str]]:
+        """根据预算后的提示词片段构建意图识别的提示信息，用户输入放在最后"""
+        return assemble_messages(self.SYSTEM_PROMPT, [], "用户输入", sections["question"])
+    
+    def _parse_response(self, response: Dict[str, Any], user_prompt: str) -> Dict[str, Any]:
+        """解析LLM返回的意图识别结果"""
+        raw_content = self._response_content(response)
         
         # 提取JSON结果
         result = self._extract_json_from_response(raw_content)
@@ -86,6 +178,9 @@ class UserIntentAgent(BaseAgent):
         # 如果LLM未返回有效结果，使用规则匹配作为备选方案
         if not result or 'agent_type' not in result:
             result = self._rule_based_intent_recognition(user_prompt)
+            result['source'] = "rules"
+        else:
+            result['source'] = "llm"
         
         # 添加原始用户输入到结果中
         result['user_prompt'] = user_prompt
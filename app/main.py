@@ -1,21 +1,40 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 import os
 import uuid
+import asyncio
+import threading
 import pandas as pd
-from typing import Dict, List, Any, Optional
+from contextlib import aclosing
+from typing import Dict, List, Any, Optional, Tuple
 import json
 
 from app.agents.user_intent_agent import UserIntentAgent
 from app.agents.data_analysis_agent import DataAnalysisAgent
 from app.agents.data_visualization_agent import DataVisualizationAgent
+from app.agents.data_analysis_plan_agent import DataAnalysisPlanAgent
 # 在适当的位置添加导入语句
 from app.agents.data_analysis_conclusion_agent import DataAnalysisConclusionAgent
+from app.agents.fused_routing_agent import FusedRoutingAgent, fused_routing_stats
 
 from app.utils.data_loader import DataLoader
+from app.utils.json_utils import JSONEncoder
 from app.services.session_service import SessionService  # 导入会话服务
+from app.services.config_service import ConfigService
+from app.services.llm_service_factory import LLMServiceFactory
+from app.utils.prompt_budget import prompt_budget_metrics
+from app.utils.prepared_dataset import PreparedDataset, get_profile_cache, prepare_frames
+from app.utils.stage_timer import StageTimer
+from app.services.llm_metrics import llm_metrics
+from app.services.intent_classifier import collect_history_samples
+from app.services.speculation import SpeculativeGeneration, speculation_stats, start_speculation
+from app.services.code_cache import get_code_cache
+from app.services.code_sandbox import get_sandbox, shutdown_sandbox
+from app.utils.pandas_idioms import slow_idiom_stats
+from app.utils.code_profiler import request_profiling
+from app.utils.code_repair import code_repair_stats
 
 app = FastAPI()
 
@@ -45,6 +64,29 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 # 初始化会话服务
 session_service = SessionService(DATA_DIR)
 
+@app.on_event("startup")
+async def warmup_llm_services():
+    """启动时在后台预热LLM服务连接池，避免首个请求承担TCP+TLS握手开销"""
+    if ConfigService().get_config_value("llm.http.warmup", True):
+        threading.Thread(target=LLMServiceFactory.warmup_services, daemon=True).start()
+
+@app.on_event("startup")
+async def warmup_code_sandbox():
+    """启动时在后台创建分析代码沙箱的工作进程"""
+    sandbox = get_sandbox()
+    if sandbox is not None:
+        threading.Thread(target=sandbox.start, daemon=True).start()
+
+@app.on_event("shutdown")
+async def close_llm_services():
+    """关闭时释放LLM服务的连接池"""
+    await LLMServiceFactory.aclose_services()
+
+@app.on_event("shutdown")
+async def close_code_sandbox():
+    """关闭时停止分析代码沙箱的工作进程"""
+    shutdown_sandbox()
+
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...), session_id: str = Form(...)):
     """上传数据文件"""
@@ -84,17 +126,8 @@ async def upload_file(file: UploadFile = File(...), session_id: str = Form(...))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"无法加载数据: {str(e)}")
 
-@app.post("/api/analyze")
-async def analyze_data(request: Dict[str, Any]):
-    """处理用户分析请求"""
-    session_id = request.get("session_id")
-    user_prompt = request.get("prompt")
-    selected_datasets = request.get("selected_datasets", [])
-    
-    if not session_id or not user_prompt:
-        raise HTTPException(status_code=400, detail="缺少必要参数")
-    
-    # 获取选中的数据集
+def _load_selected_inputs(session_id: str, selected_datasets: List[str]) -> List[pd.DataFrame]:
+    """加载会话中选中的数据集"""
     inputs = []
     datasets = session_service.get_datasets(session_id)
     
@@ -118,80 +151,81 @@ async def analyze_data(request: Dict[str, Any]):
                     # 如果是之前分析生成的DataFrame
                     df = pd.DataFrame(dataset["data"])
                     inputs.append(df)
-    
-    if not inputs:
-        raise HTTPException(status_code=400, detail="未选择有效的数据集")
-    
-    # 1. 使用UserIntentAgent确定用户意图
-    user_intent_agent = UserIntentAgent()
-    intent_result = user_intent_agent.execute(inputs, user_prompt)
-    
-    # 添加意图识别结果日志输出
-    print(f"用户意图识别结果: agent_type={intent_result.get('agent_type', 'unknown')}, confidence={intent_result.get('confidence', 0)}")
-    if 'explanation' in intent_result:
-        print(f"解释: {intent_result['explanation']}")
-    
-    # 记录到历史
-    message_id = str(uuid.uuid4())
-    user_message = {
-        "id": message_id,
-        "role": "user",
-        "content": user_prompt
+    return inputs
+
+# 意图类型与代理类的映射
+AGENT_CLASSES = {
+    "data_analysis": DataAnalysisAgent,
+    "data_visualization": DataVisualizationAgent,
+    "data_analysis_plan": DataAnalysisPlanAgent,
+    "data_analysis_conclusion": DataAnalysisConclusionAgent,
+}
+
+def _save_analysis_results(session_id: str, analysis_results: Dict[str, Any], generated_code: str,
+                           execution_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """保存分析结果数据集并记录到会话历史，要求剖析时历史中同时记录代码执行的剖析结果"""
+    result_datasets = {}
+    for key, df_data in analysis_results.items():
+        dataset_id = str(uuid.uuid4())
+        # 将列表数据转换回DataFrame以获取预览
+        df = pd.DataFrame(df_data)
+        dataset_info = {
+            "name": key,
+            "type": "generated",
+            "data": df_data,
+            "preview": df.head(5).to_dict(orient="records")
+        }
+        session_service.add_dataset(session_id, dataset_id, dataset_info)
+        result_datasets[dataset_id] = dataset_info
+    
+    # 添加系统回复到历史
+    assistant_message = {
+        "id": str(uuid.uuid4()),
+        "role": "assistant",
+        "content": "已完成数据分析",
+        "result_type": "analysis",
+        "datasets": result_datasets,
+        "generated_code": generated_code  # 添加生成的代码
     }
-    session_service.add_history(session_id, user_message)
+    if execution_profile is not None:
+        assistant_message["execution_profile"] = execution_profile
+    session_service.add_history(session_id, assistant_message)
+    return result_datasets
+
+def _persist_agent_result(session_id: str, agent_type: str, agent: Any, result: Any) -> Dict[str, Any]:
+    """
+    保存代理执行结果并记录到会话历史
     
-    # 2. 根据意图调用相应的Agent
-    agent_type = intent_result.get("agent_type")
+    Args:
+        session_id: 会话ID
+        agent_type: 代理类型
+        agent: 执行任务的代理实例
+        result: 代理的执行结果
     
-    # 在处理分析请求的部分
+    Returns:
+        接口返回结果
+    """
     if agent_type == "data_analysis":
-        # 数据分析
-        data_analysis_agent = DataAnalysisAgent()
-        analysis_results = data_analysis_agent.execute(inputs, user_prompt)
-        
         # 使用保存的生成代码
-        generated_code = data_analysis_agent.generated_code
+        generated_code = agent.generated_code
         
         # 保存分析结果
-        result_datasets = {}
-        for key, df_data in analysis_results.items():
-            dataset_id = str(uuid.uuid4())
-            # 将列表数据转换回DataFrame以获取预览
-            df = pd.DataFrame(df_data)
-            dataset_info = {
-                "name": key,
-                "type": "generated",
-                "data": df_data,
-                "preview": df.head(5).to_dict(orient="records")
-            }
-            session_service.add_dataset(session_id, dataset_id, dataset_info)
-            result_datasets[dataset_id] = dataset_info
-        
-        # 添加系统回复到历史
-        assistant_message = {
-            "id": str(uuid.uuid4()),
-            "role": "assistant",
-            "content": "已完成数据分析",
-            "result_type": "analysis",
-            "datasets": result_datasets,
-            "generated_code": generated_code  # 添加生成的代码
-        }
-        session_service.add_history(session_id, assistant_message)
+        execution_profile = agent.execution_profile
+        result_datasets = _save_analysis_results(session_id, result, generated_code, execution_profile)
         
-        return {
+        response = {
             "success": True,
             "result_type": "analysis",
             "datasets": result_datasets,
             "generated_code": generated_code  # 添加生成的代码到返回结果
         }
+        if execution_profile is not None:
+            response["execution_profile"] = execution_profile
+        return response
     
     elif agent_type == "data_visualization":
-        # 数据可视化
-        data_viz_agent = DataVisualizationAgent()
-        viz_path = data_viz_agent.execute(inputs, user_prompt)
-        
         # 生成可访问的URL
-        viz_filename = os.path.basename(viz_path)
+        viz_filename = os.path.basename(result)
         viz_url = f"/static/visualizations/{viz_filename}"
         print(f"生成的可视化URL: {viz_url}")
         
@@ -212,16 +246,11 @@ async def analyze_data(request: Dict[str, Any]):
         }
     
     elif agent_type == "data_analysis_plan":
-        # 数据分析方案生成
-        from app.agents.data_analysis_plan_agent import DataAnalysisPlanAgent
-        plan_agent = DataAnalysisPlanAgent()
-        plan_result = plan_agent.execute(inputs, user_prompt)
-        
         # 添加系统回复到历史
         assistant_message = {
             "id": str(uuid.uuid4()),
             "role": "assistant",
-            "content": plan_result["plan"],
+            "content": result["plan"],
             "result_type": "analysis_plan"
         }
         session_service.add_history(session_id, assistant_message)
@@ -229,21 +258,15 @@ async def analyze_data(request: Dict[str, Any]):
         return {
             "success": True,
             "result_type": "analysis_plan",
-            "plan": plan_result["plan"]
+            "plan": result["plan"]
         }
     
-    # 在现有的agent_type判断逻辑中添加新的代理类型处理    
-    # 在处理agent_type的条件分支中添加新的分支
     elif agent_type == "data_analysis_conclusion":
-        # 数据分析结论生成
-        conclusion_agent = DataAnalysisConclusionAgent()
-        conclusion_result = conclusion_agent.execute(inputs, user_prompt)
-        
         # 添加系统回复到历史
         assistant_message = {
             "id": str(uuid.uuid4()),
             "role": "assistant",
-            "content": conclusion_result["conclusion"],
+            "content": result["conclusion"],
             "result_type": "analysis_conclusion"
         }
         session_service.add_history(session_id, assistant_message)
@@ -251,7 +274,7 @@ async def analyze_data(request: Dict[str, Any]):
         return {
             "success": True,
             "result_type": "analysis_conclusion",
-            "conclusion": conclusion_result["conclusion"]
+            "conclusion": result["conclusion"]
         }
     
     else:
@@ -271,6 +294,365 @@ async def analyze_data(request: Dict[str, Any]):
             "message": error_message
         }
 
+def _parse_analyze_request(request: Dict[str, Any]):
+    """校验并解析分析请求参数"""
+    session_id = request.get("session_id")
+    user_prompt = request.get("prompt")
+    selected_datasets = request.get("selected_datasets", [])
+    
+    if not session_id or not user_prompt:
+        raise HTTPException(status_code=400, detail="缺少必要参数")
+    
+    # LLM限流队列积压过多时直接拒绝，避免请求长时间排队
+    if LLMServiceFactory.is_overloaded():
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试", headers={"Retry-After": "5"})
+    return session_id, user_prompt, selected_datasets
+
+async def _recognize_intent(user_prompt: str, local_prediction: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """识别用户意图，local_prediction为已经得到的本地分类结果"""
+    user_intent_agent = UserIntentAgent()
+    intent_result = await user_intent_agent.aexecute([], user_prompt, local_prediction)
+    
+    # 添加意图识别结果日志输出
+    print(f"用户意图识别结果: agent_type={intent_result.get('agent_type', 'unknown')}, confidence={intent_result.get('confidence', 0)}")
+    if 'explanation' in intent_result:
+        print(f"解释: {intent_result['explanation']}")
+    return intent_result
+
+def _record_user_message(session_id: str, user_prompt: str, intent_result: Dict[str, Any]):
+    """将用户消息和识别出的意图记录到历史"""
+    user_message = {
+        "id": str(uuid.uuid4()),
+        "role": "user",
+        "content": user_prompt,
+        # 由LLM识别的意图会作为本地意图分类模型的训练样本
+        "intent": {
+            "agent_type": intent_result.get("agent_type"),
+            "confidence": intent_result.get("confidence"),
+            "source": intent_result.get("source")
+        }
+    }
+    session_service.add_history(session_id, user_message)
+
+# 后台执行的预计算任务，保留引用避免任务在完成前被回收
+_background_tasks = set()
+
+def _warm_profiles(datasets: List[PreparedDataset], timer: StageTimer):
+    """预先计算数据集的统计摘要，在线程池中执行；同一数据集之前已经计算过时直接返回"""
+    with timer.stage("profile"):
+        for dataset in datasets:
+            dataset.profile.warm()
+
+def _on_background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # 预计算失败时代理会在使用时重新计算并抛出异常，这里只记录
+        print(f"数据集预计算失败: {str(task.exception())}")
+
+def _load_prepared_inputs(session_id: str, selected_datasets: List[str]) -> List[PreparedDataset]:
+    """加载选中的数据集并计算内容指纹和schema"""
+    return prepare_frames(_load_selected_inputs(session_id, selected_datasets))
+
+async def _load_datasets(session_id: str, selected_datasets: List[str], timer: StageTimer) -> List[PreparedDataset]:
+    """
+    加载选中的数据集，加载完成后立即在后台预先计算统计摘要，不等待计算完成
+    
+    数据集信息按内容指纹缓存，同一数据集上的后续问题不再重复计算。
+    代理使用时已经计算好的信息直接复用，正在计算的信息会等待其完成而不会重复计算
+    """
+    datasets = await timer.measure("load", asyncio.to_thread(_load_prepared_inputs, session_id, selected_datasets))
+    if datasets:
+        task = asyncio.create_task(asyncio.to_thread(_warm_profiles, datasets, timer))
+        _background_tasks.add(task)
+        task.add_done_callback(_on_background_task_done)
+    return datasets
+
+async def _prepare_request(session_id: str, user_prompt: str, selected_datasets: List[str], timer: StageTimer,
+                           speculate: bool = False, loaded: Optional[asyncio.Event] = None
+                           ) -> Tuple[List[PreparedDataset], Dict[str, Any], Optional[SpeculativeGeneration]]:
+    """
+    并行执行请求的准备阶段：意图识别的LLM调用进行期间，加载数据集并计算schema和统计摘要，
+    允许推测执行时还会提前运行本地分类器预测的代理的生成阶段
+    
+    没有有效的数据集时取消意图识别并返回空列表，用户消息在数据集和意图都就绪后才记录到历史
+    
+    Args:
+        session_id: 会话ID
+        user_prompt: 用户输入
+        selected_datasets: 选中的数据集ID列表
+        timer: 阶段计时器
+        speculate: 是否允许推测执行，是否实际执行由配置intent.speculation和本地分类结果决定
+        loaded: 数据集加载完成时设置的事件，不等待意图识别
+    
+    Returns:
+        (准备好的数据集列表, 意图识别结果, 推测执行)，推测执行需要交给_execute_agent提交或取消
+    """
+    classifier = UserIntentAgent.get_local_classifier()
+    local_prediction = classifier.predict(user_prompt) if classifier else None
+    intent_task = asyncio.create_task(timer.measure("intent", _recognize_intent(user_prompt, local_prediction)))
+    speculation = None
+    try:
+        datasets = await _load_datasets(session_id, selected_datasets, timer)
+        if loaded is not None:
+            loaded.set()
+        if not datasets:
+            intent_task.cancel()
+            return [], {}, None
+        if speculate:
+            speculation = start_speculation(local_prediction, AGENT_CLASSES, datasets, user_prompt, timer)
+        intent_result = await intent_task
+    except BaseException:
+        intent_task.cancel()
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    await asyncio.to_thread(_record_user_message, session_id, user_prompt, intent_result)
+    return datasets, intent_result, speculation
+
+async def _execute_agent(agent_type: Optional[str], inputs: List[PreparedDataset], user_prompt: str,
+                         speculation: Optional[SpeculativeGeneration], timer: StageTimer) -> Tuple[Any, Any]:
+    """
+    执行意图对应的代理，推测执行的代理与意图一致时直接使用已经生成的结果，否则取消推测并正常执行
+    
+    Returns:
+        (代理实例, 执行结果)，意图无法识别时为(None, None)
+    """
+    if speculation is not None:
+        generation = await speculation.resolve(agent_type)
+        if generation is not None:
+            print(f"推测执行命中: {agent_type}")
+            return speculation.agent, await timer.measure("agent", speculation.agent.afinish(generation))
+    if agent_type not in AGENT_CLASSES:
+        return None, None
+    agent = AGENT_CLASSES[agent_type]()
+    return agent, await timer.measure("agent", agent.aexecute(inputs, user_prompt))
+
+async def _run_fused(session_id: str, user_prompt: str, selected_datasets: List[str],
+                     timer: StageTimer) -> Tuple[List[PreparedDataset], Dict[str, Any], Any, Any]:
+    """
+    融合路由模式：一次LLM调用同时完成意图识别和代理生成，本地只执行对应代理的后续处理
+    
+    融合调用需要数据集信息，因此先加载数据集再调用。本地分类器置信度达到阈值时意图已经确定，直接执行对应代理；
+    提示词过长（数据集较大）或融合调用返回的信封无效时回退到两次调用
+    
+    Returns:
+        (准备好的数据集列表, 意图识别结果, 代理实例, 执行结果)，没有有效的数据集时返回([], {}, None, None)
+    """
+    datasets = await _load_datasets(session_id, selected_datasets, timer)
+    if not datasets:
+        return [], {}, None, None
+    
+    classifier = UserIntentAgent.get_local_classifier()
+    local_prediction = classifier.predict(user_prompt) if classifier else None
+    intent_result = UserIntentAgent().local_intent(user_prompt, local_prediction)
+    routed = None
+    if intent_result is None:
+        routed = await timer.measure("fused", FusedRoutingAgent().aexecute(datasets, user_prompt))
+        if routed is None:
+            print("未使用融合路由结果，回退到两次调用")
+            intent_result = await timer.measure("intent", _recognize_intent(user_prompt, local_prediction))
+        else:
+            intent_result = routed["intent"]
+    await asyncio.to_thread(_record_user_message, session_id, user_prompt, intent_result)
+    
+    agent_type = intent_result.get("agent_type")
+    if routed is None:
+        agent, result = await _execute_agent(agent_type, datasets, user_prompt, None, timer)
+        return datasets, intent_result, agent, result
+    agent = AGENT_CLASSES[agent_type]()
+    result = await timer.measure("agent", agent.afinish(agent.build_generation(datasets, user_prompt, routed["response"])))
+    return datasets, intent_result, agent, result
+
+async def _run_analysis(session_id: str, user_prompt: str, selected_datasets: List[str],
+                        timer: StageTimer) -> Tuple[List[PreparedDataset], Dict[str, Any], Any, Any]:
+    """
+    按配置intent.mode执行分析请求的意图识别和代理执行，不保存结果
+    
+    two_call（默认）先识别意图再调用对应代理，意图识别与数据集加载并行，并按配置推测执行；
+    fused使用一次LLM调用同时完成两者，见_run_fused
+    
+    Returns:
+        (准备好的数据集列表, 意图识别结果, 代理实例, 执行结果)，没有有效的数据集时返回([], {}, None, None)
+    """
+    if ConfigService().get_config_value("intent.mode", "two_call") == "fused":
+        return await _run_fused(session_id, user_prompt, selected_datasets, timer)
+    
+    inputs, intent_result, speculation = await _prepare_request(session_id, user_prompt, selected_datasets, timer, speculate=True)
+    if not inputs:
+        return [], {}, None, None
+    agent, result = await _execute_agent(intent_result.get("agent_type"), inputs, user_prompt, speculation, timer)
+    return inputs, intent_result, agent, result
+
+def _log_timings(timer: StageTimer) -> Dict[str, Any]:
+    """输出并返回各阶段耗时"""
+    timings = timer.snapshot()
+    stages = ", ".join(f"{name}={stage['start']:.3f}-{stage['end']:.3f}s" for name, stage in timings["stages"].items())
+    print(f"请求阶段耗时: {stages}，总耗时={timings['wall_seconds']:.3f}s，并行节省={timings['overlap_seconds']:.3f}s")
+    return timings
+
+@app.post("/api/analyze")
+async def analyze_data(request: Dict[str, Any]):
+    """
+    处理用户分析请求，LLM调用使用异步客户端，磁盘读写和CPU密集的处理在线程池中执行
+    
+    数据集加载和统计摘要计算与意图识别并行进行，返回结果中的timings给出各阶段的起止时间。
+    配置intent.mode为fused时意图识别和代理生成合并为一次LLM调用。
+    请求中profile为true时逐行剖析生成代码的执行，数据分析结果中的execution_profile给出耗时最多的行、内存峰值和中间DataFrame的大小
+    """
+    session_id, user_prompt, selected_datasets = _parse_analyze_request(request)
+    timer = StageTimer()
+    
+    # 1. 确定用户意图并调用相应的Agent
+    with request_profiling(bool(request.get("profile", False))):
+        inputs, intent_result, agent, result = await _run_analysis(session_id, user_prompt, selected_datasets, timer)
+    
+    if not inputs:
+        raise HTTPException(status_code=400, detail="未选择有效的数据集")
+    
+    # 2. 保存结果
+    agent_type = intent_result.get("agent_type")
+    with timer.stage("persist"):
+        response = await asyncio.to_thread(_persist_agent_result, session_id, agent_type, agent, result)
+    response["timings"] = _log_timings(timer)
+    return response
+
+def _format_sse(event: str, data: Any) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, cls=JSONEncoder)}\n\n"
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    响应结束或客户端断开时关闭事件生成器的流式响应
+    
+    客户端断开时Starlette只取消发送任务，不会关闭停在yield处的生成器，
+    其中的LLM流要等到垃圾回收才释放限流许可和连接
+    """
+    
+    async def stream_response(self, send):
+        try:
+            await super().stream_response(send)
+        finally:
+            await self.body_iterator.aclose()
+
+@app.post("/api/analyze/stream")
+async def analyze_data_stream(request: Dict[str, Any]):
+    """
+    以Server-Sent Events流式处理用户分析请求
+    
+    事件类型：
+        stage: 执行阶段变化，data为{"stage": "load|intent|codegen|exec|persist", "status": "start|end"}，
+               load和intent并行执行
+        intent: 意图识别结果
+        token / reasoning: 方案和结论代理生成的内容片段
+        result: 最终结果，与/api/analyze的返回格式一致，包含各阶段耗时timings；
+                请求中profile为true时数据分析结果同样包含execution_profile
+        error: 处理失败，data为{"message": "..."}
+    
+    流式请求总是先识别意图再调用代理，不使用融合路由模式：融合调用的输出在信封校验通过前不能转发给客户端
+    """
+    session_id, user_prompt, selected_datasets = _parse_analyze_request(request)
+    profile = bool(request.get("profile", False))
+    
+    async def event_stream():
+        with request_profiling(profile):
+            try:
+                timer = StageTimer()
+                yield _format_sse("stage", {"stage": "load", "status": "start"})
+                yield _format_sse("stage", {"stage": "intent", "status": "start"})
+                # 流式请求不推测执行：推测的生成不是流式调用，命中时反而推迟首个token
+                loaded = asyncio.Event()
+                prepare_task = asyncio.create_task(_prepare_request(session_id, user_prompt, selected_datasets, timer, loaded=loaded))
+                loaded_task = asyncio.create_task(loaded.wait())
+                try:
+                    # 数据集加载完成时立即发送load结束事件，意图识别仍在进行
+                    await asyncio.wait({prepare_task, loaded_task}, return_when=asyncio.FIRST_COMPLETED)
+                    if loaded.is_set():
+                        yield _format_sse("stage", {"stage": "load", "status": "end"})
+                    inputs, intent_result, _ = await prepare_task
+                finally:
+                    loaded_task.cancel()
+                    prepare_task.cancel()
+                if not inputs:
+                    yield _format_sse("error", {"message": "未选择有效的数据集"})
+                    return
+                yield _format_sse("stage", {"stage": "intent", "status": "end"})
+                yield _format_sse("intent", intent_result)
+                
+                agent_type = intent_result.get("agent_type")
+                agent = None
+                result = None
+                if agent_type in AGENT_CLASSES:
+                    agent = AGENT_CLASSES[agent_type]()
+                    with timer.stage("agent"):
+                        async with aclosing(agent.astream(inputs, user_prompt)) as events:
+                            async for event in events:
+                                if event["type"] == "result":
+                                    result = event["result"]
+                                elif event["type"] == "stage":
+                                    yield _format_sse("stage", {"stage": event["stage"], "status": event["status"]})
+                                else:
+                                    yield _format_sse(event["type"], {"content": event["content"]})
+                
+                yield _format_sse("stage", {"stage": "persist", "status": "start"})
+                with timer.stage("persist"):
+                    response = await asyncio.to_thread(_persist_agent_result, session_id, agent_type, agent, result)
+                yield _format_sse("stage", {"stage": "persist", "status": "end"})
+                response["timings"] = _log_timings(timer)
+                yield _format_sse("result", response)
+            except Exception as e:
+                print(f"流式分析请求处理失败: {str(e)}")
+                yield _format_sse("error", {"message": str(e)})
+        
+    # 关闭代理缓冲，确保每个事件立即送达客户端
+    return ClosingStreamingResponse(event_stream(), media_type="text/event-stream",
+                                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/admin/llm/stats")
+async def get_llm_stats():
+    """获取LLM服务的运行统计，包括响应缓存命中情况、各代理的提示词预算统计、本地意图分类、推测执行、融合路由、数据集信息缓存、生成代码缓存、代码沙箱、低效写法和增量修复统计"""
+    classifier = UserIntentAgent.get_local_classifier()
+    code_cache = get_code_cache()
+    sandbox = get_sandbox()
+    return {
+        "services": LLMServiceFactory.get_stats(),
+        "prompt_budget": prompt_budget_metrics.snapshot(),
+        "intent": classifier.stats() if classifier else None,
+        "speculation": speculation_stats.snapshot(),
+        "fused_routing": fused_routing_stats.snapshot(),
+        "profile_cache": get_profile_cache().get_stats(),
+        "code_cache": code_cache.stats() if code_cache else None,
+        "sandbox": sandbox.stats() if sandbox else None,
+        "slow_idioms": slow_idiom_stats.snapshot(),
+        "code_repair": code_repair_stats.snapshot()
+    }
+
+@app.get("/api/admin/llm/metrics")
+async def get_llm_metrics(agent_id: Optional[str] = None, model: Optional[str] = None):
+    """获取按代理和模型统计的LLM调用指标：排队等待、首token耗时、总耗时的直方图，token数、生成速度和错误分类"""
+    return {"metrics": llm_metrics.snapshot(agent_id=agent_id, model=model)}
+
+@app.delete("/api/admin/llm/metrics")
+async def reset_llm_metrics():
+    """清空LLM调用指标"""
+    llm_metrics.reset()
+    return {"success": True}
+
+@app.post("/api/admin/intent/train")
+async def train_intent_model():
+    """用所有会话中由LLM识别的意图训练本地意图分类模型，需要安装scikit-learn"""
+    classifier = UserIntentAgent.get_local_classifier()
+    if classifier is None:
+        raise HTTPException(status_code=400, detail="本地意图分类器未启用")
+    histories = [session_service.get_history(session["id"]) for session in session_service.list_sessions()]
+    samples = collect_history_samples(histories)
+    try:
+        result = await asyncio.to_thread(classifier.train_model, samples)
+    except ImportError:
+        raise HTTPException(status_code=400, detail="训练意图分类模型需要安装scikit-learn")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, **result}
+
 @app.get("/api/datasets/{session_id}")
 async def get_datasets(session_id: str):
     """获取会话中的数据集列表"""
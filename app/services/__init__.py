@@ -1,5 +1,11 @@
-from app.services.base_llm_service import BaseLLMService
+from app.services.base_llm_service import BaseLLMService, LLMServiceWrapper
 from app.services.silicon_flow_service import SiliconFlowService
+from app.services.llm_cache import LLMResponseCache, CachedLLMService
+from app.services.single_flight import SingleFlightLLMService
+from app.services.rate_limiter import RateLimitedLLMService, ModelRateLimiter, RateLimitTimeoutError
+from app.services.llm_metrics import MetricsLLMService, LLMMetrics, llm_metrics
+from app.services.resilience import ResilientLLMService, CircuitBreaker, CircuitOpenError
 from app.services.llm_service_factory import LLMServiceFactory
+from app.services.replay_service import ReplayLLMService, ReplayMissError
 
-__all__ = ['BaseLLMService', 'SiliconFlowService', 'LLMServiceFactory']
\ No newline at end of file
+__all__ = ['BaseLLMService', 'LLMServiceWrapper', 'SiliconFlowService', 'LLMResponseCache', 'CachedLLMService', 'SingleFlightLLMService', 'RateLimitedLLMService', 'ModelRateLimiter', 'RateLimitTimeoutError', 'MetricsLLMService', 'LLMMetrics', 'llm_metrics', 'ResilientLLMService', 'CircuitBreaker', 'CircuitOpenError', 'LLMServiceFactory', 'ReplayLLMService', 'ReplayMissError']
\ No newline at end of file
@@ -1,11 +1,80 @@
+import time
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Any, Union
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Union, Iterator, AsyncIterator, Iterable
+
+
+def assemble_stream_response(chunks: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    将流式返回的增量数据块合并为与非流式接口一致的完整结果
+    
+    Args:
+        chunks: 流式数据块，格式为{"choices": [{"delta": {"content": "..."}}]}
+        
+    Returns:
+        完整结果，格式为{"choices": [{"message": {"role": "assistant", "content": "..."}}]}
+    """
+    content_parts = []
+    reasoning_parts = []
+    result = {"object": "chat.completion", "choices": []}
+    finish_reason = None
+    
+    for chunk in chunks:
+        for key in ("id", "model", "created", "usage"):
+            if chunk.get(key) is not None:
+                result[key] = chunk[key]
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or choice.get("message") or {}
+            if delta.get("content"):
+                content_parts.append(delta["content"])
+            if delta.get("reasoning_content"):
+                reasoning_parts.append(delta["reasoning_content"])
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+    
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if reasoning_parts:
+        message["reasoning_content"] = "".join(reasoning_parts)
+    result["choices"].append({"index": 0, "message": message, "finish_reason": finish_reason})
+    return result
+
+
+def response_to_stream_chunk(response: Dict[str, Any]) -> Dict[str, Any]:
+    """将完整结果转换为单个流式数据块，用于不支持流式输出的服务"""
+    chunk = {key: value for key, value in response.items() if key != "choices"}
+    chunk["object"] = "chat.completion.chunk"
+    chunk["choices"] = [
+        {
+            "index": choice.get("index", 0),
+            "delta": choice.get("message", {}),
+            "finish_reason": choice.get("finish_reason")
+        }
+        for choice in response.get("choices", [])
+    ]
+    return chunk
+
+
+def _batch_result(index: int, response: Optional[Dict[str, Any]], error: Optional[Exception], latency_seconds: float) -> Dict[str, Any]:
+    """构建批量请求中单项的结果"""
+    return {
+        "index": index,
+        "response": response,
+        "error": str(error) if error is not None else None,
+        "error_type": type(error).__name__ if error is not None else None,
+        "latency_seconds": latency_seconds
+    }
+
 
 class BaseLLMService(ABC):
     """
     大模型服务基类，定义大模型API的通用接口
     """
     
+    # 控制服务行为的调用参数，由服务层自身消费，不会发送给模型接口
+    CONTROL_KWARGS = frozenset({"use_cache", "agent_id"})
+    
     def __init__(self, model: Optional[str] = None):
         """
         初始化大模型服务
@@ -39,4 +108,183 @@ class BaseLLMService(ABC):
         """
         pass
     
-    
\ No newline at end of file
+    async def achat_completion(self, 
+                               messages: List[Dict[str, str]], 
+                               model: Optional[str] = None,
+                               **kwargs) -> Dict[str, Any]:
+        """
+        异步聊天补全API，默认实现在线程池中执行同步的chat_completion，
+        子类可覆盖为原生异步HTTP客户端实现
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+            model: 模型名称，如果为None则使用实例的默认模型
+            **kwargs: 其他参数，与chat_completion一致
+            
+        Returns:
+            API返回结果
+        """
+        return await asyncio.to_thread(self.chat_completion, messages, model, **kwargs)
+    
+    def stream_chat_completion(self, 
+                               messages: List[Dict[str, str]], 
+                               model: Optional[str] = None,
+                               **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        流式聊天补全API，逐个返回增量数据块。默认实现调用chat_completion并一次性返回完整内容，
+        子类可覆盖为真正的流式实现
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+            model: 模型名称，如果为None则使用实例的默认模型
+            **kwargs: 其他参数，与chat_completion一致
+            
+        Returns:
+            增量数据块迭代器，格式为{"choices": [{"delta": {"content": "..."}}]}
+        """
+        yield response_to_stream_chunk(self.chat_completion(messages, model, **kwargs))
+    
+    async def astream_chat_completion(self, 
+                                      messages: List[Dict[str, str]], 
+                                      model: Optional[str] = None,
+                                      **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        异步流式聊天补全API，默认实现调用achat_completion并一次性返回完整内容
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+            model: 模型名称，如果为None则使用实例的默认模型
+            **kwargs: 其他参数，与chat_completion一致
+            
+        Returns:
+            增量数据块异步迭代器，格式为{"choices": [{"delta": {"content": "..."}}]}
+        """
+        yield response_to_stream_chunk(await self.achat_completion(messages, model, **kwargs))
+    
+    def _run_batch_item(self, index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        """执行批量请求中的一项，捕获异常作为该项的结果"""
+        start_time = time.perf_counter()
+        try:
+            response = self.chat_completion(**request)
+            return _batch_result(index, response, None, time.perf_counter() - start_time)
+        except Exception as e:
+            return _batch_result(index, None, e, time.perf_counter() - start_time)
+    
+    def chat_completion_batch(self, requests: List[Dict[str, Any]], max_parallel: int = 4) -> List[Dict[str, Any]]:
+        """
+        并发执行多个互不依赖的聊天补全请求
+        
+        每个请求通过当前服务的chat_completion执行，因此同样经过缓存、限流和重试等包装层。
+        单个请求失败不影响其他请求
+        
+        Args:
+            requests: 请求列表，每项为chat_completion的关键字参数，至少包含messages
+            max_parallel: 最大并发数
+            
+        Returns:
+            与requests顺序一致的结果列表，每项格式为
+            {"index": 0, "response": {...}或None, "error": None或错误信息, "error_type": None或异常类名, "latency_seconds": 1.2}
+        """
+        if not requests:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(requests)))) as executor:
+            return list(executor.map(self._run_batch_item, range(len(requests)), requests))
+    
+    async def achat_completion_batch(self, requests: List[Dict[str, Any]], max_parallel: int = 4) -> List[Dict[str, Any]]:
+        """
+        异步并发执行多个互不依赖的聊天补全请求，参数和返回值与chat_completion_batch一致
+        
+        Args:
+            requests: 请求列表，每项为achat_completion的关键字参数，至少包含messages
+            max_parallel: 最大并发数
+            
+        Returns:
+            与requests顺序一致的结果列表
+        """
+        semaphore = asyncio.Semaphore(max(1, max_parallel))
+        
+        async def _run(index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    response = await self.achat_completion(**request)
+                    return _batch_result(index, response, None, time.perf_counter() - start_time)
+                except Exception as e:
+                    return _batch_result(index, None, e, time.perf_counter() - start_time)
+        
+        return list(await asyncio.gather(*(_run(index, request) for index, request in enumerate(requests))))
+    
+    def warmup(self, connections: Optional[int] = None) -> int:
+        """
+        预热到服务端的连接，默认实现不做任何操作
+        
+        Args:
+            connections: 预热的连接数
+            
+        Returns:
+            成功建立的连接数
+        """
+        return 0
+    
+    def close(self):
+        """释放服务持有的连接等资源，默认实现不做任何操作"""
+        pass
+    
+    async def aclose(self):
+        """释放服务持有的异步连接等资源，默认实现不做任何操作"""
+        pass
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取服务的运行统计信息，默认没有统计项"""
+        return {}
+
+
+class LLMServiceWrapper(BaseLLMService):
+    """
+    LLM服务包装基类，默认将所有调用委托给被包装的服务，
+    缓存、请求合并等包装层只需覆盖需要增强的方法
+    """
+    
+    def __init__(self, service: BaseLLMService):
+        """
+        初始化包装服务
+        
+        Args:
+            service: 被包装的LLM服务
+        """
+        super().__init__(model=service.model)
+        self.service = service
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """委托给被包装服务的聊天补全"""
+        return self.service.chat_completion(messages, model, **kwargs)
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """委托给被包装服务的异步聊天补全"""
+        return await self.service.achat_completion(messages, model, **kwargs)
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """委托给被包装服务的流式聊天补全"""
+        yield from self.service.stream_chat_completion(messages, model, **kwargs)
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """委托给被包装服务的异步流式聊天补全"""
+        async with aclosing(self.service.astream_chat_completion(messages, model, **kwargs)) as stream:
+            async for chunk in stream:
+                yield chunk
+    
+    def warmup(self, connections: Optional[int] = None) -> int:
+        """预热被包装服务的连接"""
+        return self.service.warmup(connections)
+    
+    def close(self):
+        """释放被包装服务的资源"""
+        self.service.close()
+    
+    async def aclose(self):
+        """释放被包装服务的异步资源"""
+        await self.service.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取被包装服务的统计信息"""
+        return self.service.get_stats()
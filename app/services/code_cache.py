@@ -0,0 +1,185 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from typing import Any, Dict, Optional
+
+from app.services.config_service import ConfigService
+from app.utils.file_utils import get_project_root
+from app.utils.logger import setup_logger
+
+logger = setup_logger("code_cache")
+
+# 需求末尾不影响含义的标点
+_TRAILING_PUNCTUATION = "。．.！!？?；;，,～~ "
+
+
+def normalize_requirement(requirement: str) -> str:
+    """
+    规范化分析需求，全角字符转半角、英文转小写、合并空白并去掉末尾标点
+    
+    Args:
+        requirement: 用户的分析需求
+    
+    Returns:
+        规范化后的需求
+    """
+    text = unicodedata.normalize("NFKC", requirement or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def build_code_key(schema_fingerprint: str, requirement: str) -> str:
+    """
+    计算生成代码的缓存键
+    
+    Args:
+        schema_fingerprint: 输入数据集的schema指纹，见prepared_dataset.schema_fingerprint
+        requirement: 分析需求
+    
+    Returns:
+        sha256十六进制摘要
+    """
+    canonical = f"{schema_fingerprint}\n{normalize_requirement(requirement)}"
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class GeneratedCodeCache:
+    """
+    基于SQLite的生成代码缓存，只保存执行成功的分析代码，按条目数LRU淘汰
+    
+    schema（列名和列类型）和规范化后的需求都相同时，之前生成的代码可以直接在新数据上执行，不再调用LLM
+    """
+    
+    def __init__(self, path: str, max_entries: int = 2000):
+        """
+        初始化生成代码缓存
+        
+        Args:
+            path: SQLite数据库文件路径
+            max_entries: 最大缓存条目数
+        """
+        self.path = path
+        self.max_entries = max_entries
+        
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0, "evictions": 0}
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS generated_code (
+                key TEXT PRIMARY KEY,
+                code TEXT NOT NULL,
+                requirement TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generated_code_accessed ON generated_code(accessed_at)")
+        self._conn.commit()
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存的代码
+        
+        Args:
+            key: 缓存键，见build_code_key
+        
+        Returns:
+            缓存的代码，未命中时返回None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT code FROM generated_code WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            # 更新访问时间，用于LRU淘汰
+            self._conn.execute("UPDATE generated_code SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self._stats["hits"] += 1
+        return row[0]
+    
+    def put(self, key: str, code: str, requirement: str) -> None:
+        """
+        写入执行成功的代码并按需淘汰旧条目
+        
+        Args:
+            key: 缓存键
+            code: 生成的代码
+            requirement: 原始分析需求，只用于排查问题
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generated_code (key, code, requirement, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, code, requirement, now, now)
+            )
+            self._stats["writes"] += 1
+            count = self._conn.execute("SELECT COUNT(*) FROM generated_code").fetchone()[0]
+            if count > self.max_entries:
+                cursor = self._conn.execute(
+                    "DELETE FROM generated_code WHERE key IN (SELECT key FROM generated_code ORDER BY accessed_at ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                self._stats["evictions"] += cursor.rowcount
+            self._conn.commit()
+    
+    def invalidate(self, key: str) -> None:
+        """删除在新数据上执行失败的代码"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM generated_code WHERE key = ?", (key,))
+            self._conn.commit()
+            self._stats["invalidations"] += cursor.rowcount
+    
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM generated_code")
+            self._conn.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计和当前条目数"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM generated_code").fetchone()[0]
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = count
+        return stats
+    
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+_code_cache: Optional[GeneratedCodeCache] = None
+_code_cache_lock = threading.Lock()
+
+
+def get_code_cache() -> Optional[GeneratedCodeCache]:
+    """
+    获取共享的生成代码缓存，配置analysis.code_cache.enabled为false时返回None
+    
+    Returns:
+        生成代码缓存实例
+    """
+    global _code_cache
+    config_service = ConfigService()
+    if not config_service.get_config_value('analysis.code_cache.enabled', True):
+        return None
+    
+    with _code_cache_lock:
+        if _code_cache is None:
+            path = config_service.get_config_value('analysis.code_cache.path', 'data/code_cache.sqlite3')
+            if not os.path.isabs(path):
+                path = os.path.join(get_project_root(), path)
+            _code_cache = GeneratedCodeCache(path, max_entries=config_service.get_config_value('analysis.code_cache.max_entries', 2000))
+            logger.info(f"启用生成代码缓存: {path}")
+        return _code_cache
@@ -0,0 +1,460 @@
+import os
+import time
+import queue
+import pickle
+import signal
+import threading
+import traceback
+import multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.services.config_service import ConfigService
+from app.utils.code_compiler import compile_analysis_code, load_entry_point
+from app.utils.code_profiler import profile_call
+from app.utils.columnar import decode_frame, encode_frame
+from app.utils.logger import setup_logger
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不限制CPU时间和内存
+    resource = None
+
+logger = setup_logger("code_sandbox")
+
+
+class SandboxTimeoutError(TimeoutError):
+    """分析代码超过墙钟时间或CPU时间限制"""
+
+
+class SandboxWorkerError(RuntimeError):
+    """执行分析代码的工作进程异常退出，例如被系统因内存不足终止"""
+
+
+class RemoteTraceback(Exception):
+    """工作进程中的异常堆栈，作为重新抛出的异常的__cause__"""
+    
+    def __init__(self, tb: str):
+        super().__init__(tb)
+        self.tb = tb
+    
+    def __str__(self):
+        return self.tb
+
+
+def run_analysis_code(code: str, dfs: List[pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    执行分析代码中的analyze_data函数
+    
+    Args:
+        code: 分析代码
+        dfs: 输入的DataFrame列表
+    
+    Returns:
+        分析结果字典，键为描述，值为DataFrame
+    
+    Raises:
+        CodeCheckError: 代码存在语法错误或没有通过静态检查
+    """
+    # 在内存中编译代码（按源码哈希缓存）并在新的命名空间中执行
+    analyze_data = load_entry_point(compile_analysis_code(code))
+    return _check_result(analyze_data(dfs))
+
+
+def profile_analysis_code(code: str, dfs: List[pd.DataFrame]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Any]]:
+    """
+    执行并逐行剖析分析代码，参数与run_analysis_code一致
+    
+    Returns:
+        (分析结果字典, 剖析结果)，剖析结果格式见LineProfiler.profile
+    """
+    analyze_data = load_entry_point(compile_analysis_code(code))
+    result, profile = profile_call(analyze_data, dfs)
+    return _check_result(result), profile
+
+
+def _check_result(result: Any) -> Dict[str, pd.DataFrame]:
+    """确保返回的是字典，且值都是DataFrame"""
+    if not isinstance(result, dict):
+        raise TypeError("分析函数必须返回字典类型的结果")
+    for key, value in result.items():
+        if not isinstance(value, pd.DataFrame):
+            raise TypeError(f"分析结果'{key}'必须是DataFrame类型")
+    return result
+
+
+def _encode_frames(frames: List[pd.DataFrame]) -> Tuple[List[Dict[str, Any]], List[memoryview]]:
+    """编码DataFrame列表，返回(元数据列表, 缓冲区列表)，缓冲区由调用方在元数据之后发送"""
+    encoded = [encode_frame(df) for df in frames]
+    return [meta for meta, _ in encoded], [buffer for _, buffers in encoded for buffer in buffers]
+
+
+def _recv_frames(conn, metas: List[Dict[str, Any]]) -> List[pd.DataFrame]:
+    """按元数据接收缓冲区并还原DataFrame，缓冲区为可写的bytearray"""
+    frames = []
+    for meta in metas:
+        buffers = []
+        for length in meta["lengths"]:
+            buffer = bytearray(length)
+            if length:
+                conn.recv_bytes_into(buffer)
+            else:
+                conn.recv_bytes()
+            buffers.append(buffer)
+        frames.append(decode_frame(meta, buffers))
+    return frames
+
+
+def _raise_cpu_timeout(signum, frame):
+    raise SandboxTimeoutError("分析代码超过CPU时间限制")
+
+
+def _set_cpu_limit(cpu_seconds: Optional[float]):
+    """把CPU时间软限制设为已用时间加cpu_seconds，超出时收到SIGXCPU；为None时取消限制"""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _set_memory_limit(memory_mb: int):
+    """限制地址空间为当前大小加memory_mb，预加载的pandas等模块不占用分析代码的额度"""
+    if resource is None or memory_mb <= 0:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        current = 0
+    limit = current + memory_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _portable_error(error: Exception) -> Exception:
+    """返回可以在主进程中还原的异常，分析代码中定义的异常类型转换为RuntimeError"""
+    try:
+        return pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(conn, memory_mb: int, cpu_seconds: float):
+    """
+    工作进程主循环：接收代码和数据、在CPU时间限制内执行，按列编码返回结果
+    
+    消息格式：任务为(code, 数据元数据, 是否剖析)，之后是各数据缓冲区；
+    结果为("ok", [(键, 元数据)], 剖析结果或None)加缓冲区，或("error", 异常, 堆栈文本)；
+    数据接收到一半失败时回复("broken", 异常, 堆栈文本)并退出
+    """
+    _set_memory_limit(memory_mb)
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _raise_cpu_timeout)
+    
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        
+        code, metas, profile = job
+        try:
+            dfs = _recv_frames(conn, metas)
+        except Exception as e:
+            # 管道中可能残留未读取的缓冲区，会被当作下一个任务读取，由主进程替换本进程
+            conn.send(("broken", _portable_error(e), traceback.format_exc()))
+            break
+        
+        try:
+            _set_cpu_limit(cpu_seconds)
+            try:
+                if profile:
+                    result, profile = profile_analysis_code(code, dfs)
+                else:
+                    result = run_analysis_code(code, dfs)
+            finally:
+                _set_cpu_limit(None)
+            keys = list(result.keys())
+            metas, buffers = _encode_frames([result[key] for key in keys])
+        except Exception as e:
+            conn.send(("error", _portable_error(e), traceback.format_exc()))
+            continue
+        
+        conn.send(("ok", list(zip(keys, metas)), profile or None))
+        for buffer in buffers:
+            conn.send_bytes(buffer)
+
+
+class _Worker:
+    """一个预热的工作进程及其通信管道"""
+    
+    def __init__(self, context, memory_mb: int, cpu_seconds: float):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_mb, cpu_seconds), name="analysis-sandbox", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+    
+    def alive(self) -> bool:
+        return self.process.is_alive()
+    
+    def kill(self):
+        """强制终止工作进程"""
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+    
+    def stop(self):
+        """通知工作进程退出，超时未退出时强制终止"""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        self.conn.close()
+
+
+class CodeSandbox:
+    """
+    分析代码沙箱：在预热的工作进程池中执行LLM生成的代码，与API进程隔离
+    
+    每个任务有墙钟时间和CPU时间限制，工作进程的地址空间限制为预加载模块之外再加memory_mb。
+    死循环、内存耗尽等问题只影响执行任务的工作进程，超时或异常退出的工作进程被终止后按需重新创建。
+    DataFrame按列编码传输，数值列直接传输底层内存，字符串等列使用字典编码
+    """
+    
+    def __init__(self, workers: int = 2, timeout_seconds: float = 120, cpu_seconds: float = 120, memory_mb: int = 4096):
+        """
+        初始化代码沙箱，工作进程在第一次使用或调用start时创建
+        
+        Args:
+            workers: 工作进程数，也是同时执行的任务数上限
+            timeout_seconds: 每个任务的墙钟时间上限，包括数据传输
+            cpu_seconds: 每个任务的CPU时间上限
+            memory_mb: 每个工作进程可以额外使用的内存（MB），不大于0时不限制
+        """
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        
+        methods = multiprocessing.get_all_start_methods()
+        if "forkserver" in methods:
+            # forkserver预加载pandas，新的工作进程不需要重新导入
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(["numpy", "pandas", "app.services.code_sandbox"])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+        
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._count = 0
+        self._closed = False
+        self._stats = {"jobs": 0, "errors": 0, "timeouts": 0, "crashes": 0, "workers_started": 0}
+    
+    def start(self):
+        """创建全部工作进程"""
+        started = []
+        while True:
+            worker = self._spawn()
+            if worker is None:
+                break
+            started.append(worker)
+        for worker in started:
+            self._idle.put(worker)
+    
+    def run(self, code: str, dfs: List[pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        """
+        在工作进程中执行分析代码，所有工作进程都在忙时等待
+        
+        Args:
+            code: 分析代码
+            dfs: 输入的DataFrame列表
+        
+        Returns:
+            分析结果字典，键为描述，值为DataFrame
+        
+        Raises:
+            SandboxTimeoutError: 超过墙钟时间或CPU时间限制
+            SandboxWorkerError: 工作进程异常退出
+            分析代码抛出的异常，__cause__为工作进程中的堆栈
+        """
+        return self._run(code, dfs, profile=False)[0]
+    
+    def run_profiled(self, code: str, dfs: List[pd.DataFrame]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Any]]:
+        """
+        在工作进程中执行并逐行剖析分析代码，参数和异常与run一致
+        
+        Returns:
+            (分析结果字典, 剖析结果)，剖析结果格式见LineProfiler.profile
+        """
+        return self._run(code, dfs, profile=True)
+    
+    def _run(self, code: str, dfs: List[pd.DataFrame], profile: bool) -> Tuple[Dict[str, pd.DataFrame], Optional[Dict[str, Any]]]:
+        """执行一个任务，返回(分析结果字典, 剖析结果)，不剖析时剖析结果为None"""
+        worker = self._acquire()
+        self._record("jobs")
+        try:
+            message, frames = self._exchange(worker, code, dfs, profile)
+        except SandboxTimeoutError:
+            self._discard(worker)
+            self._record("timeouts")
+            raise
+        except (EOFError, OSError) as e:
+            # 工作进程在执行期间退出，通常是内存超出系统限制被终止
+            worker.process.join(timeout=1)
+            exitcode = worker.process.exitcode
+            self._discard(worker)
+            self._record("crashes")
+            raise SandboxWorkerError(f"执行分析代码的工作进程异常退出，退出码: {exitcode}") from e
+        except BaseException:
+            # 管道中可能残留未读取的数据，不再复用该工作进程
+            self._discard(worker)
+            raise
+        
+        if message[0] == "broken":
+            _, error, tb = message
+            self._discard(worker)
+            self._record("crashes")
+            raise SandboxWorkerError(f"工作进程接收数据失败，已替换该工作进程: {error}") from RemoteTraceback(tb)
+        self._release(worker)
+        
+        if message[0] == "error":
+            _, error, tb = message
+            self._record("timeouts" if isinstance(error, SandboxTimeoutError) else "errors")
+            raise error from RemoteTraceback(tb)
+        return frames, message[2]
+    
+    def _exchange(self, worker: _Worker, code: str, dfs: List[pd.DataFrame], profile: bool) -> Tuple[Any, Optional[Dict[str, pd.DataFrame]]]:
+        """向工作进程发送任务并接收结果，返回(结果消息, 结果DataFrame)，超过墙钟时间时抛出SandboxTimeoutError"""
+        deadline = time.monotonic() + self.timeout_seconds
+        metas, buffers = _encode_frames(dfs)
+        worker.conn.send((code, metas, profile))
+        for buffer in buffers:
+            worker.conn.send_bytes(buffer)
+        
+        if not worker.conn.poll(max(deadline - time.monotonic(), 0)):
+            raise SandboxTimeoutError(f"分析代码执行超过{self.timeout_seconds}秒")
+        message = worker.conn.recv()
+        if message[0] != "ok":
+            return message, None
+        keys = [key for key, _ in message[1]]
+        frames = _recv_frames(worker.conn, [meta for _, meta in message[1]])
+        return message, dict(zip(keys, frames))
+    
+    def shutdown(self):
+        """停止所有空闲的工作进程，执行中的任务完成后其工作进程也会停止"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(worker, graceful=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取任务统计和当前工作进程数"""
+        with self._lock:
+            return {**self._stats, "workers": self._count, "max_workers": self.workers}
+    
+    def _record(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+    
+    def _spawn(self) -> Optional[_Worker]:
+        """工作进程数未达上限时创建一个新的工作进程"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("代码沙箱已关闭")
+            if self._count >= self.workers:
+                return None
+            self._count += 1
+            self._stats["workers_started"] += 1
+        try:
+            return _Worker(self._context, self.memory_mb, self.cpu_seconds)
+        except Exception:
+            with self._lock:
+                self._count -= 1
+            raise
+    
+    def _acquire(self) -> _Worker:
+        """获取空闲的工作进程，没有空闲进程时创建或等待"""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                worker = self._spawn() or self._idle.get()
+            if worker.alive():
+                return worker
+            self._discard(worker)
+    
+    def _release(self, worker: _Worker):
+        with self._lock:
+            closed = self._closed
+        if closed:
+            self._discard(worker, graceful=True)
+        else:
+            self._idle.put(worker)
+    
+    def _discard(self, worker: _Worker, graceful: bool = False):
+        """终止工作进程并释放名额"""
+        if graceful:
+            worker.stop()
+        else:
+            worker.kill()
+        with self._lock:
+            self._count -= 1
+
+
+_sandbox: Optional[CodeSandbox] = None
+_sandbox_lock = threading.Lock()
+
+
+def get_sandbox() -> Optional[CodeSandbox]:
+    """
+    获取共享的代码沙箱，配置analysis.sandbox.enabled为false时返回None，分析代码在API进程中执行
+    
+    Returns:
+        代码沙箱实例
+    """
+    global _sandbox
+    config_service = ConfigService()
+    if not config_service.get_config_value('analysis.sandbox.enabled', True):
+        return None
+    
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = CodeSandbox(
+                workers=config_service.get_config_value('analysis.sandbox.workers', 2),
+                timeout_seconds=config_service.get_config_value('analysis.sandbox.timeout_seconds', 120),
+                cpu_seconds=config_service.get_config_value('analysis.sandbox.cpu_seconds', 120),
+                memory_mb=config_service.get_config_value('analysis.sandbox.memory_mb', 4096)
+            )
+            logger.info(f"启用分析代码沙箱，工作进程数: {_sandbox.workers}")
+        return _sandbox
+
+
+def shutdown_sandbox():
+    """停止共享代码沙箱的工作进程"""
+    global _sandbox
+    with _sandbox_lock:
+        sandbox, _sandbox = _sandbox, None
+    if sandbox is not None:
+        sandbox.shutdown()
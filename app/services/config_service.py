@@ -2,7 +2,7 @@ import os
 import json
 import time
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import threading
 
 class ConfigService:
@@ -164,6 +164,15 @@ class ConfigService:
                 return agent
         return None
     
+    def get_rate_limit_config(self, model: str) -> Dict[str, Any]:
+        """获取模型的限流配置，未单独配置的模型使用rate_limits中的default"""
+        rate_limits = self.agents_config.get("rate_limits", {})
+        return rate_limits.get(model) or rate_limits.get("default") or {}
+    
+    def get_fallback_chain(self, model: str) -> List[str]:
+        """获取模型的降级链，返回按顺序尝试的代理配置ID列表"""
+        return self.agents_config.get("fallbacks", {}).get(model, [])
+    
     def get_config_value(self, key_path: str, default=None) -> Any:
         """
         获取配置值，支持点号分隔的路径
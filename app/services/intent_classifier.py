@@ -0,0 +1,356 @@
+import os
+import math
+import time
+import pickle
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.utils.logger import setup_logger
+
+logger = setup_logger("intent_classifier")
+
+# 默认的Platt缩放参数，confidence = sigmoid(a * margin + b)，margin为第一和第二意图的关键词得分差
+DEFAULT_CALIBRATION = (1.3, -0.9)
+
+# 得分最高的意图只命中一个关键词且得分差小于min_single_margin时（如只出现“分析”“展示”等通用的短关键词），
+# 置信度不超过这一值：低于默认的本地阈值0.8，由LLM识别，但仍可以推测执行
+AMBIGUOUS_CONFIDENCE = 0.6
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick多模式匹配自动机，一次扫描找出文本中出现的所有关键词，耗时与关键词数量无关
+    """
+    
+    def __init__(self, patterns: Iterable[str]):
+        """
+        构建自动机
+        
+        Args:
+            patterns: 关键词列表
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build_fail_links()
+    
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        if pattern not in self._output[state]:
+            self._output[state].append(pattern)
+    
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+    
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """
+        查找文本中所有关键词的出现位置，包括相互重叠的匹配
+        
+        Args:
+            text: 待匹配文本
+        
+        Returns:
+            (起始位置, 结束位置, 关键词)迭代器
+        """
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern in self._output[state]:
+                yield index + 1 - len(pattern), index + 1, pattern
+
+
+def _longest_non_overlapping(matches: Iterable[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    """优先保留更长的匹配，去掉被其覆盖的短匹配，如“分析方案”中的“分析”"""
+    selected = []
+    occupied = set()
+    for start, end, pattern in sorted(matches, key=lambda match: (match[0] - match[1], match[0])):
+        if any(position in occupied for position in range(start, end)):
+            continue
+        occupied.update(range(start, end))
+        selected.append((start, end, pattern))
+    return sorted(selected)
+
+
+def _sigmoid(value: float) -> float:
+    return 1.0 / (1.0 + math.exp(-value)) if value >= 0 else math.exp(value) / (1.0 + math.exp(value))
+
+
+def fit_calibration(margins: Sequence[float], correct: Sequence[bool], iterations: int = 200) -> Tuple[float, float]:
+    """
+    用牛顿法拟合Platt缩放参数，使关键词得分差映射到的置信度与实际正确率一致
+    
+    Args:
+        margins: 每个样本第一和第二意图的关键词得分差
+        correct: 每个样本得分最高的意图是否正确
+        iterations: 最大迭代次数
+    
+    Returns:
+        (a, b)，置信度为sigmoid(a * margin + b)
+    """
+    # 按Platt的做法对标签做平滑，避免样本完全可分时参数发散
+    positives = sum(1 for label in correct if label)
+    negatives = len(correct) - positives
+    high, low = (positives + 1.0) / (positives + 2.0), 1.0 / (negatives + 2.0)
+    targets = [high if label else low for label in correct]
+    a, b = DEFAULT_CALIBRATION
+    for _ in range(iterations):
+        grad_a = grad_b = h_aa = h_ab = h_bb = 0.0
+        for margin, target in zip(margins, targets):
+            p = _sigmoid(a * margin + b)
+            diff = p - target
+            weight = max(p * (1 - p), 1e-12)
+            grad_a += diff * margin
+            grad_b += diff
+            h_aa += weight * margin * margin
+            h_ab += weight * margin
+            h_bb += weight
+        det = h_aa * h_bb - h_ab * h_ab
+        if abs(det) < 1e-12:
+            break
+        step_a = (h_bb * grad_a - h_ab * grad_b) / det
+        step_b = (h_aa * grad_b - h_ab * grad_a) / det
+        a, b = a - step_a, b - step_b
+        if abs(step_a) < 1e-8 and abs(step_b) < 1e-8:
+            break
+    return a, b
+
+
+class LocalIntentClassifier:
+    """
+    不调用LLM的本地意图分类器
+    
+    关键词由Aho-Corasick自动机一次扫描匹配，重叠时保留较长的关键词，每个匹配按关键词长度计分，
+    第一和第二意图的得分差经Platt缩放得到校准后的置信度。只命中一个较短关键词时置信度不超过AMBIGUOUS_CONFIDENCE。
+    存在由历史记录训练的scikit-learn模型时，
+    与模型的预测概率加权平均。置信度低于阈值时由调用方改用LLM识别
+    """
+    
+    def __init__(self, agent_types: Dict[str, Dict[str, Any]], calibration: Optional[Sequence[float]] = None,
+                 model_path: Optional[str] = None, model_weight: float = 0.5, min_single_margin: float = 3.0):
+        """
+        初始化分类器
+        
+        Args:
+            agent_types: 意图类型配置，格式与UserIntentAgent.AGENT_TYPES一致，使用其中的keywords和local_keywords
+            calibration: Platt缩放参数(a, b)
+            model_path: scikit-learn模型文件路径，文件不存在或未安装scikit-learn时只使用关键词
+            model_weight: 模型概率在加权平均中的权重
+            min_single_margin: 只命中一个关键词时不限制置信度所需的最小得分差，默认要求关键词至少3个字
+        """
+        self.labels = list(agent_types)
+        self._keyword_labels: Dict[str, List[str]] = {}
+        for label, info in agent_types.items():
+            for keyword in info.get("keywords", []) + info.get("local_keywords", []):
+                self._keyword_labels.setdefault(keyword.lower(), []).append(label)
+        self._automaton = AhoCorasick(self._keyword_labels)
+        self.calibration = tuple(calibration or DEFAULT_CALIBRATION)
+        self.model_path = model_path
+        self.model_weight = model_weight
+        self.min_single_margin = min_single_margin
+        self._model = None
+        self._lock = threading.Lock()
+        self._stats = {"predictions": 0, "accepted": 0, "total_seconds": 0.0}
+        if model_path and os.path.exists(model_path):
+            self.load_model(model_path)
+    
+    def keyword_scores(self, text: str) -> Tuple[Dict[str, float], List[str]]:
+        """
+        计算各意图的关键词得分
+        
+        Args:
+            text: 用户输入
+        
+        Returns:
+            ({意图: 得分}, 匹配到的关键词列表)
+        """
+        scores = {label: 0.0 for label in self.labels}
+        matched = []
+        for _, _, keyword in _longest_non_overlapping(self._automaton.iter_matches(text.lower())):
+            matched.append(keyword)
+            labels = self._keyword_labels[keyword]
+            for label in labels:
+                scores[label] += len(keyword) / len(labels)
+        return scores, matched
+    
+    def _keyword_probabilities(self, scores: Dict[str, float], matched: List[str]) -> Tuple[Dict[str, float], float]:
+        """
+        将关键词得分转换为概率分布，得分最高的意图取校准后的置信度，其余按得分分配剩余概率
+        
+        得分最高的意图只命中一个关键词且得分差小于min_single_margin时，置信度不超过AMBIGUOUS_CONFIDENCE
+        """
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        margin = ranked[0][1] - ranked[1][1] if len(ranked) > 1 else ranked[0][1]
+        confidence = _sigmoid(self.calibration[0] * margin + self.calibration[1])
+        hits = sum(1 for keyword in matched if ranked[0][0] in self._keyword_labels[keyword])
+        if hits < 2 and margin < self.min_single_margin:
+            confidence = min(confidence, AMBIGUOUS_CONFIDENCE)
+        # 得分最高的意图概率不低于均匀分布
+        confidence = max(confidence, 1.0 / len(ranked))
+        rest = ranked[1:]
+        rest_total = sum(score for _, score in rest)
+        probabilities = {ranked[0][0]: confidence}
+        for label, score in rest:
+            share = score / rest_total if rest_total else 1.0 / len(rest)
+            probabilities[label] = (1.0 - confidence) * share
+        return probabilities, margin
+    
+    def predict(self, text: str) -> Dict[str, Any]:
+        """
+        预测用户输入的意图
+        
+        Args:
+            text: 用户输入
+        
+        Returns:
+            {"agent_type": "...", "confidence": 0.9, "probabilities": {...}, "margin": 3.0,
+             "matched_keywords": [...], "explanation": "..."}；没有关键词匹配且没有模型时confidence为0
+        """
+        start_time = time.perf_counter()
+        scores, matched = self.keyword_scores(text)
+        model_probabilities = self._model_probabilities(text)
+        
+        if matched:
+            probabilities, margin = self._keyword_probabilities(scores, matched)
+            if model_probabilities:
+                probabilities = {
+                    label: (1 - self.model_weight) * probabilities[label] + self.model_weight * model_probabilities.get(label, 0.0)
+                    for label in self.labels
+                }
+        elif model_probabilities:
+            probabilities, margin = model_probabilities, 0.0
+        else:
+            probabilities, margin = {label: 0.0 for label in self.labels}, 0.0
+        
+        agent_type = max(probabilities, key=probabilities.get)
+        result = {
+            "agent_type": agent_type,
+            "confidence": probabilities[agent_type],
+            "probabilities": probabilities,
+            "margin": margin,
+            "matched_keywords": matched,
+            "explanation": f"本地分类器根据关键词{matched}识别" if matched else "本地分类器根据历史模型识别"
+        }
+        with self._lock:
+            self._stats["predictions"] += 1
+            self._stats["total_seconds"] += time.perf_counter() - start_time
+        return result
+    
+    def record_accepted(self):
+        """记录一次本地识别结果被采用（未调用LLM）"""
+        with self._lock:
+            self._stats["accepted"] += 1
+    
+    def _model_probabilities(self, text: str) -> Optional[Dict[str, float]]:
+        model = self._model
+        if model is None:
+            return None
+        probabilities = model.predict_proba([text])[0]
+        return {label: float(probability) for label, probability in zip(model.classes_, probabilities) if label in self.labels}
+    
+    def load_model(self, path: str) -> bool:
+        """
+        加载train_model保存的模型
+        
+        Args:
+            path: 模型文件路径
+        
+        Returns:
+            是否加载成功
+        """
+        try:
+            with open(path, 'rb') as f:
+                self._model = pickle.load(f)
+            logger.info(f"已加载意图分类模型: {path}")
+            return True
+        except Exception as e:
+            logger.warning(f"加载意图分类模型失败: {path}，错误: {str(e)}")
+            return False
+    
+    def train_model(self, samples: Sequence[Tuple[str, str]], path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        用(用户输入, 意图)样本训练字符n-gram逻辑回归模型并保存，需要安装scikit-learn
+        
+        Args:
+            samples: 训练样本，通常来自collect_history_samples
+            path: 模型保存路径，默认使用初始化时的model_path
+        
+        Returns:
+            训练信息，如{"samples": 120, "classes": [...]}
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+        
+        samples = [(text, label) for text, label in samples if label in self.labels]
+        classes = sorted({label for _, label in samples})
+        if len(classes) < 2:
+            raise ValueError(f"训练意图分类模型至少需要两种意图的样本，当前只有: {classes}")
+        # 中文没有空格分词，使用字符n-gram；逻辑回归的预测概率本身校准较好
+        model = make_pipeline(
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 3), sublinear_tf=True),
+            LogisticRegression(max_iter=1000, class_weight="balanced")
+        )
+        model.fit([text for text, _ in samples], [label for _, label in samples])
+        
+        path = path or self.model_path
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(model, f)
+            os.replace(tmp_path, path)
+            logger.info(f"意图分类模型已保存: {path}，样本数: {len(samples)}")
+        self._model = model
+        return {"samples": len(samples), "classes": classes, "path": path}
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取分类统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_latency_seconds"] = stats.pop("total_seconds") / stats["predictions"] if stats["predictions"] else 0.0
+        stats["accept_rate"] = stats["accepted"] / stats["predictions"] if stats["predictions"] else 0.0
+        stats["model_loaded"] = self._model is not None
+        return stats
+
+
+def collect_history_samples(histories: Iterable[List[Dict[str, Any]]]) -> List[Tuple[str, str]]:
+    """
+    从会话历史中收集训练样本，只使用由LLM识别的意图（包括融合路由调用识别的意图），避免本地分类器用自己的输出训练自己
+    
+    Args:
+        histories: 每个会话的历史记录列表
+    
+    Returns:
+        (用户输入, 意图)样本列表
+    """
+    samples = []
+    for history in histories:
+        for item in history:
+            intent = item.get("intent") or {}
+            if item.get("role") == "user" and intent.get("source") in ("llm", "fused") and intent.get("agent_type"):
+                samples.append((item.get("content", ""), intent["agent_type"]))
+    return samples
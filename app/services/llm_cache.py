@@ -0,0 +1,302 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import aclosing
+from typing import Dict, List, Optional, Any, Iterator, AsyncIterator
+
+from app.services.base_llm_service import BaseLLMService, LLMServiceWrapper, assemble_stream_response, response_to_stream_chunk
+from app.utils.logger import setup_logger
+
+logger = setup_logger("llm_cache")
+
+# 缓存命中时的访问时间先记录在内存中，累计到这一数量或写入新响应时再批量写入数据库
+ACCESS_FLUSH_BATCH = 100
+
+
+def build_request_key(model: Optional[str], messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    """
+    计算请求的规范化哈希，作为缓存键
+    
+    Args:
+        model: 模型名称
+        messages: 消息列表
+        params: 调用时显式传入的采样参数（temperature、max_tokens等）
+    
+    Returns:
+        请求的sha256十六进制摘要
+    """
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    基于SQLite的LLM响应磁盘缓存，支持TTL过期以及按条目数和占用空间的LRU淘汰
+    
+    读写都是阻塞的磁盘操作，异步代码中应在线程池中调用。命中时不单独提交访问时间的更新，
+    而是批量写入，LRU淘汰前会先写入所有待更新的访问时间
+    """
+    
+    def __init__(self, path: str, ttl_seconds: Optional[float] = 86400, max_entries: int = 5000, max_size_mb: float = 200):
+        """
+        初始化响应缓存
+        
+        Args:
+            path: SQLite数据库文件路径
+            ttl_seconds: 缓存有效期（秒），为None或0时不过期
+            max_entries: 最大缓存条目数
+            max_size_mb: 缓存响应的最大总大小（MB）
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds or None
+        self.max_entries = max_entries
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evictions": 0}
+        self._pending_access: Dict[str, float] = {}
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_accessed ON llm_responses(accessed_at)")
+        self._conn.commit()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存的响应
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            缓存的响应，未命中或已过期时返回None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            
+            if self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            
+            # 记录访问时间，用于LRU淘汰
+            self._pending_access[key] = now
+            if len(self._pending_access) >= ACCESS_FLUSH_BATCH:
+                self._flush_access()
+                self._conn.commit()
+            self._stats["hits"] += 1
+        
+        return json.loads(row[0])
+    
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        """
+        写入响应并按需淘汰旧条目
+        
+        Args:
+            key: 缓存键
+            response: LLM返回结果
+        """
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_size_bytes:
+            return
+        
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now)
+            )
+            self._stats["writes"] += 1
+            self._pending_access.pop(key, None)
+            self._flush_access()
+            self._evict(now)
+            self._conn.commit()
+    
+    def _flush_access(self) -> None:
+        """把内存中记录的访问时间写入数据库，由调用方提交"""
+        if self._pending_access:
+            self._conn.executemany("UPDATE llm_responses SET accessed_at = ? WHERE key = ?",
+                                   [(accessed_at, key) for key, accessed_at in self._pending_access.items()])
+            self._pending_access.clear()
+    
+    def _evict(self, now: float) -> None:
+        """删除过期条目，再按最近访问时间从旧到新淘汰，直到满足条目数和空间限制"""
+        if self.ttl_seconds:
+            cursor = self._conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._stats["expired"] += cursor.rowcount
+        
+        count, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+        if count <= self.max_entries and total_size <= self.max_size_bytes:
+            return
+        
+        evict_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_responses ORDER BY accessed_at ASC"):
+            if count <= self.max_entries and total_size <= self.max_size_bytes:
+                break
+            evict_keys.append((key,))
+            count -= 1
+            total_size -= size
+        
+        self._conn.executemany("DELETE FROM llm_responses WHERE key = ?", evict_keys)
+        self._stats["evictions"] += len(evict_keys)
+    
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._pending_access.clear()
+            self._conn.execute("DELETE FROM llm_responses")
+            self._conn.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计和当前占用"""
+        with self._lock:
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses"
+            ).fetchone()
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = count
+        stats["size_bytes"] = total_size
+        return stats
+    
+    def close(self) -> None:
+        """写入待更新的访问时间并关闭数据库连接"""
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedLLMService(LLMServiceWrapper):
+    """
+    为LLM服务增加响应缓存的包装服务
+    
+    缓存键由模型、消息和调用时显式传入的参数计算。调用时传入use_cache=False可跳过缓存，
+    流式调用命中缓存时以单个数据块返回完整内容。异步调用在线程池中读写缓存，不阻塞事件循环
+    """
+    
+    def __init__(self, service: BaseLLMService, cache: LLMResponseCache):
+        """
+        初始化缓存包装服务
+        
+        Args:
+            service: 被包装的LLM服务
+            cache: 响应缓存
+        """
+        super().__init__(service)
+        self.cache = cache
+    
+    def _cache_key(self, messages: List[Dict[str, str]], model: Optional[str], kwargs: Dict[str, Any]) -> Optional[str]:
+        """计算缓存键，不使用缓存时返回None"""
+        if not kwargs.pop("use_cache", True):
+            return None
+        params = {key: value for key, value in kwargs.items() if key not in BaseLLMService.CONTROL_KWARGS and key != "stream"}
+        return build_request_key(model or self.model, messages, params)
+    
+    @staticmethod
+    def _is_cacheable(response: Dict[str, Any]) -> bool:
+        """只缓存包含有效内容的响应"""
+        choices = response.get("choices") or []
+        return bool(choices) and bool((choices[0].get("message") or {}).get("content"))
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """带响应缓存的聊天补全，未命中时调用被包装的服务并写入缓存"""
+        key = self._cache_key(messages, model, kwargs)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"LLM响应缓存命中: {key[:16]}")
+                return cached
+        
+        response = self.service.chat_completion(messages, model, **kwargs)
+        if key is not None and self._is_cacheable(response):
+            self.cache.put(key, response)
+        return response
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """带响应缓存的异步聊天补全"""
+        key = self._cache_key(messages, model, kwargs)
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.info(f"LLM响应缓存命中: {key[:16]}")
+                return cached
+        
+        response = await self.service.achat_completion(messages, model, **kwargs)
+        if key is not None and self._is_cacheable(response):
+            await asyncio.to_thread(self.cache.put, key, response)
+        return response
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """带响应缓存的流式聊天补全，流结束后将合并结果写入缓存"""
+        key = self._cache_key(messages, model, kwargs)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"LLM响应缓存命中: {key[:16]}")
+                yield response_to_stream_chunk(cached)
+                return
+        
+        chunks = []
+        for chunk in self.service.stream_chat_completion(messages, model, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        
+        response = assemble_stream_response(chunks)
+        if key is not None and self._is_cacheable(response):
+            self.cache.put(key, response)
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """带响应缓存的异步流式聊天补全"""
+        key = self._cache_key(messages, model, kwargs)
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.info(f"LLM响应缓存命中: {key[:16]}")
+                yield response_to_stream_chunk(cached)
+                return
+        
+        chunks = []
+        async with aclosing(self.service.astream_chat_completion(messages, model, **kwargs)) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        
+        response = assemble_stream_response(chunks)
+        if key is not None and self._is_cacheable(response):
+            await asyncio.to_thread(self.cache.put, key, response)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取被包装服务的统计信息，并附加缓存统计"""
+        stats = self.service.get_stats()
+        stats["cache"] = self.cache.stats()
+        return stats
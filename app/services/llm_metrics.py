@@ -0,0 +1,346 @@
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from contextlib import aclosing, contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Any, Iterator, AsyncIterator, Sequence, Tuple
+
+from app.services.base_llm_service import LLMServiceWrapper
+from app.utils.token_utils import estimate_tokens
+
+# 直方图桶上界
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 8192, 16384, 32768, 65536, 131072)
+THROUGHPUT_BUCKETS = (1, 5, 10, 20, 30, 50, 80, 120, 200, 500)
+
+# 未传入agent_id的调用（如基准测试脚本直接调用服务）归入该代理
+UNKNOWN_AGENT = "unknown"
+
+
+class Histogram:
+    """
+    固定桶直方图，只保存各桶计数和汇总值，内存占用与调用次数无关
+    """
+    
+    def __init__(self, bounds: Sequence[float]):
+        """
+        初始化直方图
+        
+        Args:
+            bounds: 递增的桶上界，超过最大上界的值计入+Inf桶
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+    
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        按桶计数估算分位数，在所在桶内线性插值，结果限制在观测到的最小值和最大值之间
+        
+        Args:
+            percent: 分位数，如95
+        
+        Returns:
+            估算值，没有样本时返回None
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else self.min
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                value = lower + (upper - lower) * (rank - cumulative) / count
+                return min(max(value, self.min), self.max)
+            cumulative += count
+        return self.max
+    
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": buckets
+        }
+
+
+def _new_series() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "error_classes": {},
+        "queue_wait_seconds": Histogram(LATENCY_BUCKETS),
+        "ttft_seconds": Histogram(LATENCY_BUCKETS),
+        "latency_seconds": Histogram(LATENCY_BUCKETS),
+        "prompt_tokens": Histogram(TOKEN_BUCKETS),
+        "completion_tokens": Histogram(TOKEN_BUCKETS),
+        "reasoning_tokens": Histogram(TOKEN_BUCKETS),
+        "prompt_cache_hit_tokens": Histogram(TOKEN_BUCKETS),
+        "tokens_per_second": Histogram(THROUGHPUT_BUCKETS),
+    }
+
+
+def error_class(error: BaseException) -> str:
+    """
+    错误分类名称，HTTP错误附带状态码，如HTTPStatusError:429；调用方放弃等待记为Cancelled
+    
+    Args:
+        error: 调用抛出的异常
+    
+    Returns:
+        错误分类名称
+    """
+    if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+        return "Cancelled"
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None) if response is not None else None
+    return f"{type(error).__name__}:{status_code}" if status_code else type(error).__name__
+
+
+def parse_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    从响应的usage中读取提示词、生成、推理和命中服务端前缀缓存的token数，缺失的字段不返回
+    
+    前缀缓存命中数兼容prompt_cache_hit_tokens和prompt_tokens_details.cached_tokens两种格式
+    
+    Args:
+        usage: 响应中的usage字段
+    
+    Returns:
+        {"prompt_tokens": 100, "completion_tokens": 50, "reasoning_tokens": 30, "prompt_cache_hit_tokens": 80}
+    """
+    usage = usage or {}
+    tokens = {key: usage[key] for key in ("prompt_tokens", "completion_tokens") if usage.get(key) is not None}
+    details = usage.get("completion_tokens_details") or {}
+    reasoning_tokens = details.get("reasoning_tokens", usage.get("reasoning_tokens"))
+    if reasoning_tokens is not None:
+        tokens["reasoning_tokens"] = reasoning_tokens
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    cache_hit_tokens = usage.get("prompt_cache_hit_tokens", prompt_details.get("cached_tokens"))
+    if cache_hit_tokens is not None:
+        tokens["prompt_cache_hit_tokens"] = cache_hit_tokens
+    return tokens
+
+
+class LLMMetrics:
+    """
+    按(代理ID, 模型)统计LLM调用的排队等待、首token耗时、总耗时、token数、前缀缓存命中、生成速度和错误分类
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    
+    def _get_series(self, agent_id: Optional[str], model: Optional[str]) -> Dict[str, Any]:
+        key = (agent_id or UNKNOWN_AGENT, model or "")
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _new_series()
+        return series
+    
+    def record_queue_wait(self, agent_id: Optional[str], model: Optional[str], seconds: float):
+        """记录请求在限流队列中的等待时间"""
+        with self._lock:
+            self._get_series(agent_id, model)["queue_wait_seconds"].observe(seconds)
+    
+    def record_call(self, agent_id: Optional[str], model: Optional[str], latency_seconds: float,
+                    ttft_seconds: Optional[float] = None, usage: Optional[Dict[str, Any]] = None,
+                    error: Optional[BaseException] = None):
+        """
+        记录一次上游调用
+        
+        Args:
+            agent_id: 发起调用的代理ID
+            model: 模型名称
+            latency_seconds: 调用总耗时，不含限流排队时间
+            ttft_seconds: 流式调用收到首个内容块的耗时，非流式调用为None
+            usage: 响应中的usage字段
+            error: 调用失败时的异常
+        """
+        tokens = parse_usage(usage)
+        with self._lock:
+            series = self._get_series(agent_id, model)
+            series["calls"] += 1
+            series["latency_seconds"].observe(latency_seconds)
+            if ttft_seconds is not None:
+                series["ttft_seconds"].observe(ttft_seconds)
+            if error is not None:
+                name = error_class(error)
+                series["errors"] += 1
+                series["error_classes"][name] = series["error_classes"].get(name, 0) + 1
+                return
+            for key, value in tokens.items():
+                series[key].observe(value)
+            # 生成速度只计算生成阶段，流式调用扣除首token之前的等待
+            generation_seconds = latency_seconds - (ttft_seconds or 0.0)
+            if tokens.get("completion_tokens") and generation_seconds > 0:
+                series["tokens_per_second"].observe(tokens["completion_tokens"] / generation_seconds)
+    
+    def snapshot(self, agent_id: Optional[str] = None, model: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        获取统计快照
+        
+        Args:
+            agent_id: 只返回该代理的统计
+            model: 只返回该模型的统计
+        
+        Returns:
+            每个(代理ID, 模型)一项的统计列表
+        """
+        with self._lock:
+            result = []
+            for (series_agent, series_model), series in sorted(self._series.items()):
+                if (agent_id and series_agent != agent_id) or (model and series_model != model):
+                    continue
+                entry = {"agent_id": series_agent, "model": series_model}
+                for key, value in series.items():
+                    if isinstance(value, Histogram):
+                        entry[key] = value.snapshot()
+                    elif isinstance(value, dict):
+                        entry[key] = dict(value)
+                    else:
+                        entry[key] = value
+                # 服务端从未返回前缀缓存命中数时命中率为None
+                hits = series["prompt_cache_hit_tokens"]
+                entry["prompt_cache_hit_ratio"] = hits.sum / series["prompt_tokens"].sum if hits.count and series["prompt_tokens"].sum else None
+                result.append(entry)
+            return result
+    
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._series.clear()
+
+
+llm_metrics = LLMMetrics()
+
+# 当前上下文中收集每次上游调用token用量的列表，由collect_usage设置
+_usage_sink: ContextVar[Optional[List[Dict[str, int]]]] = ContextVar("llm_usage_sink", default=None)
+
+
+@contextmanager
+def collect_usage(sink: List[Dict[str, int]]) -> Iterator[List[Dict[str, int]]]:
+    """
+    将代码块内（包括其中创建的任务和线程池调用）每次上游调用的token用量追加到sink
+    
+    调用被取消或失败而没有返回usage时，按提示词估算prompt_tokens并标记estimated，
+    用于统计推测执行等被丢弃的调用消耗的token
+    
+    Args:
+        sink: 接收用量的列表，每次调用追加一项parse_usage格式的字典
+    """
+    token = _usage_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _usage_sink.reset(token)
+
+
+class _CallTimer:
+    """单次调用的计时，流式调用按数据块记录首token时间和usage"""
+    
+    def __init__(self, agent_id: Optional[str], model: Optional[str], messages: List[Dict[str, str]]):
+        self.agent_id = agent_id
+        self.model = model
+        self.messages = messages
+        self.start_time = time.perf_counter()
+        self.ttft_seconds = None
+        self.usage = None
+    
+    def observe_chunk(self, chunk: Dict[str, Any]):
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        if self.ttft_seconds is None:
+            for choice in chunk.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if delta.get("content") or delta.get("reasoning_content"):
+                    self.ttft_seconds = time.perf_counter() - self.start_time
+                    break
+    
+    def finish(self, usage: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None):
+        usage = usage or self.usage
+        llm_metrics.record_call(self.agent_id, self.model, time.perf_counter() - self.start_time,
+                                ttft_seconds=self.ttft_seconds, usage=usage, error=error)
+        sink = _usage_sink.get()
+        if sink is not None:
+            tokens = parse_usage(usage)
+            if "prompt_tokens" not in tokens:
+                tokens = {"prompt_tokens": sum(estimate_tokens(m.get("content") or "") for m in self.messages), "estimated": 1}
+            sink.append(tokens)
+
+
+class MetricsLLMService(LLMServiceWrapper):
+    """
+    记录每次上游调用指标的包装服务，位于限流层之内，重试和对冲产生的每次调用都会单独记录
+    
+    代理通过控制参数agent_id标识调用方
+    """
+    
+    def _timer(self, messages: List[Dict[str, str]], model: Optional[str], kwargs: Dict[str, Any]) -> _CallTimer:
+        return _CallTimer(kwargs.get("agent_id"), model or self.model, messages)
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """记录指标的聊天补全"""
+        timer = self._timer(messages, model, kwargs)
+        try:
+            response = self.service.chat_completion(messages, model, **kwargs)
+        except BaseException as e:
+            timer.finish(error=e)
+            raise
+        timer.finish(usage=response.get("usage"))
+        return response
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """记录指标的异步聊天补全"""
+        timer = self._timer(messages, model, kwargs)
+        try:
+            response = await self.service.achat_completion(messages, model, **kwargs)
+        except BaseException as e:
+            timer.finish(error=e)
+            raise
+        timer.finish(usage=response.get("usage"))
+        return response
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """记录首token耗时和指标的流式聊天补全"""
+        timer = self._timer(messages, model, kwargs)
+        try:
+            for chunk in self.service.stream_chat_completion(messages, model, **kwargs):
+                timer.observe_chunk(chunk)
+                yield chunk
+        except BaseException as e:
+            timer.finish(error=e)
+            raise
+        timer.finish()
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """记录首token耗时和指标的异步流式聊天补全"""
+        timer = self._timer(messages, model, kwargs)
+        try:
+            async with aclosing(self.service.astream_chat_completion(messages, model, **kwargs)) as stream:
+                async for chunk in stream:
+                    timer.observe_chunk(chunk)
+                    yield chunk
+        except BaseException as e:
+            timer.finish(error=e)
+            raise
+        timer.finish()
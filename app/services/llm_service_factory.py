@@ -1,12 +1,102 @@
-from typing import Dict, Optional, Type
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Type
+from collections import OrderedDict
+from contextlib import aclosing, contextmanager
 import os
+import threading
 
-from app.services.base_llm_service import BaseLLMService
+from app.services.base_llm_service import BaseLLMService, LLMServiceWrapper
 from app.services.silicon_flow_service import SiliconFlowService
+from app.services.config_service import ConfigService
+from app.services.llm_cache import LLMResponseCache, CachedLLMService
+from app.services.single_flight import SingleFlightLLMService
+from app.services.rate_limiter import RateLimitedLLMService, get_queue_depth
+from app.services.resilience import ResilientLLMService, RetryPolicy
+from app.services.llm_metrics import MetricsLLMService
+from app.utils.file_utils import get_project_root
 from app.utils.logger import setup_logger
 
 logger = setup_logger("llm_service_factory")
 
+
+class SharedLLMService(LLMServiceWrapper):
+    """
+    工厂缓存的服务实例，按引用计数决定何时真正关闭被包装的服务
+    
+    与SiliconFlowService共享连接池的计数方式一致：实例缓存、包装它的完整服务、降级链和进行中的调用各持有一个引用，
+    close()和aclose()只释放调用方自己的引用，最后一个引用释放时才关闭被包装的服务
+    """
+    
+    def __init__(self, service: BaseLLMService):
+        """
+        初始化共享服务，创建方持有第一个引用
+        
+        Args:
+            service: 被包装的LLM服务
+        """
+        super().__init__(service)
+        self._refs = 1
+        self._refs_lock = threading.Lock()
+    
+    def acquire(self) -> bool:
+        """
+        增加一个引用
+        
+        Returns:
+            是否成功增加，被包装的服务已经关闭时返回False
+        """
+        with self._refs_lock:
+            if self._refs <= 0:
+                return False
+            self._refs += 1
+            return True
+    
+    def _release(self) -> bool:
+        """释放一个引用，返回是否释放了最后一个引用"""
+        with self._refs_lock:
+            if self._refs <= 0:
+                return False
+            self._refs -= 1
+            return self._refs == 0
+    
+    @contextmanager
+    def _in_flight(self):
+        """调用期间持有一个引用，避免实例被淘汰后在调用中途关闭连接"""
+        acquired = self.acquire()
+        try:
+            yield
+        finally:
+            if acquired:
+                self.close()
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self._in_flight():
+            return self.service.chat_completion(messages, model, **kwargs)
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        with self._in_flight():
+            return await self.service.achat_completion(messages, model, **kwargs)
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        with self._in_flight():
+            yield from self.service.stream_chat_completion(messages, model, **kwargs)
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        with self._in_flight():
+            async with aclosing(self.service.astream_chat_completion(messages, model, **kwargs)) as stream:
+                async for chunk in stream:
+                    yield chunk
+    
+    def close(self):
+        """释放一个引用，最后一个引用释放时关闭被包装的服务"""
+        if self._release():
+            self.service.close()
+    
+    async def aclose(self):
+        """释放一个引用，最后一个引用释放时异步关闭被包装的服务"""
+        if self._release():
+            await self.service.aclose()
+
+
 class LLMServiceFactory:
     """
     大模型服务工厂类，用于创建和管理不同的LLM服务实例
@@ -17,8 +107,18 @@ class LLMServiceFactory:
         "silicon_flow": SiliconFlowService,
     }
     
-    # 服务实例缓存 - 使用(service_type, model)作为键
-    _service_instances: Dict[str, BaseLLMService] = {}
+    # 服务实例缓存 - 使用(service_type, model)作为键，按最近使用顺序排列
+    _service_instances: "OrderedDict[str, SharedLLMService]" = OrderedDict()
+    
+    # 只经过限流的底层服务实例，供完整服务包装和降级链共用，与_service_instances使用相同的键
+    _upstream_instances: "OrderedDict[str, SharedLLMService]" = OrderedDict()
+    
+    # 保护上面两个实例缓存，只在查找和插入时持有，服务构造在锁外进行
+    _instances_lock = threading.RLock()
+    
+    # 所有服务共享的响应缓存，缓存键中包含模型名称
+    _response_cache: Optional[LLMResponseCache] = None
+    _response_cache_lock = threading.Lock()
     
     @classmethod
     def get_service(cls, service_type: str = None, model: str = None, **kwargs) -> BaseLLMService:
@@ -37,6 +137,9 @@ class LLMServiceFactory:
         if service_type is None:
             service_type = os.environ.get("LLM_SERVICE_TYPE", "silicon_flow")
         
+        # 离线运行时可通过LLM_SERVICE_TYPE_OVERRIDE让所有代理使用指定的服务类型，如replay
+        service_type = os.environ.get("LLM_SERVICE_TYPE_OVERRIDE") or service_type
+        
         # 如果未指定模型，则从环境变量获取 - 修改为使用SILICON_LLM_MODEL_NAME
         if model is None:
             if service_type == "silicon_flow":
@@ -52,24 +155,254 @@ class LLMServiceFactory:
         # 创建缓存键
         cache_key = f"{service_type}_{model}"
         
-        # 如果实例已存在，直接返回
-        if cache_key in cls._service_instances:
-            return cls._service_instances[cache_key]
+        with cls._instances_lock:
+            service_instance = cls._service_instances.get(cache_key)
+            if service_instance is not None:
+                cls._touch(cache_key)
+                return service_instance
         
-        # 创建新实例
+        # 在锁外创建，较慢的服务构造不会阻塞获取其他服务的调用方
         logger.info(f"创建新的LLM服务实例: {service_type}，模型: {model}")
+        upstream = cls._acquire_upstream(service_type, model, **kwargs)
+        service_instance = SharedLLMService(cls._wrap_service(upstream, service_type))
+        
+        with cls._instances_lock:
+            # 底层服务在创建期间被淘汰时不缓存，否则完整服务不会再随底层服务一起淘汰
+            if cache_key not in cls._service_instances and cls._upstream_instances.get(cache_key) is upstream:
+                cls._service_instances[cache_key] = service_instance
+                cls._touch(cache_key)
+                return service_instance
+        
+        # 其他线程已经缓存了同一键的实例，关闭本线程创建的重复实例后使用缓存的实例
+        service_instance.close()
+        return cls.get_service(service_type, model, **kwargs)
+    
+    @classmethod
+    def get_upstream_service(cls, service_type: str, model: Optional[str], **kwargs) -> BaseLLMService:
+        """
+        获取只包装了限流层和调用指标层的底层服务实例，不存在时创建
+        
+        返回的实例带有调用方持有的一个引用，用完后需调用close()或aclose()释放
+        
+        Args:
+            service_type: 服务类型
+            model: 模型名称
+            **kwargs: 传递给服务构造函数的参数
+            
+        Returns:
+            底层服务实例
+        """
+        return cls._acquire_upstream(service_type, model, **kwargs)
+    
+    @classmethod
+    def _acquire_upstream(cls, service_type: str, model: Optional[str], **kwargs) -> SharedLLMService:
+        """获取底层服务实例并为调用方增加一个引用，服务构造在锁外进行"""
+        cache_key = f"{service_type}_{model}"
+        with cls._instances_lock:
+            service = cls._upstream_instances.get(cache_key)
+            if service is not None:
+                cls._touch(cache_key)
+                service.acquire()
+                return service
+        
         service_class = cls._service_classes[service_type]
         
         # 将model添加到kwargs中
         if model:
             kwargs['model'] = model
+        
+        created = service_class(**kwargs)
+        config_service = ConfigService()
+        if config_service.get_config_value('llm.metrics.enabled', True):
+            created = MetricsLLMService(created)
+        if config_service.get_config_value('llm.rate_limit.enabled', True):
+            created = RateLimitedLLMService(created)
+        created = SharedLLMService(created)
+        
+        evicted = []
+        with cls._instances_lock:
+            service = cls._upstream_instances.get(cache_key)
+            if service is None:
+                service = cls._upstream_instances[cache_key] = created
+                evicted = cls._evict_overflow()
+            else:
+                cls._touch(cache_key)
+            # 在锁内增加引用，淘汰只会在锁内从缓存中移除实例，此时实例仍然持有缓存的引用
+            service.acquire()
+        
+        # 关闭重复创建和被淘汰的实例不需要持有锁
+        if service is not created:
+            created.close()
+        for evicted_key, evicted_service in evicted:
+            cls._close_evicted(evicted_key, evicted_service)
+        return service
+    
+    @classmethod
+    def _touch(cls, cache_key: str):
+        """将缓存键标记为最近使用，调用方需持有_instances_lock"""
+        if cache_key in cls._upstream_instances:
+            cls._upstream_instances.move_to_end(cache_key)
+        if cache_key in cls._service_instances:
+            cls._service_instances.move_to_end(cache_key)
+    
+    @classmethod
+    def _evict_overflow(cls) -> List[Tuple[str, BaseLLMService]]:
+        """
+        实例数超过llm.service_cache.max_instances时按最近最少使用淘汰，调用方需持有_instances_lock
+        
+        同一键的完整服务和底层服务一起淘汰，各自释放缓存持有的引用
+        
+        Returns:
+            被淘汰的(缓存键, 需要释放缓存引用的服务实例)列表
+        """
+        max_instances = max(1, ConfigService().get_config_value('llm.service_cache.max_instances', 32))
+        evicted = []
+        while len(cls._upstream_instances) > max_instances:
+            cache_key, upstream = cls._upstream_instances.popitem(last=False)
+            service = cls._service_instances.pop(cache_key, None)
+            if service is not None:
+                evicted.append((cache_key, service))
+            evicted.append((cache_key, upstream))
+        return evicted
+    
+    @staticmethod
+    def _close_evicted(cache_key: str, service: SharedLLMService):
+        """
+        释放缓存对被淘汰实例的引用
+        
+        仍持有该实例的代理、降级链和进行中的调用释放各自的引用后，被包装的服务才会真正关闭
+        """
+        logger.info(f"LLM服务实例缓存已满，淘汰最近最少使用的实例: {cache_key}")
+        try:
+            service.close()
+        except Exception as e:
+            logger.warning(f"关闭LLM服务失败: {cache_key}，错误: {str(e)}")
+    
+    @classmethod
+    def _resolve_fallbacks(cls, service_type: str, model: Optional[str]) -> List[Tuple[str, str, BaseLLMService]]:
+        """
+        按config/agents.json中fallbacks配置的代理ID解析模型的降级链
+        
+        Args:
+            service_type: 服务类型
+            model: 模型名称
+            
+        Returns:
+            降级候选列表，每项为(服务类型, 模型, 底层服务实例)，每个实例带有一个由调用方释放的引用
+        """
+        config_service = ConfigService()
+        fallbacks = []
+        for agent_id in config_service.get_fallback_chain(model):
+            agent = config_service.get_agent_config(agent_id)
+            if not agent or not agent.get("enabled", True):
+                logger.warning(f"降级链中的代理配置不存在或未启用: {agent_id}")
+                continue
+            agent_config = agent.get("config", {})
+            fallback_type = os.environ.get("LLM_SERVICE_TYPE_OVERRIDE") or agent_config.get("service_type", service_type)
+            fallback_model = agent_config.get("model")
+            if (fallback_type, fallback_model) == (service_type, model) or fallback_type not in cls._service_classes:
+                continue
+            fallbacks.append((fallback_type, fallback_model, cls._acquire_upstream(fallback_type, fallback_model)))
+        return fallbacks
+    
+    @classmethod
+    def _wrap_service(cls, service: BaseLLMService, service_type: str) -> BaseLLMService:
+        """
+        按配置为底层服务增加包装层，由内到外依次为：重试/熔断/降级、并发请求合并、响应缓存
+        
+        Args:
+            service: 底层服务实例，包装后的服务关闭时释放对它的引用
+            service_type: 服务类型
             
-        service_instance = service_class(**kwargs)
+        Returns:
+            包装后的服务实例
+        """
+        config_service = ConfigService()
+        if config_service.get_config_value('llm.resilience.enabled', True):
+            model = service.model
+            service = ResilientLLMService(
+                service,
+                service_type,
+                fallback_resolver=lambda: cls._resolve_fallbacks(service_type, model),
+                retry_policy=RetryPolicy(
+                    max_retries=config_service.get_config_value('llm.resilience.max_retries', 3),
+                    base_delay=config_service.get_config_value('llm.resilience.backoff_base_seconds', 0.5),
+                    max_delay=config_service.get_config_value('llm.resilience.backoff_max_seconds', 8)
+                ),
+                hedge_enabled=config_service.get_config_value('llm.resilience.hedge.enabled', False),
+                hedge_percentile=config_service.get_config_value('llm.resilience.hedge.percentile', 95),
+                hedge_min_samples=config_service.get_config_value('llm.resilience.hedge.min_samples', 20),
+                hedge_min_delay=config_service.get_config_value('llm.resilience.hedge.min_delay_seconds', 1.0),
+                failure_threshold=config_service.get_config_value('llm.resilience.circuit_breaker.failure_threshold', 5),
+                reset_timeout=config_service.get_config_value('llm.resilience.circuit_breaker.reset_timeout_seconds', 30)
+            )
+        
+        if config_service.get_config_value('llm.single_flight.enabled', True):
+            service = SingleFlightLLMService(service)
+        
+        response_cache = cls.get_response_cache()
+        if response_cache is not None:
+            service = CachedLLMService(service, response_cache)
+        return service
+    
+    @classmethod
+    def get_response_cache(cls) -> Optional[LLMResponseCache]:
+        """
+        获取共享的LLM响应缓存，配置llm.cache.enabled为false时返回None
+        
+        Returns:
+            响应缓存实例
+        """
+        config_service = ConfigService()
+        if not config_service.get_config_value('llm.cache.enabled', True):
+            return None
+        
+        with cls._response_cache_lock:
+            if cls._response_cache is None:
+                path = config_service.get_config_value('llm.cache.path', 'data/llm_cache.sqlite3')
+                if not os.path.isabs(path):
+                    path = os.path.join(get_project_root(), path)
+                cls._response_cache = LLMResponseCache(
+                    path,
+                    ttl_seconds=config_service.get_config_value('llm.cache.ttl_seconds', 86400),
+                    max_entries=config_service.get_config_value('llm.cache.max_entries', 5000),
+                    max_size_mb=config_service.get_config_value('llm.cache.max_size_mb', 200)
+                )
+                logger.info(f"启用LLM响应缓存: {path}")
+            return cls._response_cache
+    
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """
+        获取所有缓存服务实例的运行统计
+        
+        Returns:
+            以服务缓存键为键的统计信息字典
+        """
+        with cls._instances_lock:
+            services = list(cls._service_instances.items())
+        return {cache_key: service.get_stats() for cache_key, service in services}
+    
+    @classmethod
+    def get_queue_depth(cls) -> int:
+        """
+        获取所有模型限流队列中等待的请求总数
         
-        # 缓存实例
-        cls._service_instances[cache_key] = service_instance
+        Returns:
+            排队中的请求数
+        """
+        return get_queue_depth()
+    
+    @classmethod
+    def is_overloaded(cls) -> bool:
+        """
+        判断排队请求数是否超过llm.rate_limit.max_queue_depth，超过时应拒绝新的请求
         
-        return service_instance
+        Returns:
+            是否过载
+        """
+        max_queue_depth = ConfigService().get_config_value('llm.rate_limit.max_queue_depth')
+        return bool(max_queue_depth) and cls.get_queue_depth() >= max_queue_depth
     
     @classmethod
     def register_service(cls, service_type: str, service_class: Type[BaseLLMService]) -> None:
@@ -81,4 +414,49 @@ class LLMServiceFactory:
             service_class: 服务类
         """
         cls._service_classes[service_type] = service_class
-        logger.info(f"注册新的LLM服务类型: {service_type}")
\ No newline at end of file
+        logger.info(f"注册新的LLM服务类型: {service_type}")
+    
+    @classmethod
+    def warmup_services(cls) -> Dict[str, int]:
+        """
+        为所有已启用代理配置的服务预热连接池
+        
+        Returns:
+            每个服务缓存键对应的成功预热连接数
+        """
+        config_service = ConfigService()
+        results = {}
+        for agent in config_service.get_agents_config().get("agents", []):
+            if not agent.get("enabled", True):
+                continue
+            agent_config = agent.get("config", {})
+            service_type = agent_config.get("service_type")
+            model = agent_config.get("model")
+            cache_key = f"{service_type}_{model}"
+            if cache_key in results:
+                continue
+            try:
+                service = cls.get_service(service_type=service_type, model=model)
+                results[cache_key] = service.warmup()
+            except Exception as e:
+                logger.warning(f"预热LLM服务失败: {cache_key}，错误: {str(e)}")
+                results[cache_key] = 0
+        return results
+    
+    @classmethod
+    async def aclose_services(cls) -> None:
+        """关闭并清空所有缓存的服务实例，释放它们持有的同步和异步连接池"""
+        with cls._instances_lock:
+            services = list(cls._service_instances.items())
+            # 只被降级链使用的底层服务没有对应的完整服务实例，需要单独关闭
+            services.extend((cache_key, service) for cache_key, service in cls._upstream_instances.items()
+                            if cache_key not in cls._service_instances)
+            cls._service_instances.clear()
+            cls._upstream_instances.clear()
+        
+        # 释放缓存持有的引用，完整服务关闭时会继续释放它对底层服务的引用
+        for cache_key, service in services:
+            try:
+                await service.aclose()
+            except Exception as e:
+                logger.warning(f"关闭LLM服务失败: {cache_key}，错误: {str(e)}")
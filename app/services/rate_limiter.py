@@ -0,0 +1,400 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import aclosing
+from typing import Dict, List, Optional, Any, Iterator, AsyncIterator
+
+from app.services.base_llm_service import LLMServiceWrapper
+from app.services.config_service import ConfigService
+from app.services.llm_metrics import llm_metrics
+from app.utils.token_utils import estimate_message_tokens
+from app.utils.logger import setup_logger
+
+logger = setup_logger("rate_limiter")
+
+
+class RateLimitTimeoutError(TimeoutError):
+    """请求在限流队列中等待超时"""
+    pass
+
+
+class TokenBucket:
+    """
+    令牌桶，按每分钟速率匀速补充，容量为一分钟的配额
+    """
+    
+    def __init__(self, per_minute: float):
+        """
+        初始化令牌桶
+        
+        Args:
+            per_minute: 每分钟补充的令牌数
+        """
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.per_minute / 60.0)
+        self.updated_at = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        计算取出指定数量令牌需要等待的时间
+        
+        Args:
+            amount: 需要的令牌数，超过容量时按容量计算，避免永远无法满足
+            now: 当前时间
+        
+        Returns:
+            需要等待的秒数，0表示可以立即取出
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.per_minute
+    
+    def consume(self, amount: float):
+        """取出令牌，允许余额为负以记录超额使用"""
+        self.tokens -= amount
+
+
+class _Waiter:
+    """限流队列中的等待者，同步调用使用线程事件，异步调用使用所在事件循环的事件"""
+    
+    def __init__(self, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.tokens = tokens
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+        self.enqueued_at = time.monotonic()
+    
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+
+class RatePermit:
+    """已获准的调用许可，释放时按实际消耗的token数校正令牌桶"""
+    
+    def __init__(self, limiter: "ModelRateLimiter", estimated_tokens: int, wait_seconds: float):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.wait_seconds = wait_seconds
+        self.released = False
+    
+    def release(self, actual_tokens: Optional[int] = None):
+        """
+        释放许可
+        
+        Args:
+            actual_tokens: 实际消耗的token数（来自usage.total_tokens），为None时不校正
+        """
+        if not self.released:
+            self.released = True
+            self.limiter._release(self, actual_tokens)
+
+
+class ModelRateLimiter:
+    """
+    单个模型的限流器，组合每分钟请求数(RPM)、每分钟token数(TPM)令牌桶和并发数信号量
+    
+    所有调用（同步和异步）进入同一个FIFO队列，只有队首的请求可以获准，保证先到先服务
+    """
+    
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 max_concurrency: Optional[int] = None, max_queue_wait: Optional[float] = None):
+        """
+        初始化限流器
+        
+        Args:
+            name: 限流器名称，通常为模型名称
+            rpm: 每分钟最大请求数，为None时不限制
+            tpm: 每分钟最大token数，为None时不限制
+            max_concurrency: 最大并发请求数，为None时不限制
+            max_queue_wait: 在队列中的最长等待时间（秒），为None时一直等待
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._queue: deque = deque()
+        self._active = 0
+        self._stats = {"admitted": 0, "timeouts": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+        self.configure(rpm, tpm, max_concurrency, max_queue_wait)
+    
+    def configure(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                  max_concurrency: Optional[int] = None, max_queue_wait: Optional[float] = None):
+        """更新限流参数，已在队列中的请求按新参数继续排队"""
+        with self._lock:
+            self.config = {"rpm": rpm, "tpm": tpm, "max_concurrency": max_concurrency, "max_queue_wait": max_queue_wait}
+            self._request_bucket = TokenBucket(rpm) if rpm else None
+            self._token_bucket = TokenBucket(tpm) if tpm else None
+            self.max_concurrency = max_concurrency
+            self.max_queue_wait = max_queue_wait
+            self._wake_head()
+    
+    def _try_admit(self, waiter: _Waiter):
+        """
+        尝试放行等待者，调用方需持有锁
+        
+        Returns:
+            (是否放行, 建议的等待秒数；None表示等待其他请求释放后被唤醒)
+        """
+        if not self._queue or self._queue[0] is not waiter:
+            return False, None
+        if self.max_concurrency and self._active >= self.max_concurrency:
+            return False, None
+        
+        now = time.monotonic()
+        delay = 0.0
+        if self._request_bucket is not None:
+            delay = max(delay, self._request_bucket.wait_time(1, now))
+        if self._token_bucket is not None:
+            delay = max(delay, self._token_bucket.wait_time(waiter.tokens, now))
+        if delay > 0:
+            return False, delay
+        
+        self._queue.popleft()
+        if self._request_bucket is not None:
+            self._request_bucket.consume(1)
+        if self._token_bucket is not None:
+            self._token_bucket.consume(waiter.tokens)
+        self._active += 1
+        
+        wait_seconds = now - waiter.enqueued_at
+        self._stats["admitted"] += 1
+        self._stats["total_wait_seconds"] += wait_seconds
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait_seconds)
+        
+        # 队首变化后唤醒新的队首
+        self._wake_head()
+        return True, wait_seconds
+    
+    def _wake_head(self):
+        if self._queue:
+            self._queue[0].wake()
+    
+    def _abandon(self, waiter: _Waiter):
+        """等待超时或被取消时移出队列"""
+        with self._lock:
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                pass
+            self._wake_head()
+    
+    def _enqueue(self, waiter: _Waiter, timeout: Optional[float]) -> Optional[float]:
+        """将等待者加入队列，返回等待截止时间"""
+        with self._lock:
+            self._queue.append(waiter)
+        timeout = timeout if timeout is not None else self.max_queue_wait
+        return waiter.enqueued_at + timeout if timeout else None
+    
+    def _timeout(self, waiter: _Waiter):
+        self._abandon(waiter)
+        with self._lock:
+            self._stats["timeouts"] += 1
+        raise RateLimitTimeoutError(f"模型{self.name}的限流队列等待超时")
+    
+    def acquire(self, tokens: int = 0, timeout: Optional[float] = None) -> RatePermit:
+        """
+        同步获取调用许可，按排队顺序阻塞直到获准
+        
+        Args:
+            tokens: 预计消耗的token数
+            timeout: 最长等待时间（秒），为None时使用配置的max_queue_wait
+        
+        Returns:
+            调用许可，调用结束后必须释放
+        """
+        waiter = _Waiter(tokens)
+        deadline = self._enqueue(waiter, timeout)
+        while True:
+            waiter.event.clear()
+            with self._lock:
+                admitted, delay = self._try_admit(waiter)
+            if admitted:
+                return RatePermit(self, tokens, delay)
+            
+            wait = delay
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeout(waiter)
+                wait = remaining if wait is None else min(wait, remaining)
+            waiter.event.wait(wait)
+    
+    async def aacquire(self, tokens: int = 0, timeout: Optional[float] = None) -> RatePermit:
+        """
+        异步获取调用许可，排队期间不阻塞事件循环
+        
+        Args:
+            tokens: 预计消耗的token数
+            timeout: 最长等待时间（秒），为None时使用配置的max_queue_wait
+        
+        Returns:
+            调用许可，调用结束后必须释放
+        """
+        waiter = _Waiter(tokens, loop=asyncio.get_running_loop())
+        deadline = self._enqueue(waiter, timeout)
+        try:
+            while True:
+                waiter.event.clear()
+                with self._lock:
+                    admitted, delay = self._try_admit(waiter)
+                if admitted:
+                    return RatePermit(self, tokens, delay)
+                
+                wait = delay
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeout(waiter)
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+    
+    def _release(self, permit: RatePermit, actual_tokens: Optional[int]):
+        with self._lock:
+            self._active -= 1
+            if actual_tokens is not None and self._token_bucket is not None:
+                # 按实际用量补扣或退还预估的差额
+                self._token_bucket.consume(actual_tokens - permit.estimated_tokens)
+            self._wake_head()
+    
+    @property
+    def queue_depth(self) -> int:
+        """当前排队等待的请求数"""
+        return len(self._queue)
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取限流统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._queue)
+            stats["active"] = self._active
+            stats.update(self.config)
+        stats["avg_wait_seconds"] = stats["total_wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+        return stats
+
+
+# 按模型共享的限流器，同一模型的所有服务实例共用一个配额
+_limiters: Dict[str, ModelRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    """
+    获取模型的限流器，配置来自config/agents.json的rate_limits，配置变化时自动更新
+    
+    Args:
+        model: 模型名称
+    
+    Returns:
+        限流器实例
+    """
+    config_service = ConfigService()
+    limits = config_service.get_rate_limit_config(model)
+    limit_args = {
+        "rpm": limits.get("rpm"),
+        "tpm": limits.get("tpm"),
+        "max_concurrency": limits.get("max_concurrency"),
+        "max_queue_wait": config_service.get_config_value("llm.rate_limit.max_queue_wait_seconds", 300),
+    }
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = ModelRateLimiter(model, **limit_args)
+            _limiters[model] = limiter
+            logger.info(f"创建模型限流器: {model}，配置: {limit_args}")
+    if limiter.config != limit_args:
+        logger.info(f"更新模型限流器: {model}，配置: {limit_args}")
+        limiter.configure(**limit_args)
+    return limiter
+
+
+def get_queue_depth() -> int:
+    """所有模型限流队列中等待的请求总数"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return sum(limiter.queue_depth for limiter in limiters)
+
+
+def _usage_tokens(response: Dict[str, Any]) -> Optional[int]:
+    """从响应或数据块的usage中读取总token数"""
+    usage = response.get("usage") or {}
+    return usage.get("total_tokens")
+
+
+class RateLimitedLLMService(LLMServiceWrapper):
+    """
+    在调用被包装服务前按模型限流的包装服务
+    
+    预计token数按消息内容在本地估算，调用结束后按响应中的usage校正
+    """
+    
+    def _limiter(self, model: Optional[str]) -> ModelRateLimiter:
+        return get_rate_limiter(model or self.model)
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """获准后调用的聊天补全"""
+        permit = self._limiter(model).acquire(estimate_message_tokens(messages))
+        llm_metrics.record_queue_wait(kwargs.get("agent_id"), model or self.model, permit.wait_seconds)
+        actual_tokens = None
+        try:
+            response = self.service.chat_completion(messages, model, **kwargs)
+            actual_tokens = _usage_tokens(response)
+            return response
+        finally:
+            permit.release(actual_tokens)
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """获准后调用的异步聊天补全"""
+        permit = await self._limiter(model).aacquire(estimate_message_tokens(messages))
+        llm_metrics.record_queue_wait(kwargs.get("agent_id"), model or self.model, permit.wait_seconds)
+        actual_tokens = None
+        try:
+            response = await self.service.achat_completion(messages, model, **kwargs)
+            actual_tokens = _usage_tokens(response)
+            return response
+        finally:
+            permit.release(actual_tokens)
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """获准后调用的流式聊天补全，流结束时释放许可"""
+        permit = self._limiter(model).acquire(estimate_message_tokens(messages))
+        llm_metrics.record_queue_wait(kwargs.get("agent_id"), model or self.model, permit.wait_seconds)
+        actual_tokens = None
+        try:
+            for chunk in self.service.stream_chat_completion(messages, model, **kwargs):
+                actual_tokens = _usage_tokens(chunk) or actual_tokens
+                yield chunk
+        finally:
+            permit.release(actual_tokens)
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """获准后调用的异步流式聊天补全，流结束、出错或被调用方关闭（含任务取消）时释放许可"""
+        permit = await self._limiter(model).aacquire(estimate_message_tokens(messages))
+        llm_metrics.record_queue_wait(kwargs.get("agent_id"), model or self.model, permit.wait_seconds)
+        actual_tokens = None
+        try:
+            async with aclosing(self.service.astream_chat_completion(messages, model, **kwargs)) as stream:
+                async for chunk in stream:
+                    actual_tokens = _usage_tokens(chunk) or actual_tokens
+                    yield chunk
+        finally:
+            permit.release(actual_tokens)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取被包装服务的统计信息，并附加限流统计"""
+        stats = self.service.get_stats()
+        stats["rate_limit"] = self._limiter(None).stats()
+        return stats
@@ -0,0 +1,257 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+from contextlib import aclosing
+from typing import Dict, List, Optional, Any, Iterator, AsyncIterator, Union
+
+from app.services.base_llm_service import BaseLLMService, assemble_stream_response
+from app.services.config_service import ConfigService
+from app.services.llm_cache import build_request_key
+from app.services.llm_service_factory import LLMServiceFactory
+from app.utils.file_utils import get_project_root
+from app.utils.token_utils import estimate_tokens
+from app.utils.logger import setup_logger
+
+logger = setup_logger("replay_service")
+
+# 流式回放时按约一个token切分内容：中文等宽字符单独成块，其余字符每4个一块
+_TOKEN_PIECE_PATTERN = re.compile(r'[⺀-鿿가-힯豈-﫿＀-￯]|[^⺀-鿿가-힯豈-﫿＀-￯]{1,4}', re.S)
+
+# 内置的延迟配置：ttft_seconds为首个token的等待时间，tokens_per_second为生成速度，0表示不限速
+DEFAULT_PROFILES = {
+    "instant": {"ttft_seconds": 0.0, "tokens_per_second": 0},
+}
+
+
+class ReplayMissError(KeyError):
+    """回放模式下没有找到请求对应的录制文件"""
+    pass
+
+
+class ReplayLLMService(BaseLLMService):
+    """
+    离线录制/回放LLM服务
+    
+    请求按模型、消息和采样参数计算哈希，每个请求的响应保存为fixtures目录下的一个JSON文件。
+    三种模式：
+        replay: 只回放，找不到录制文件时抛出ReplayMissError
+        record: 总是调用真实服务并覆盖录制文件
+        auto: 有录制文件时回放，否则调用真实服务并录制
+    回放时可按延迟配置模拟首token等待时间和生成速度，用于在无网络环境下测量端到端性能
+    """
+    
+    def __init__(self, model: Optional[str] = None, fixtures_dir: Optional[str] = None, mode: Optional[str] = None,
+                 profile: Optional[Union[str, Dict[str, float]]] = None, record_service_type: Optional[str] = None):
+        """
+        初始化回放服务，未传入的参数从配置llm.replay中读取
+        
+        Args:
+            model: 默认使用的模型名称
+            fixtures_dir: 录制文件目录，相对路径相对于项目根目录
+            mode: replay、record或auto
+            profile: 延迟配置名称（对应llm.replay.profiles）或配置字典
+            record_service_type: 录制时调用的真实服务类型
+        """
+        super().__init__(model=model)
+        config_service = ConfigService()
+        fixtures_dir = fixtures_dir or config_service.get_config_value('llm.replay.fixtures_dir', 'tests/fixtures/llm')
+        if not os.path.isabs(fixtures_dir):
+            fixtures_dir = os.path.join(get_project_root(), fixtures_dir)
+        self.fixtures_dir = fixtures_dir
+        self.mode = mode or os.environ.get("LLM_REPLAY_MODE") or config_service.get_config_value('llm.replay.mode', 'replay')
+        if self.mode not in ("replay", "record", "auto"):
+            raise ValueError(f"不支持的回放模式: {self.mode}，支持的模式有: replay, record, auto")
+        self.record_service_type = record_service_type or config_service.get_config_value('llm.replay.record_service_type', 'silicon_flow')
+        
+        profile = profile or os.environ.get("LLM_REPLAY_PROFILE") or config_service.get_config_value('llm.replay.profile', 'instant')
+        if isinstance(profile, str):
+            profiles = dict(DEFAULT_PROFILES, **config_service.get_config_value('llm.replay.profiles', {}))
+            if profile not in profiles:
+                raise ValueError(f"未配置的回放延迟配置: {profile}，可用的配置有: {', '.join(profiles)}")
+            profile = profiles[profile]
+        self.ttft_seconds = float(profile.get("ttft_seconds", 0.0))
+        self.tokens_per_second = float(profile.get("tokens_per_second", 0))
+        
+        self._upstream: Optional[BaseLLMService] = None
+        self._lock = threading.Lock()
+        self._stats = {"replayed": 0, "recorded": 0, "misses": 0}
+    
+    def _request_key(self, messages: List[Dict[str, str]], model: Optional[str], kwargs: Dict[str, Any]) -> str:
+        """计算请求哈希，与响应缓存一致，不包含服务层控制参数和stream"""
+        params = {key: value for key, value in kwargs.items() if key not in self.CONTROL_KWARGS and key != "stream"}
+        return build_request_key(model or self.model, messages, params)
+    
+    def _fixture_path(self, key: str) -> str:
+        return os.path.join(self.fixtures_dir, f"{key}.json")
+    
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+    
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取录制的响应，需要录制时返回None"""
+        path = self._fixture_path(key)
+        if self.mode != "record" and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                fixture = json.load(f)
+            self._count("replayed")
+            return fixture["response"]
+        if self.mode == "replay":
+            self._count("misses")
+            raise ReplayMissError(f"没有找到请求{key[:16]}的录制文件: {path}，请使用record或auto模式录制")
+        return None
+    
+    def _save(self, key: str, messages: List[Dict[str, str]], model: Optional[str], kwargs: Dict[str, Any],
+              response: Dict[str, Any], latency_seconds: float):
+        """原子地写入录制文件，同时保存请求内容便于人工检查"""
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        fixture = {
+            "key": key,
+            "model": model or self.model,
+            "messages": messages,
+            "params": {k: v for k, v in kwargs.items() if k not in self.CONTROL_KWARGS and k != "stream"},
+            "response": response,
+            "latency_seconds": latency_seconds,
+            "recorded_at": time.time()
+        }
+        path = self._fixture_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+        self._count("recorded")
+        logger.info(f"已录制LLM响应: {path}")
+    
+    def _get_upstream(self) -> BaseLLMService:
+        """录制时使用的真实服务，只经过限流层，回放服务关闭时释放对它的引用"""
+        if self._upstream is None:
+            upstream = LLMServiceFactory.get_upstream_service(self.record_service_type, self.model)
+            with self._lock:
+                if self._upstream is None:
+                    self._upstream, upstream = upstream, None
+            if upstream is not None:
+                upstream.close()
+        return self._upstream
+    
+    @staticmethod
+    def _completion_tokens(response: Dict[str, Any]) -> int:
+        """录制响应的生成token数，优先使用usage，缺失时本地估算"""
+        usage = response.get("usage") or {}
+        if usage.get("completion_tokens"):
+            return usage["completion_tokens"]
+        message = (response.get("choices") or [{}])[0].get("message") or {}
+        return estimate_tokens(message.get("content") or "") + estimate_tokens(message.get("reasoning_content") or "")
+    
+    def _generation_seconds(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+    
+    @staticmethod
+    def _stream_chunks(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """将完整响应切分为约每个token一块的流式数据块，推理内容在前"""
+        choice = (response.get("choices") or [{}])[0]
+        message = choice.get("message") or {}
+        base = {key: value for key, value in response.items() if key not in ("choices", "usage")}
+        base["object"] = "chat.completion.chunk"
+        chunks = []
+        for field in ("reasoning_content", "content"):
+            for piece in _TOKEN_PIECE_PATTERN.findall(message.get(field) or ""):
+                chunks.append(dict(base, choices=[{"index": 0, "delta": {field: piece}, "finish_reason": None}]))
+        last = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": choice.get("finish_reason") or "stop"}])
+        if response.get("usage"):
+            last["usage"] = response["usage"]
+        chunks.append(last)
+        return chunks
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """回放或录制聊天补全"""
+        key = self._request_key(messages, model, kwargs)
+        response = self._load(key)
+        if response is not None:
+            time.sleep(self.ttft_seconds + self._generation_seconds(self._completion_tokens(response)))
+            return response
+        
+        start_time = time.time()
+        response = self._get_upstream().chat_completion(messages, model, **kwargs)
+        self._save(key, messages, model, kwargs, response, time.time() - start_time)
+        return response
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """回放或录制异步聊天补全"""
+        key = self._request_key(messages, model, kwargs)
+        response = await asyncio.to_thread(self._load, key)
+        if response is not None:
+            await asyncio.sleep(self.ttft_seconds + self._generation_seconds(self._completion_tokens(response)))
+            return response
+        
+        start_time = time.time()
+        response = await self._get_upstream().achat_completion(messages, model, **kwargs)
+        await asyncio.to_thread(self._save, key, messages, model, kwargs, response, time.time() - start_time)
+        return response
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """回放或录制流式聊天补全，回放时按延迟配置逐块返回"""
+        key = self._request_key(messages, model, kwargs)
+        response = self._load(key)
+        if response is not None:
+            time.sleep(self.ttft_seconds)
+            token_delay = self._generation_seconds(1)
+            for chunk in self._stream_chunks(response):
+                yield chunk
+                if token_delay:
+                    time.sleep(token_delay)
+            return
+        
+        start_time = time.time()
+        chunks = []
+        for chunk in self._get_upstream().stream_chat_completion(messages, model, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self._save(key, messages, model, kwargs, assemble_stream_response(chunks), time.time() - start_time)
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """回放或录制异步流式聊天补全"""
+        key = self._request_key(messages, model, kwargs)
+        response = await asyncio.to_thread(self._load, key)
+        if response is not None:
+            await asyncio.sleep(self.ttft_seconds)
+            token_delay = self._generation_seconds(1)
+            for chunk in self._stream_chunks(response):
+                yield chunk
+                if token_delay:
+                    await asyncio.sleep(token_delay)
+            return
+        
+        start_time = time.time()
+        chunks = []
+        async with aclosing(self._get_upstream().astream_chat_completion(messages, model, **kwargs)) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        await asyncio.to_thread(self._save, key, messages, model, kwargs, assemble_stream_response(chunks), time.time() - start_time)
+    
+    def close(self):
+        """释放录制时使用的真实服务"""
+        with self._lock:
+            upstream, self._upstream = self._upstream, None
+        if upstream is not None:
+            upstream.close()
+    
+    async def aclose(self):
+        """异步释放录制时使用的真实服务"""
+        with self._lock:
+            upstream, self._upstream = self._upstream, None
+        if upstream is not None:
+            await upstream.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取回放统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mode"] = self.mode
+        return {"replay": stats}
+
+
+LLMServiceFactory.register_service("replay", ReplayLLMService)
@@ -0,0 +1,571 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from typing import Callable, Dict, List, Optional, Any, Iterator, AsyncIterator, Tuple
+
+import httpx
+import requests
+
+from app.services.base_llm_service import BaseLLMService, LLMServiceWrapper
+from app.utils.logger import setup_logger
+
+logger = setup_logger("resilience")
+
+# 可重试的HTTP状态码：限流和服务端错误
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器打开且没有可用的降级服务"""
+    pass
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """读取requests或httpx异常对应的HTTP状态码"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) if response is not None else None
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    判断异常是否为可重试的瞬时错误
+    
+    连接失败、超时以及429/5xx状态码可以重试，其余4xx说明请求本身有问题，重试和降级都无意义
+    
+    Args:
+        error: 调用抛出的异常
+    
+    Returns:
+        是否可以重试
+    """
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)):
+        return _status_code(error) in RETRYABLE_STATUS_CODES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              httpx.TransportError))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """读取响应中的Retry-After头（秒）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """带全抖动(full jitter)的指数退避重试策略"""
+    
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        """
+        初始化重试策略
+        
+        Args:
+            max_retries: 最大重试次数，不含首次调用
+            base_delay: 第一次重试的退避上限（秒）
+            max_delay: 单次退避的最大时长（秒）
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """
+        计算第attempt次重试前的等待时间，在[0, min(max_delay, base_delay * 2^attempt)]内均匀随机，
+        避免大量客户端同时重试。服务端返回Retry-After时以其为下限
+        
+        Args:
+            attempt: 重试序号，从0开始
+            error: 触发重试的异常
+        
+        Returns:
+            等待秒数
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，在冷却时间内拒绝调用；冷却结束后进入半开状态，
+    只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        初始化熔断器
+        
+        Args:
+            name: 熔断器名称
+            failure_threshold: 打开熔断器的连续失败次数
+            reset_timeout: 打开后进入半开状态前的冷却时间（秒）
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0}
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+    
+    def allow(self) -> bool:
+        """判断是否允许发起调用"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+    
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+    
+    def record_failure(self):
+        """记录一次可重试类型的失败"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._stats["opened"] += 1
+                    logger.warning(f"熔断器打开: {self.name}，连续失败{self._failures}次")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取熔断器状态和统计"""
+        state = self.state
+        with self._lock:
+            stats = dict(self._stats)
+            stats["consecutive_failures"] = self._failures
+        stats["state"] = state
+        return stats
+
+
+# 按(service_type, model)共享的熔断器，降级调用也会更新被降级模型的熔断状态
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(service_type: str, model: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    """
+    获取(service_type, model)对应的熔断器
+    
+    Args:
+        service_type: 服务类型
+        model: 模型名称
+        failure_threshold: 新建熔断器时使用的连续失败阈值
+        reset_timeout: 新建熔断器时使用的冷却时间（秒）
+    
+    Returns:
+        熔断器实例
+    """
+    key = (service_type, model)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(f"{service_type}_{model}", failure_threshold, reset_timeout)
+            _breakers[key] = breaker
+        return breaker
+
+
+class LatencyTracker:
+    """记录最近若干次成功调用的耗时，用于计算对冲请求的触发阈值"""
+    
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, percent: float, min_samples: int = 1) -> Optional[float]:
+        """
+        计算耗时分位数
+        
+        Args:
+            percent: 分位数，如95
+            min_samples: 最少样本数，样本不足时返回None
+        
+        Returns:
+            分位数对应的耗时（秒）
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+# 降级链中的一个候选：(服务类型, 模型, 服务实例)
+Candidate = Tuple[str, str, BaseLLMService]
+
+
+class ResilientLLMService(LLMServiceWrapper):
+    """
+    为LLM服务增加重试、对冲请求、熔断和降级的包装服务
+    
+    - 429/5xx和网络错误按指数退避加抖动重试
+    - 开启对冲时，调用耗时超过最近p95后再发起一个相同请求，取先返回的结果，降低尾延迟
+    - 每个(service_type, model)有独立熔断器，主服务熔断或重试耗尽后依次尝试降级链中的服务
+    - 流式调用只在返回第一个数据块之前重试和降级
+    """
+    
+    def __init__(self, service: BaseLLMService, service_type: str,
+                 fallback_resolver: Optional[Callable[[], List[Candidate]]] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 hedge_enabled: bool = False, hedge_percentile: float = 95, hedge_min_samples: int = 20,
+                 hedge_min_delay: float = 1.0, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        初始化容错包装服务
+        
+        Args:
+            service: 被包装的LLM服务
+            service_type: 服务类型，与模型一起确定熔断器
+            fallback_resolver: 返回降级候选列表的函数，在首次降级时调用，本服务关闭时关闭返回的降级服务
+            retry_policy: 重试策略
+            hedge_enabled: 是否开启对冲请求
+            hedge_percentile: 触发对冲的耗时分位数
+            hedge_min_samples: 计算分位数所需的最少样本数，样本不足时不对冲
+            hedge_min_delay: 对冲等待时间的下限（秒）
+            failure_threshold: 熔断器连续失败阈值
+            reset_timeout: 熔断器冷却时间（秒）
+        """
+        super().__init__(service)
+        self.service_type = service_type
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._fallback_resolver = fallback_resolver
+        self._fallbacks: Optional[List[Candidate]] = None
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0, "short_circuited": 0, "failures": 0}
+    
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+    
+    def _candidates(self, model: Optional[str]) -> List[Tuple[str, Optional[str], BaseLLMService]]:
+        """主服务在前、降级服务在后的候选列表，主服务保留调用时指定的模型"""
+        if self._fallbacks is None:
+            resolved = self._fallback_resolver() if self._fallback_resolver else []
+            with self._lock:
+                if self._fallbacks is None:
+                    self._fallbacks, resolved = [candidate for candidate in resolved if candidate[2] is not self.service], []
+            # 并发解析时只保留先完成的结果，关闭多余的降级服务以释放它们的引用
+            for _, _, service in resolved:
+                service.close()
+        candidates = [(self.service_type, model, self.service)]
+        candidates.extend((service_type, None, service) for service_type, _, service in self._fallbacks)
+        return candidates
+    
+    def _breaker(self, service_type: str, model: Optional[str], service: BaseLLMService) -> CircuitBreaker:
+        return get_circuit_breaker(service_type, model or service.model, self.failure_threshold, self.reset_timeout)
+    
+    def _tracker(self, model: str) -> LatencyTracker:
+        with self._lock:
+            tracker = self._latency.get(model)
+            if tracker is None:
+                tracker = self._latency[model] = LatencyTracker()
+            return tracker
+    
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        """对冲等待时间，未开启或样本不足时返回None"""
+        if not self.hedge_enabled:
+            return None
+        p = self._tracker(model).percentile(self.hedge_percentile, self.hedge_min_samples)
+        return max(p, self.hedge_min_delay) if p is not None else None
+    
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+            return self._hedge_executor
+    
+    def _call_once(self, service: BaseLLMService, messages, model, kwargs) -> Dict[str, Any]:
+        """同步执行一次调用，超过对冲阈值仍未返回时发起第二个相同请求，返回先成功的结果"""
+        resolved_model = model or service.model
+        hedge_delay = self._hedge_delay(resolved_model)
+        start_time = time.monotonic()
+        if hedge_delay is None:
+            response = service.chat_completion(messages, model, **kwargs)
+            self._tracker(resolved_model).record(time.monotonic() - start_time)
+            return response
+        
+        executor = self._get_hedge_executor()
+        primary = executor.submit(service.chat_completion, messages, model, **kwargs)
+        done, _ = wait_futures([primary], timeout=hedge_delay)
+        pending = [primary]
+        if not done:
+            self._count("hedged")
+            pending.append(executor.submit(service.chat_completion, messages, model, **kwargs))
+        
+        error = None
+        while pending:
+            done, _ = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    self._tracker(resolved_model).record(time.monotonic() - start_time)
+                    # 落后的请求无法中断，其结果直接丢弃
+                    return future.result()
+                error = future.exception()
+        raise error
+    
+    async def _acall_once(self, service: BaseLLMService, messages, model, kwargs) -> Dict[str, Any]:
+        """异步执行一次调用，对冲请求返回后取消落后的请求"""
+        resolved_model = model or service.model
+        hedge_delay = self._hedge_delay(resolved_model)
+        start_time = time.monotonic()
+        if hedge_delay is None:
+            response = await service.achat_completion(messages, model, **kwargs)
+            self._tracker(resolved_model).record(time.monotonic() - start_time)
+            return response
+        
+        primary = asyncio.ensure_future(service.achat_completion(messages, model, **kwargs))
+        done, _ = await asyncio.wait([primary], timeout=hedge_delay)
+        pending = {primary}
+        if not done:
+            self._count("hedged")
+            pending.add(asyncio.ensure_future(service.achat_completion(messages, model, **kwargs)))
+        
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        self._tracker(resolved_model).record(time.monotonic() - start_time)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def _should_retry(self, error: BaseException, attempt: int, breaker: CircuitBreaker) -> bool:
+        """记录失败并判断是否继续在同一服务上重试"""
+        if not is_retryable_error(error):
+            return False
+        breaker.record_failure()
+        return attempt < self.retry_policy.max_retries and breaker.state == CircuitBreaker.CLOSED
+    
+    def _log_fallback(self, service_type: str, service: BaseLLMService, error: Optional[BaseException]):
+        self._count("fallbacks")
+        logger.warning(f"LLM服务{service_type}_{service.model}不可用，尝试降级链中的下一个服务，错误: {error}")
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """带重试、对冲、熔断和降级的聊天补全"""
+        self._count("calls")
+        last_error = None
+        for index, (service_type, candidate_model, service) in enumerate(self._candidates(model)):
+            if index > 0:
+                self._log_fallback(service_type, service, last_error)
+            breaker = self._breaker(service_type, candidate_model, service)
+            if not breaker.allow():
+                self._count("short_circuited")
+                continue
+            attempt = 0
+            while True:
+                try:
+                    response = self._call_once(service, messages, candidate_model, kwargs)
+                    breaker.record_success()
+                    return response
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable_error(e):
+                        # 请求本身有问题说明服务可达，不计入熔断
+                        breaker.record_success()
+                        self._count("failures")
+                        raise
+                    if not self._should_retry(e, attempt, breaker):
+                        break
+                    delay = self.retry_policy.backoff(attempt, e)
+                    logger.warning(f"LLM调用失败，{delay:.2f}秒后第{attempt + 1}次重试，错误: {str(e)}")
+                    self._count("retries")
+                    time.sleep(delay)
+                    attempt += 1
+        self._count("failures")
+        raise last_error or CircuitOpenError(f"LLM服务{self.service_type}_{model or self.model}已熔断且没有可用的降级服务")
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """带重试、对冲、熔断和降级的异步聊天补全"""
+        self._count("calls")
+        last_error = None
+        for index, (service_type, candidate_model, service) in enumerate(self._candidates(model)):
+            if index > 0:
+                self._log_fallback(service_type, service, last_error)
+            breaker = self._breaker(service_type, candidate_model, service)
+            if not breaker.allow():
+                self._count("short_circuited")
+                continue
+            attempt = 0
+            while True:
+                try:
+                    response = await self._acall_once(service, messages, candidate_model, kwargs)
+                    breaker.record_success()
+                    return response
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable_error(e):
+                        # 请求本身有问题说明服务可达，不计入熔断
+                        breaker.record_success()
+                        self._count("failures")
+                        raise
+                    if not self._should_retry(e, attempt, breaker):
+                        break
+                    delay = self.retry_policy.backoff(attempt, e)
+                    logger.warning(f"LLM调用失败，{delay:.2f}秒后第{attempt + 1}次重试，错误: {str(e)}")
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        self._count("failures")
+        raise last_error or CircuitOpenError(f"LLM服务{self.service_type}_{model or self.model}已熔断且没有可用的降级服务")
+    
+    def stream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """流式聊天补全，在返回第一个数据块之前失败时重试或降级"""
+        self._count("calls")
+        last_error = None
+        for index, (service_type, candidate_model, service) in enumerate(self._candidates(model)):
+            if index > 0:
+                self._log_fallback(service_type, service, last_error)
+            breaker = self._breaker(service_type, candidate_model, service)
+            if not breaker.allow():
+                self._count("short_circuited")
+                continue
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    for chunk in service.stream_chat_completion(messages, candidate_model, **kwargs):
+                        started = True
+                        yield chunk
+                    breaker.record_success()
+                    return
+                except Exception as e:
+                    last_error = e
+                    if started or not is_retryable_error(e):
+                        if is_retryable_error(e):
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        self._count("failures")
+                        raise
+                    if not self._should_retry(e, attempt, breaker):
+                        break
+                    self._count("retries")
+                    time.sleep(self.retry_policy.backoff(attempt, e))
+                    attempt += 1
+        self._count("failures")
+        raise last_error or CircuitOpenError(f"LLM服务{self.service_type}_{model or self.model}已熔断且没有可用的降级服务")
+    
+    async def astream_chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """异步流式聊天补全，在返回第一个数据块之前失败时重试或降级"""
+        self._count("calls")
+        last_error = None
+        for index, (service_type, candidate_model, service) in enumerate(self._candidates(model)):
+            if index > 0:
+                self._log_fallback(service_type, service, last_error)
+            breaker = self._breaker(service_type, candidate_model, service)
+            if not breaker.allow():
+                self._count("short_circuited")
+                continue
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    async with aclosing(service.astream_chat_completion(messages, candidate_model, **kwargs)) as stream:
+                        async for chunk in stream:
+                            started = True
+                            yield chunk
+                    breaker.record_success()
+                    return
+                except Exception as e:
+                    last_error = e
+                    if started or not is_retryable_error(e):
+                        if is_retryable_error(e):
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        self._count("failures")
+                        raise
+                    if not self._should_retry(e, attempt, breaker):
+                        break
+                    self._count("retries")
+                    await asyncio.sleep(self.retry_policy.backoff(attempt, e))
+                    attempt += 1
+        self._count("failures")
+        raise last_error or CircuitOpenError(f"LLM服务{self.service_type}_{model or self.model}已熔断且没有可用的降级服务")
+    
+    def _release_resources(self) -> List[Candidate]:
+        """关闭对冲线程池，返回需要关闭的降级服务，重复调用时返回空列表"""
+        with self._lock:
+            executor, self._hedge_executor = self._hedge_executor, None
+            fallbacks, self._fallbacks = self._fallbacks or [], []
+        if executor is not None:
+            executor.shutdown(wait=False)
+        return fallbacks
+    
+    def close(self):
+        """关闭对冲线程池、降级服务和被包装的服务"""
+        for _, _, service in self._release_resources():
+            service.close()
+        self.service.close()
+    
+    async def aclose(self):
+        """关闭对冲线程池，异步关闭降级服务和被包装的服务"""
+        for _, _, service in self._release_resources():
+            await service.aclose()
+        await self.service.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取被包装服务的统计信息，并附加容错统计"""
+        stats = self.service.get_stats()
+        with self._lock:
+            resilience = dict(self._stats)
+        resilience["circuit_breaker"] = self._breaker(self.service_type, None, self.service).stats()
+        resilience["p95_latency_seconds"] = self._tracker(self.model).percentile(95)
+        stats["resilience"] = resilience
+        return stats
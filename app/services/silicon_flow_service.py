@@ -1,24 +1,42 @@
 import os
+import asyncio
+import httpx
 import requests
-from typing import Dict, List, Optional, Any, Union
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Any, Union, Tuple, Iterator, AsyncIterator
 import time
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # 加载.env文件中的环境变量
 load_dotenv()
 
-from app.services.base_llm_service import BaseLLMService
+from app.services.base_llm_service import BaseLLMService, assemble_stream_response
+from app.services.config_service import ConfigService
 from app.utils.logger import setup_logger
 
 logger = setup_logger("silicon_flow_service")
 
+# 流式输出结束标记
+_STREAM_DONE = object()
+
 class SiliconFlowService(BaseLLMService):
     """
     硅基流动API服务实现
     """
     
-    def __init__(self, api_key: Optional[str] = None, api_base: Optional[str] = None, model: Optional[str] = None):
+    # 连接池会话缓存 - 同一api_base的所有服务实例共享一个keep-alive连接池
+    _sessions: Dict[Tuple[str, int, int], requests.Session] = {}
+    _sessions_lock = threading.Lock()
+    # 异步HTTP客户端缓存 - 值为(事件循环, 客户端)
+    _async_clients: Dict[Tuple[str, int, int], Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+    # 共享连接池的引用计数，最后一个使用它的服务实例关闭时才真正关闭连接池
+    _session_refs: Dict[Tuple[str, int, int], int] = {}
+    
+    def __init__(self, api_key: Optional[str] = None, api_base: Optional[str] = None, model: Optional[str] = None,
+                 pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None):
         """
         初始化硅基流动API服务
         
@@ -26,6 +44,8 @@ class SiliconFlowService(BaseLLMService):
             api_key: API密钥，如果为None则从环境变量获取
             api_base: API基础URL，如果为None则从环境变量获取
             model: 模型名称，如果为None则从环境变量获取
+            pool_connections: 连接池数量，如果为None则从配置llm.http.pool_connections获取
+            pool_maxsize: 每个连接池的最大连接数，如果为None则从配置llm.http.pool_maxsize获取
         """
         self.api_key = api_key or os.environ.get("SILICON_FLOW_API_KEY")
         self.api_base = api_base or os.environ.get("SILICON_FLOW_API_BASE", "https://api.siliconflow.cn/v1")
@@ -38,6 +58,112 @@ class SiliconFlowService(BaseLLMService):
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        
+        # HTTP连接配置
+        config_service = ConfigService()
+        self.pool_connections = pool_connections or config_service.get_config_value('llm.http.pool_connections', 4)
+        self.pool_maxsize = pool_maxsize or config_service.get_config_value('llm.http.pool_maxsize', 16)
+        self.timeout = (
+            config_service.get_config_value('llm.http.connect_timeout', 10),
+            config_service.get_config_value('llm.http.read_timeout', 3000)
+        )
+        self.session = self._get_session(self.api_base, self.pool_connections, self.pool_maxsize)
+        with self._sessions_lock:
+            self._session_refs[self._session_key] = self._session_refs.get(self._session_key, 0) + 1
+        self._closed = False
+    
+    @property
+    def _session_key(self) -> Tuple[str, int, int]:
+        return (self.api_base, self.pool_connections, self.pool_maxsize)
+    
+    @classmethod
+    def _get_session(cls, api_base: str, pool_connections: int, pool_maxsize: int) -> requests.Session:
+        """
+        获取指定api_base的共享会话，不存在时创建
+        
+        Args:
+            api_base: API基础URL
+            pool_connections: 连接池数量
+            pool_maxsize: 每个连接池的最大连接数
+            
+        Returns:
+            启用keep-alive连接池的requests会话
+        """
+        session_key = (api_base, pool_connections, pool_maxsize)
+        with cls._sessions_lock:
+            session = cls._sessions.get(session_key)
+            if session is None:
+                logger.info(f"创建HTTP连接池: {api_base}，pool_connections={pool_connections}，pool_maxsize={pool_maxsize}")
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._sessions[session_key] = session
+            return session
+    
+    def warmup(self, connections: Optional[int] = None) -> int:
+        """
+        预热连接池，提前完成TCP+TLS握手，使首次调用不再承担建连开销
+        
+        Args:
+            connections: 预热的连接数，如果为None则从配置llm.http.warmup_connections获取
+            
+        Returns:
+            成功建立的连接数
+        """
+        if connections is None:
+            connections = ConfigService().get_config_value('llm.http.warmup_connections', 2)
+        connections = max(1, min(connections, self.pool_maxsize))
+        
+        def _connect(_):
+            try:
+                # 只需要建立连接，响应状态码无关紧要
+                response = self.session.get(f"{self.api_base}/models", headers=self.headers, timeout=self.timeout[0])
+                response.close()
+                return True
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"预热连接失败: {str(e)}")
+                return False
+        
+        start_time = time.time()
+        # 并发请求才能让连接池中同时保留多个连接
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            warmed = sum(executor.map(_connect, range(connections)))
+        logger.info(f"连接池预热完成: {self.api_base}，成功{warmed}/{connections}个连接，耗时: {time.time() - start_time:.2f}秒")
+        return warmed
+    
+    def _release(self) -> Optional[Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]]:
+        """
+        释放当前实例对共享连接池的引用，重复调用不会重复释放
+        
+        Returns:
+            最后一个引用释放时需要关闭的异步客户端及其事件循环，否则为None
+        """
+        with self._sessions_lock:
+            if self._closed:
+                return None
+            self._closed = True
+            refs = self._session_refs.get(self._session_key, 0) - 1
+            if refs > 0:
+                self._session_refs[self._session_key] = refs
+                return None
+            self._session_refs.pop(self._session_key, None)
+            session = self._sessions.pop(self._session_key, None)
+            entry = self._async_clients.pop(self._session_key, None)
+        if session is not None:
+            logger.info(f"关闭HTTP连接池: {self.api_base}")
+            session.close()
+        return entry
+    
+    def close(self):
+        """
+        释放当前服务对共享连接池的引用，没有其他服务实例使用时关闭同步会话和异步客户端
+        
+        异步客户端绑定在创建它的事件循环上，事件循环仍在运行时提交到该事件循环关闭
+        """
+        entry = self._release()
+        if entry is not None and entry[0].is_running():
+            asyncio.run_coroutine_threadsafe(entry[1].aclose(), entry[0])
     
     def chat_completion(self, 
                         messages: List[Dict[str, str]], 
@@ -59,7 +185,7 @@ class SiliconFlowService(BaseLLMService):
             model: 模型名称，如果为None则使用实例的默认模型
             temperature: 温度参数，控制随机性，范围0-1
             max_tokens: 最大生成token数
-            stream: 是否流式输出
+            stream: 是否流式输出，为True时以流式方式请求并合并为完整结果返回
             top_p: 核采样参数
             top_k: 保留概率最高的k个token
             frequency_penalty: 频率惩罚参数
@@ -71,7 +197,199 @@ class SiliconFlowService(BaseLLMService):
             API返回结果
         """
         url = f"{self.api_base}/chat/completions"
+        payload = self._build_payload(messages, model, temperature, max_tokens, stream, top_p, top_k,
+                                      frequency_penalty, presence_penalty, stop, **kwargs)
         
+        if stream:
+            return assemble_stream_response(self._post_stream(payload))
+        
+        try:
+            logger.info(f"发送请求到硅基流动API: {url}，使用模型: {payload['model']}")
+            start_time = time.time()
+            
+            # 通过共享会话复用keep-alive连接，超时参数为(连接超时, 读取超时)
+            response = self.session.post(url, json=payload, headers=self.headers, timeout=self.timeout)
+            response.raise_for_status()
+            
+            end_time = time.time()
+            logger.info(f"硅基流动API请求完成，耗时: {end_time - start_time:.2f}秒")
+            
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"硅基流动API请求失败: {str(e)}")
+            if hasattr(e, 'response') and e.response:
+                logger.error(f"错误响应: {e.response.text}")
+            raise
+    
+    async def achat_completion(self, 
+                               messages: List[Dict[str, str]], 
+                               model: Optional[str] = None,
+                               **kwargs) -> Dict[str, Any]:
+        """
+        使用原生异步HTTP客户端调用硅基流动聊天补全API，等待响应期间不阻塞事件循环
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+            model: 模型名称，如果为None则使用实例的默认模型
+            **kwargs: 其他参数，与chat_completion一致
+            
+        Returns:
+            API返回结果
+        """
+        if kwargs.get("stream"):
+            chunks = [chunk async for chunk in self.astream_chat_completion(messages, model, **kwargs)]
+            return assemble_stream_response(chunks)
+        
+        url = f"{self.api_base}/chat/completions"
+        payload = self._build_payload(messages, model, **kwargs)
+        client = self._get_async_client()
+        
+        try:
+            logger.info(f"发送异步请求到硅基流动API: {url}，使用模型: {payload['model']}")
+            start_time = time.time()
+            
+            response = await client.post(url, json=payload, headers=self.headers)
+            response.raise_for_status()
+            
+            end_time = time.time()
+            logger.info(f"硅基流动API异步请求完成，耗时: {end_time - start_time:.2f}秒")
+            
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"硅基流动API异步请求失败: {str(e)}")
+            if isinstance(e, httpx.HTTPStatusError):
+                logger.error(f"错误响应: {e.response.text}")
+            raise
+    
+    def stream_chat_completion(self, 
+                               messages: List[Dict[str, str]], 
+                               model: Optional[str] = None,
+                               **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        以SSE流式方式调用硅基流动聊天补全API，逐个返回增量数据块
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+            model: 模型名称，如果为None则使用实例的默认模型
+            **kwargs: 其他参数，与chat_completion一致
+            
+        Returns:
+            增量数据块迭代器，格式为{"choices": [{"delta": {"content": "..."}}]}
+        """
+        kwargs["stream"] = True
+        payload = self._build_payload(messages, model, **kwargs)
+        yield from self._post_stream(payload)
+    
+    async def astream_chat_completion(self, 
+                                      messages: List[Dict[str, str]], 
+                                      model: Optional[str] = None,
+                                      **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        使用异步HTTP客户端以SSE流式方式调用硅基流动聊天补全API
+        
+        Args:
+            messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+            model: 模型名称，如果为None则使用实例的默认模型
+            **kwargs: 其他参数，与chat_completion一致
+            
+        Returns:
+            增量数据块异步迭代器，格式为{"choices": [{"delta": {"content": "..."}}]}
+        """
+        url = f"{self.api_base}/chat/completions"
+        kwargs["stream"] = True
+        payload = self._build_payload(messages, model, **kwargs)
+        client = self._get_async_client()
+        
+        try:
+            logger.info(f"发送异步流式请求到硅基流动API: {url}，使用模型: {payload['model']}")
+            start_time = time.time()
+            first_chunk = True
+            
+            async with client.stream("POST", url, json=payload, headers=self.headers) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                
+                async for line in response.aiter_lines():
+                    chunk = self._parse_sse_line(line)
+                    if chunk is None:
+                        continue
+                    if chunk is _STREAM_DONE:
+                        break
+                    if first_chunk:
+                        logger.info(f"硅基流动API首个数据块耗时: {time.time() - start_time:.2f}秒")
+                        first_chunk = False
+                    yield chunk
+            
+            logger.info(f"硅基流动API异步流式请求完成，耗时: {time.time() - start_time:.2f}秒")
+        except httpx.HTTPError as e:
+            logger.error(f"硅基流动API异步流式请求失败: {str(e)}")
+            if isinstance(e, httpx.HTTPStatusError):
+                logger.error(f"错误响应: {e.response.text}")
+            raise
+    
+    def _post_stream(self, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """发送流式请求并逐个返回解析后的数据块"""
+        url = f"{self.api_base}/chat/completions"
+        
+        try:
+            logger.info(f"发送流式请求到硅基流动API: {url}，使用模型: {payload['model']}")
+            start_time = time.time()
+            first_chunk = True
+            
+            with self.session.post(url, json=payload, headers=self.headers, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                
+                # 按字节切分行后再解码，避免多字节字符被截断
+                for line in response.iter_lines():
+                    chunk = self._parse_sse_line(line.decode("utf-8"))
+                    if chunk is None:
+                        continue
+                    if chunk is _STREAM_DONE:
+                        break
+                    if first_chunk:
+                        logger.info(f"硅基流动API首个数据块耗时: {time.time() - start_time:.2f}秒")
+                        first_chunk = False
+                    yield chunk
+            
+            logger.info(f"硅基流动API流式请求完成，耗时: {time.time() - start_time:.2f}秒")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"硅基流动API流式请求失败: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
+                logger.error(f"错误响应: {e.response.text}")
+            raise
+    
+    @staticmethod
+    def _parse_sse_line(line: str) -> Any:
+        """
+        解析一行SSE数据
+        
+        Returns:
+            数据块字典；非数据行返回None；结束标记返回_STREAM_DONE
+        """
+        line = line.strip()
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return _STREAM_DONE
+        if not data:
+            return None
+        return json.loads(data)
+    
+    def _build_payload(self, 
+                       messages: List[Dict[str, str]], 
+                       model: Optional[str] = None,
+                       temperature: float = 0.1,
+                       max_tokens: int = 16384,
+                       stream: bool = False,
+                       top_p: float = 0.1,
+                       top_k: int = 50,
+                       frequency_penalty: float = 0.0,
+                       presence_penalty: float = 0.0,
+                       stop: Optional[Union[str, List[str]]] = None,
+                       **kwargs) -> Dict[str, Any]:
+        """构建聊天补全请求体，参数含义与chat_completion一致"""
         # 构建请求参数，优先使用传入的model，否则使用实例的model属性
         payload = {
             "model": model or self.model,
@@ -89,25 +407,41 @@ class SiliconFlowService(BaseLLMService):
         if stop:
             payload["stop"] = stop
         
-        # 添加其他自定义参数
+        # 添加其他自定义参数，服务层的控制参数不发送给接口
         for key, value in kwargs.items():
-            payload[key] = value
+            if key not in self.CONTROL_KWARGS:
+                payload[key] = value
         
-        try:
-            logger.info(f"发送请求到硅基流动API: {url}，使用模型: {payload['model']}")
-            start_time = time.time()
-            
-            # 添加超时参数（连接10秒，读取300秒）
-            response = requests.post(url, json=payload, headers=self.headers, timeout=(10, 3000))
-            response.raise_for_status()
-            
-            end_time = time.time()
-            logger.info(f"硅基流动API请求完成，耗时: {end_time - start_time:.2f}秒")
-            
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"硅基流动API请求失败: {str(e)}")
-            if hasattr(e, 'response') and e.response:
-                logger.error(f"错误响应: {e.response.text}")
-            raise
+        return payload
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        获取当前事件循环下共享的异步HTTP客户端，不存在时创建
+        
+        httpx.AsyncClient的连接绑定在创建它的事件循环上，因此按事件循环区分
+        """
+        loop = asyncio.get_running_loop()
+        client_key = self._session_key
+        with self._sessions_lock:
+            entry = self._async_clients.get(client_key)
+            if entry is None or entry[0] is not loop or entry[1].is_closed:
+                config_service = ConfigService()
+                limits = httpx.Limits(
+                    max_connections=config_service.get_config_value('llm.http.async_max_connections', 100),
+                    max_keepalive_connections=self.pool_maxsize
+                )
+                timeout = httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+                entry = (loop, httpx.AsyncClient(limits=limits, timeout=timeout))
+                self._async_clients[client_key] = entry
+            return entry[1]
     
+    async def aclose(self):
+        """释放当前服务对共享连接池的引用，异步客户端属于当前事件循环时直接等待其关闭"""
+        entry = self._release()
+        if entry is None:
+            return
+        loop, client = entry
+        if loop is asyncio.get_running_loop():
+            await client.aclose()
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
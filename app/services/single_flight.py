@@ -0,0 +1,106 @@
+import copy
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Any
+
+from app.services.base_llm_service import BaseLLMService, LLMServiceWrapper
+from app.services.llm_cache import build_request_key
+
+
+class SingleFlightLLMService(LLMServiceWrapper):
+    """
+    合并并发相同请求的包装服务
+    
+    同一时刻规范化请求相同的多个调用只会向上游发送一次请求，其余调用等待并共享该结果。
+    同步和异步调用共用同一张在途请求表，因此两种调用方式之间也可以互相合并。
+    流式调用的增量内容无法共享，由基类直接透传给被包装的服务
+    """
+    
+    def __init__(self, service: BaseLLMService):
+        """
+        初始化请求合并服务
+        
+        Args:
+            service: 被包装的LLM服务
+        """
+        super().__init__(service)
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._stats = {"calls": 0, "upstream_calls": 0, "coalesced": 0}
+    
+    def _flight_key(self, messages: List[Dict[str, str]], model: Optional[str], kwargs: Dict[str, Any]) -> str:
+        """计算在途请求的合并键"""
+        params = {key: value for key, value in kwargs.items() if key not in self.CONTROL_KWARGS}
+        return build_request_key(model or self.model, messages, params)
+    
+    def _join_or_lead(self, key: str):
+        """
+        加入已有的在途请求，或登记为新请求的发起方
+        
+        Returns:
+            (在途请求的Future, 是否为发起方)
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self._stats["upstream_calls"] += 1
+            return future, True
+    
+    def _finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        """移除在途请求并通知所有等待方"""
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def chat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """合并并发相同请求的聊天补全"""
+        key = self._flight_key(messages, model, kwargs)
+        future, is_leader = self._join_or_lead(key)
+        if not is_leader:
+            # 返回副本，避免多个调用方共享同一个可变对象
+            return copy.deepcopy(future.result())
+        
+        try:
+            result = self.service.chat_completion(messages, model, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+    
+    async def achat_completion(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """合并并发相同请求的异步聊天补全"""
+        key = self._flight_key(messages, model, kwargs)
+        future, is_leader = self._join_or_lead(key)
+        if not is_leader:
+            return copy.deepcopy(await asyncio.wrap_future(future))
+        
+        async def _lead():
+            try:
+                result = await self.service.achat_completion(messages, model, **kwargs)
+            except BaseException as e:
+                self._finish(key, future, error=e)
+                raise
+            self._finish(key, future, result=result)
+            return result
+        
+        # 发起方被取消（如客户端断开）时上游请求继续执行，等待方仍能拿到结果
+        return await asyncio.shield(asyncio.ensure_future(_lead()))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取被包装服务的统计信息，并附加请求合并统计"""
+        stats = self.service.get_stats()
+        with self._lock:
+            single_flight = dict(self._stats)
+            single_flight["in_flight"] = len(self._in_flight)
+        stats["single_flight"] = single_flight
+        return stats
@@ -0,0 +1,166 @@
+import time
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Type
+
+from app.services.config_service import ConfigService
+from app.services.llm_metrics import collect_usage
+from app.utils.stage_timer import StageTimer
+
+
+class SpeculationStats:
+    """推测执行统计：命中率、浪费的token和命中时提前开始生成的时间"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._stats = {
+                "attempts": 0,
+                "hits": 0,
+                "misses": 0,
+                "failures": 0,
+                "wasted_prompt_tokens": 0,
+                "wasted_completion_tokens": 0,
+                "wasted_calls": 0,
+                "head_start_seconds": 0.0,
+            }
+    
+    def record(self, outcome: str, head_start_seconds: float = 0.0):
+        with self._lock:
+            self._stats["attempts"] += 1
+            self._stats[outcome] += 1
+            self._stats["head_start_seconds"] += head_start_seconds
+    
+    def record_waste(self, usage: List[Dict[str, int]]):
+        with self._lock:
+            self._stats["wasted_calls"] += len(usage)
+            self._stats["wasted_prompt_tokens"] += sum(item.get("prompt_tokens", 0) for item in usage)
+            self._stats["wasted_completion_tokens"] += sum(item.get("completion_tokens", 0) for item in usage)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+        
+        Returns:
+            计数、浪费的token数，以及hit_rate（命中次数/推测次数）
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["hits"] / stats["attempts"] if stats["attempts"] else None
+        return stats
+
+
+speculation_stats = SpeculationStats()
+
+
+class SpeculativeGeneration:
+    """
+    一次推测执行：在等待LLM意图识别期间，提前运行本地分类器预测的代理的生成阶段
+    
+    只运行代理的agenerate，执行代码、保存文件等副作用在意图确认后才由afinish完成。
+    意图不一致时取消生成，已经消耗的token计入浪费统计
+    """
+    
+    def __init__(self, agent_type: str, agent: Any, inputs: List[Any], prompt: str, timer: Optional[StageTimer] = None):
+        """
+        启动推测执行，必须在事件循环中调用
+        
+        Args:
+            agent_type: 预测的代理类型
+            agent: 代理实例，需要支持agenerate和afinish
+            inputs: 代理输入
+            prompt: 用户输入
+            timer: 阶段计时器，生成阶段记为speculation阶段
+        """
+        self.agent_type = agent_type
+        self.agent = agent
+        self.usage: List[Dict[str, int]] = []
+        self._start_time = time.perf_counter()
+        self._end_time: Optional[float] = None
+        self._task = asyncio.create_task(self._run(inputs, prompt, timer))
+    
+    async def _run(self, inputs: List[Any], prompt: str, timer: Optional[StageTimer]) -> Dict[str, Any]:
+        with collect_usage(self.usage):
+            try:
+                generation = self.agent.agenerate(inputs, prompt)
+                return await (timer.measure("speculation", generation) if timer else generation)
+            finally:
+                self._end_time = time.perf_counter()
+    
+    async def resolve(self, agent_type: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        根据确认的意图提交或丢弃推测结果
+        
+        Args:
+            agent_type: 意图识别确认的代理类型
+        
+        Returns:
+            意图一致且生成成功时返回生成结果，由self.agent.afinish完成后续处理；否则返回None，调用方按正常流程执行
+        """
+        head_start = (self._end_time or time.perf_counter()) - self._start_time
+        if agent_type != self.agent_type:
+            self.cancel()
+            return None
+        try:
+            generation = await self._task
+        except Exception:
+            speculation_stats.record("failures")
+            speculation_stats.record_waste(self.usage)
+            return None
+        speculation_stats.record("hits", head_start)
+        return generation
+    
+    def cancel(self):
+        """取消推测执行，生成结束后统计浪费的token"""
+        if self._task.done():
+            self._on_cancelled(self._task)
+        else:
+            self._task.add_done_callback(self._on_cancelled)
+            self._task.cancel()
+    
+    def _on_cancelled(self, task: asyncio.Task):
+        if not task.cancelled():
+            # 读取异常，避免任务失败时产生未处理异常的警告
+            task.exception()
+        speculation_stats.record("misses")
+        speculation_stats.record_waste(self.usage)
+
+
+def start_speculation(prediction: Optional[Dict[str, Any]], agent_classes: Dict[str, Type], inputs: List[Any],
+                      prompt: str, timer: Optional[StageTimer] = None) -> Optional[SpeculativeGeneration]:
+    """
+    根据本地意图分类结果决定是否推测执行，配置intent.speculation.enabled为true时才启用
+    
+    本地置信度达到本地分类器阈值时意图识别不调用LLM，推测没有收益；低于min_confidence时命中率太低，浪费的token过多。
+    配置了intent.speculation.agent_types时只推测其中的代理类型
+    
+    Args:
+        prediction: 本地分类器的预测结果
+        agent_classes: 代理类型到代理类的映射
+        inputs: 代理输入
+        prompt: 用户输入
+        timer: 阶段计时器
+    
+    Returns:
+        启动的推测执行，不满足条件时返回None
+    """
+    config_service = ConfigService()
+    settings = config_service.get_config_value('intent.speculation', {}) or {}
+    if not settings.get('enabled', False) or not prediction:
+        return None
+    confidence = prediction.get('confidence', 0.0)
+    local_threshold = config_service.get_config_value('intent.local_classifier.threshold', 0.8)
+    if confidence < settings.get('min_confidence', 0.5) or confidence >= local_threshold:
+        return None
+    agent_type = prediction.get('agent_type')
+    agent_class = agent_classes.get(agent_type)
+    if agent_class is None or not agent_class.supports_staged_execution():
+        return None
+    allowed = settings.get('agent_types')
+    if allowed and agent_type not in allowed:
+        return None
+    return SpeculativeGeneration(agent_type, agent_class(), inputs, prompt, timer)
@@ -0,0 +1,132 @@
+import ast
+import hashlib
+import linecache
+import threading
+from collections import OrderedDict
+from types import CodeType
+from typing import Any, Dict
+
+# 分析代码中禁止导入的模块：文件系统、进程、网络和解释器内部
+FORBIDDEN_MODULES = frozenset({
+    "os", "sys", "subprocess", "shutil", "pathlib", "glob", "tempfile", "io",
+    "socket", "ssl", "http", "urllib", "requests", "httpx", "ftplib", "smtplib",
+    "ctypes", "multiprocessing", "threading", "concurrent", "asyncio", "signal", "resource", "pty",
+    "importlib", "builtins", "pickle", "marshal", "code", "gc", "inspect",
+})
+
+# 可以绕过导入检查的内置函数
+FORBIDDEN_CALLS = frozenset({"__import__", "eval", "exec", "compile", "open", "breakpoint"})
+
+ENTRY_POINT = "analyze_data"
+
+
+class CodeCheckError(ValueError):
+    """分析代码没有通过执行前的静态检查"""
+
+
+def check_analysis_code(tree: ast.Module) -> None:
+    """
+    检查分析代码的语法树：禁止导入FORBIDDEN_MODULES中的模块、禁止调用FORBIDDEN_CALLS中的内置函数，
+    并要求在模块顶层定义analyze_data函数
+    
+    Args:
+        tree: 分析代码的语法树
+    
+    Raises:
+        CodeCheckError: 检查不通过
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""] if node.level == 0 else []
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FORBIDDEN_CALLS:
+            raise CodeCheckError(f"分析代码第{node.lineno}行调用了禁止使用的函数: {node.func.id}")
+        else:
+            continue
+        for module in modules:
+            if module.split(".")[0] in FORBIDDEN_MODULES:
+                raise CodeCheckError(f"分析代码第{node.lineno}行导入了禁止使用的模块: {module}")
+    
+    if not any(isinstance(node, ast.FunctionDef) and node.name == ENTRY_POINT for node in tree.body):
+        raise CodeCheckError(f"分析代码中没有定义{ENTRY_POINT}函数")
+
+
+class CompiledCodeCache:
+    """
+    按源码哈希缓存编译后的代码对象，相同的分析代码（例如命中生成代码缓存时）只解析、检查和编译一次
+    
+    编译时把源码登记到linecache，异常堆栈中可以显示出错的代码行
+    """
+    
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._code: "OrderedDict[str, CodeType]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+    
+    def compile(self, source: str) -> CodeType:
+        """
+        检查并编译分析代码
+        
+        Args:
+            source: 分析代码
+        
+        Returns:
+            编译后的代码对象
+        
+        Raises:
+            CodeCheckError: 语法错误或没有通过静态检查
+        """
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        with self._lock:
+            code = self._code.get(digest)
+            if code is not None:
+                self._code.move_to_end(digest)
+                self._stats["hits"] += 1
+                return code
+            self._stats["misses"] += 1
+        
+        filename = f"<analysis-{digest[:12]}>"
+        try:
+            tree = ast.parse(source, filename=filename)
+        except SyntaxError as e:
+            raise CodeCheckError(f"分析代码第{e.lineno}行存在语法错误: {e.msg}") from e
+        check_analysis_code(tree)
+        code = compile(tree, filename, "exec")
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        
+        with self._lock:
+            self._code[digest] = code
+            while len(self._code) > max(self.max_entries, 0):
+                evicted, _ = self._code.popitem(last=False)
+                linecache.cache.pop(f"<analysis-{evicted[:12]}>", None)
+        return code
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存条目数和命中统计"""
+        with self._lock:
+            return {"entries": len(self._code), "max_entries": self.max_entries, **self._stats}
+
+
+_compiled_code_cache = CompiledCodeCache()
+
+
+def compile_analysis_code(source: str) -> CodeType:
+    """使用进程内共享的缓存检查并编译分析代码，参数和返回值见CompiledCodeCache.compile"""
+    return _compiled_code_cache.compile(source)
+
+
+def load_entry_point(code: CodeType) -> Any:
+    """
+    在新的命名空间中执行编译后的分析代码，返回其中的analyze_data函数
+    
+    Args:
+        code: compile_analysis_code返回的代码对象
+    
+    Returns:
+        analyze_data函数
+    """
+    namespace: Dict[str, Any] = {"__name__": "analysis"}
+    exec(code, namespace)
+    return namespace[ENTRY_POINT]
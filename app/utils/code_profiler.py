@@ -0,0 +1,151 @@
+import sys
+import time
+import linecache
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+import pandas as pd
+
+# 当前请求是否要求分析代码执行剖析，由request_profiling设置
+_profiling_requested: ContextVar[bool] = ContextVar("analysis_profiling_requested", default=False)
+
+
+@contextmanager
+def request_profiling(enabled: bool = True) -> Iterator[None]:
+    """
+    在代码块内（包括其中创建的任务和线程池调用）要求对分析代码的执行做逐行剖析
+    
+    Args:
+        enabled: 是否要求剖析
+    """
+    token = _profiling_requested.set(enabled)
+    try:
+        yield
+    finally:
+        _profiling_requested.reset(token)
+
+
+def profiling_requested() -> bool:
+    """当前上下文是否要求剖析"""
+    return _profiling_requested.get()
+
+
+def _frame_size(value: Any) -> Dict[str, int]:
+    """DataFrame或Series的行数、列数和内存占用，内存不含对象列中字符串等对象本身"""
+    if isinstance(value, pd.DataFrame):
+        return {"rows": len(value), "columns": value.shape[1], "bytes": int(value.memory_usage(index=True, deep=False).sum())}
+    return {"rows": len(value), "columns": 1, "bytes": int(value.memory_usage(index=True, deep=False))}
+
+
+class LineProfiler:
+    """
+    逐行剖析一个函数：每行的执行次数、耗时和执行期间的内存峰值，以及入口函数中DataFrame变量的大小
+    
+    只跟踪与入口函数定义在同一文件中的代码（包括其中定义的lambda和内部函数），pandas等库内部不跟踪，
+    库函数的耗时计入调用它的行。行耗时包含其中调用的被跟踪函数的耗时；内部函数的行会重置内存峰值，
+    外层行的内存峰值是近似值。剖析本身有额外开销，总耗时会高于正常执行
+    """
+    
+    def __init__(self, func: Callable, top_lines: int = 10, top_frames: int = 10):
+        """
+        初始化逐行剖析器
+        
+        Args:
+            func: 要剖析的入口函数
+            top_lines: 结果中保留的耗时最多的行数
+            top_frames: 结果中保留的最大的DataFrame变量数
+        """
+        self.func = func
+        self.filename = func.__code__.co_filename
+        self.top_lines = top_lines
+        self.top_frames = top_frames
+        self._lines: Dict[int, Dict[str, Any]] = {}
+        self._frames: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._seen: Dict[str, int] = {}
+        self._current: Dict[Any, Tuple[int, float]] = {}
+    
+    def run(self, *args, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """
+        执行并剖析入口函数
+        
+        Returns:
+            (入口函数的返回值, 剖析结果)，剖析结果见profile
+        """
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        previous_trace = sys.gettrace()
+        start = time.perf_counter()
+        sys.settrace(self._trace_call)
+        try:
+            result = self.func(*args, **kwargs)
+        finally:
+            sys.settrace(previous_trace)
+            total_seconds = time.perf_counter() - start
+            peak = max((stats["peak_memory_bytes"] for stats in self._lines.values()), default=0)
+            if started_tracemalloc:
+                tracemalloc.stop()
+        return result, self.profile(total_seconds, peak)
+    
+    def profile(self, total_seconds: float, peak_memory_bytes: int) -> Dict[str, Any]:
+        """
+        整理剖析结果
+        
+        Returns:
+            {"total_seconds", "peak_memory_bytes", "lines": 耗时最多的行, "frames": 最大的DataFrame变量}，
+            lines按耗时降序，每项包含line、code、hits、seconds和peak_memory_bytes；
+            frames按内存降序，每项包含name、line（产生该值的行）、rows、columns和bytes
+        """
+        lines = sorted(self._lines.items(), key=lambda item: item[1]["seconds"], reverse=True)[:self.top_lines]
+        frames = sorted(self._frames.values(), key=lambda item: item["bytes"], reverse=True)[:self.top_frames]
+        return {
+            "total_seconds": round(total_seconds, 6),
+            "peak_memory_bytes": peak_memory_bytes,
+            "lines": [
+                {"line": lineno, "code": linecache.getline(self.filename, lineno).strip(), "hits": stats["hits"],
+                 "seconds": round(stats["seconds"], 6), "peak_memory_bytes": stats["peak_memory_bytes"]}
+                for lineno, stats in lines
+            ],
+            "frames": frames,
+        }
+    
+    def _trace_call(self, frame, event, arg):
+        if event == "call" and frame.f_code.co_filename == self.filename:
+            return self._trace_line
+        return None
+    
+    def _trace_line(self, frame, event, arg):
+        if event not in ("line", "return"):
+            return self._trace_line
+        now = time.perf_counter()
+        previous = self._current.pop(frame, None)
+        if previous is not None:
+            lineno, started = previous
+            _, peak = tracemalloc.get_traced_memory()
+            stats = self._lines.setdefault(lineno, {"hits": 0, "seconds": 0.0, "peak_memory_bytes": 0})
+            stats["hits"] += 1
+            stats["seconds"] += now - started
+            stats["peak_memory_bytes"] = max(stats["peak_memory_bytes"], peak)
+            if frame.f_code is self.func.__code__:
+                self._record_frames(frame, lineno)
+        if event == "line":
+            tracemalloc.reset_peak()
+            # 不计入剖析器自身的耗时
+            self._current[frame] = (frame.f_lineno, time.perf_counter())
+        return self._trace_line
+    
+    def _record_frames(self, frame, lineno: int):
+        """记录入口函数中新产生的DataFrame和Series变量，按变量名和产生它的行去重"""
+        for name, value in frame.f_locals.items():
+            if not isinstance(value, (pd.DataFrame, pd.Series)) or self._seen.get(name) == id(value):
+                continue
+            self._seen[name] = id(value)
+            self._frames[(name, lineno)] = {"name": name, "line": lineno, **_frame_size(value)}
+
+
+def profile_call(func: Callable, *args, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+    """使用默认参数的LineProfiler执行并剖析函数，返回(返回值, 剖析结果)"""
+    return LineProfiler(func).run(*args, **kwargs)
@@ -0,0 +1,151 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+# 编译后的分析代码的文件名前缀，见code_compiler.CompiledCodeCache
+_ANALYSIS_FILE = '"<analysis-'
+
+# 错误信息的最大长度，超出部分截断
+MAX_ERROR_CHARS = 800
+
+# 列出全部列时的最大列数
+MAX_COLUMNS = 50
+
+
+def compact_traceback(traceback_text: str) -> str:
+    """
+    压缩异常堆栈：只保留分析代码中的栈帧（行号、函数名和代码行）和最终的异常信息，
+    pandas等库内部的栈帧和链式异常的前序堆栈都不保留
+    
+    Args:
+        traceback_text: 完整的异常堆栈文本
+    
+    Returns:
+        压缩后的堆栈
+    """
+    # 链式异常只保留最后一段
+    section = traceback_text.rsplit("Traceback (most recent call last):", 1)[-1]
+    lines = section.strip("\n").splitlines()
+    
+    frames = []
+    last_frame_line = -1
+    for i, line in enumerate(lines):
+        if line.startswith("  "):
+            last_frame_line = i
+        if line.startswith("  File ") and _ANALYSIS_FILE in line:
+            location = line.split(", line ", 1)[-1]
+            code = lines[i + 1].strip() if i + 1 < len(lines) and lines[i + 1].startswith("    ") else ""
+            frames.append(f"第{location.replace(', in ', '行, in ')}: {code}")
+    
+    error = "\n".join(lines[last_frame_line + 1:]).strip()
+    if len(error) > MAX_ERROR_CHARS:
+        error = error[:MAX_ERROR_CHARS] + "..."
+    return "\n".join(frames + [error])
+
+
+def relevant_columns(code: str, error_text: str, dfs: List[pd.DataFrame]) -> str:
+    """
+    列出代码中引用到的列及其类型，以及是否含缺失值
+    
+    没有引用任何已有列，或异常信息中引号内的名称不是已有列时（例如列名写错），
+    同时列出该数据集的全部列名和类型，最多MAX_COLUMNS列
+    
+    Args:
+        code: 出错的分析代码
+        error_text: 压缩后的错误信息，最后一行为异常信息
+        dfs: 输入的DataFrame列表
+    
+    Returns:
+        每项一行的列信息
+    """
+    error_line = error_text.strip().splitlines()[-1] if error_text.strip() else ""
+    quoted = re.findall(r"['\"]([^'\"]+)['\"]", error_line)
+    lines = []
+    for i, df in enumerate(dfs):
+        names = {str(col) for col in df.columns}
+        referenced = [j for j, col in enumerate(df.columns) if f"'{col}'" in code or f'"{col}"' in code]
+        for j in referenced:
+            series = df.iloc[:, j]
+            suffix = "，含缺失值" if series.isna().any() else ""
+            lines.append(f'dfs[{i}]["{df.columns[j]}"]: {series.dtype}{suffix}')
+        if not referenced or any(name not in names for name in quoted):
+            columns = [f"{col}({dtype})" for col, dtype in df.dtypes.items()]
+            lines.append(f"dfs[{i}]的全部列: " + ", ".join(columns[:MAX_COLUMNS]) + ("..." if len(columns) > MAX_COLUMNS else ""))
+    return "\n".join(lines)
+
+
+def build_repair_messages(system_prompt: str, requirement: str, code: str, error: str, columns: str) -> List[Dict[str, str]]:
+    """
+    构建按错误信息修复代码的提示信息
+    
+    系统指令与代码生成时完全相同，可以命中服务端的前缀缓存；用户消息只包含需求、出错的代码、
+    压缩后的错误信息和相关列，不再附带完整的schema、统计摘要和样本数据
+    
+    Args:
+        system_prompt: 代码生成使用的系统指令
+        requirement: 分析需求
+        code: 出错的分析代码
+        error: 压缩后的错误信息
+        columns: 相关列的类型信息
+    
+    Returns:
+        提示信息
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"## 分析需求\n{requirement}\n\n## 出错的代码\n```python\n{code}\n```\n\n"
+                                    f"## 错误信息\n{error}\n\n## 相关列\n{columns}\n\n"
+                                    "请修复上面代码中的错误，返回完整的analyze_data函数。"},
+    ]
+
+
+class CodeRepairStats:
+    """
+    增量修复统计：进入修复的次数、修复成功和失败次数、修复调用的提示词token数，
+    以及同样次数的完整重新生成估计需要的提示词token数。两者都按estimate_message_tokens估算，
+    只有能得到代码生成提示信息的修复调用（compared_calls）计入对比
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._stats = {"attempts": 0, "repaired": 0, "failed": 0, "repair_calls": 0, "repair_prompt_tokens": 0,
+                           "compared_calls": 0, "compared_repair_prompt_tokens": 0, "regeneration_prompt_tokens": 0}
+    
+    def record_call(self, repair_prompt_tokens: int, regeneration_prompt_tokens: Optional[int]):
+        """记录一次修复调用的提示词token数和完整重新生成的提示词token数，后者未知时为None"""
+        with self._lock:
+            self._stats["repair_calls"] += 1
+            self._stats["repair_prompt_tokens"] += repair_prompt_tokens
+            if regeneration_prompt_tokens is not None:
+                self._stats["compared_calls"] += 1
+                self._stats["compared_repair_prompt_tokens"] += repair_prompt_tokens
+                self._stats["regeneration_prompt_tokens"] += regeneration_prompt_tokens
+    
+    def record_outcome(self, repaired: bool):
+        """记录一次修复过程的结果"""
+        with self._lock:
+            self._stats["attempts"] += 1
+            self._stats["repaired" if repaired else "failed"] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+        
+        Returns:
+            计数、success_rate（修复成功次数/进入修复次数）和tokens_saved（计入对比的调用中重新生成与修复的提示词token数之差）
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["success_rate"] = stats["repaired"] / stats["attempts"] if stats["attempts"] else None
+        stats["tokens_saved"] = stats["regeneration_prompt_tokens"] - stats["compared_repair_prompt_tokens"]
+        return stats
+
+
+code_repair_stats = CodeRepairStats()
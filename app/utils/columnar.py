@@ -0,0 +1,112 @@
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 直接传输底层内存的numpy类型：布尔、整数、浮点、复数、时间间隔和时间
+_RAW_KINDS = "biufcmM"
+
+
+def _dictionary_encodable(series: pd.Series) -> bool:
+    """
+    列是否可以无损地字典编码
+    
+    factorize会把True和1视为同一个值，对象列只有非缺失值全部是字符串时才字典编码；
+    字符串类型和分类列还原时按原类型转换，缺失值不受影响
+    """
+    return pd.api.types.infer_dtype(series, skipna=True) in ("string", "categorical")
+
+
+def _encode_missing(series: pd.Series, codes: np.ndarray) -> List[Any]:
+    """
+    对象列中的缺失值按类型（None、NaN、pd.NA等）分别编码为-1、-2……，原地修改codes
+    
+    Returns:
+        缺失值列表，编码-(k+1)对应其中第k项
+    """
+    missing = np.flatnonzero(codes == -1)
+    if not len(missing):
+        return []
+    values = series.to_numpy(dtype=object)
+    na_values = {}
+    for position in missing:
+        value = values[position]
+        k = na_values.setdefault(type(value), (len(na_values), value))[0]
+        codes[position] = -(k + 1)
+    return [value for _, value in na_values.values()]
+
+
+def encode_frame(df: pd.DataFrame) -> Tuple[Dict[str, Any], List[memoryview]]:
+    """
+    将DataFrame按列编码为元数据和内存缓冲区，用于在进程之间传输
+    
+    数值和时间列直接传输底层内存；字符串和分类列使用字典编码，
+    只传输整数编码和去重后的取值，避免逐个序列化大量Python对象。其他列按对象或扩展数组序列化
+    
+    Args:
+        df: 要编码的DataFrame
+    
+    Returns:
+        (元数据, 缓冲区列表)，元数据可以直接pickle，缓冲区按元数据中的顺序传输
+    """
+    columns = []
+    buffers = []
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        dtype = series.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in _RAW_KINDS:
+            values = np.ascontiguousarray(series.to_numpy())
+            columns.append({"kind": "raw", "dtype": values.dtype.str})
+            buffers.append(memoryview(values.view(np.uint8)))
+            continue
+        if not _dictionary_encodable(series):
+            # 扩展类型（可空整数、带时区的时间等）直接序列化其数组，保留类型和缺失值
+            values = series.to_numpy(dtype=object) if dtype == object else series.array
+            columns.append({"kind": "object", "dtype": dtype, "values": values})
+            continue
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        codes = np.ascontiguousarray(codes, dtype=np.int32 if len(uniques) < 2**31 else np.int64)
+        # 字符串类型和分类列还原时重新转换缺失值，对象列需要保留原来的None或NaN
+        na_values = _encode_missing(series, codes) if dtype == object else []
+        columns.append({"kind": "dict", "dtype": dtype, "codes": codes.dtype.str,
+                        "uniques": np.asarray(uniques, dtype=object), "na_values": na_values})
+        buffers.append(memoryview(codes.view(np.uint8)))
+    
+    meta = {"columns": df.columns, "index": df.index, "lengths": [buffer.nbytes for buffer in buffers], "specs": columns}
+    return meta, buffers
+
+
+def decode_frame(meta: Dict[str, Any], buffers: List[Any]) -> pd.DataFrame:
+    """
+    由encode_frame的元数据和缓冲区还原DataFrame
+    
+    Args:
+        meta: 元数据
+        buffers: 缓冲区列表，使用可写的bytearray时还原出的数值列可以原地修改
+    
+    Returns:
+        还原的DataFrame
+    """
+    data = {}
+    buffer_iter = iter(buffers)
+    for i, spec in enumerate(meta["specs"]):
+        if spec["kind"] == "raw":
+            values = np.frombuffer(next(buffer_iter), dtype=np.dtype(spec["dtype"]))
+        elif spec["kind"] == "dict":
+            codes = np.frombuffer(next(buffer_iter), dtype=np.dtype(spec["codes"]))
+            # 负数编码表示缺失值，-(k+1)对应查找表末尾倒数第k+1项，即na_values中的第k项
+            na_values = spec["na_values"] or [np.nan]
+            lookup = np.empty(len(spec["uniques"]) + len(na_values), dtype=object)
+            lookup[:len(spec["uniques"])] = spec["uniques"]
+            lookup[len(spec["uniques"]):] = na_values[::-1]
+            values = pd.Series(lookup[codes], dtype=object, copy=False).astype(spec["dtype"])
+        else:
+            # 对象列需要指定类型，否则构建DataFrame时会被推断为字符串类型，None变为NaN
+            values = pd.Series(spec["values"], dtype=spec["dtype"], copy=False)
+        data[i] = values
+    
+    # 先使用默认索引构建，避免对象列按重复的索引对齐
+    df = pd.DataFrame(data, copy=False)
+    df.index = meta["index"]
+    df.columns = meta["columns"]
+    return df
@@ -88,4 +88,3 @@ class DataLoader:
         """
         schema_info = self.get_schema_info()
         return json.dumps(schema_info, ensure_ascii=False, cls=JSONEncoder)
-print (DataLoader("/Users/haihuang.hh/Documents/code/data_analysis_agent/data/sample.xlsx").get_schema_json())
\ No newline at end of file
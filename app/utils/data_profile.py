@@ -0,0 +1,117 @@
+import threading
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+
+# 数据样本的默认行数
+SAMPLE_ROWS = 5
+
+
+def statistical_summary(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    计算DataFrame的统计摘要，包括数值列、分类列和日期列的描述性统计
+    
+    Args:
+        df: 输入的DataFrame
+    
+    Returns:
+        {"numeric": {...}, "categorical": {...}, "date": {...}, "missing_values": 0, "duplicate_rows": 0}
+    """
+    # 数值列的描述性统计
+    numeric_stats = {}
+    for col in df.select_dtypes(include=['number']).columns:
+        numeric_stats[col] = {
+            "mean": df[col].mean() if not df[col].isnull().all() else None,
+            "median": df[col].median() if not df[col].isnull().all() else None,
+            "std": df[col].std() if not df[col].isnull().all() else None,
+            "min": df[col].min() if not df[col].isnull().all() else None,
+            "max": df[col].max() if not df[col].isnull().all() else None,
+            "null_count": df[col].isnull().sum()
+        }
+    
+    # 分类列的描述性统计
+    categorical_stats = {}
+    for col in df.select_dtypes(include=['object', 'category']).columns:
+        value_counts = df[col].value_counts().head(5).to_dict()  # 只取前5个最常见的值
+        categorical_stats[col] = {
+            "unique_count": df[col].nunique(),
+            "top_values": value_counts,
+            "null_count": df[col].isnull().sum()
+        }
+    
+    # 日期列的描述性统计
+    date_stats = {}
+    for col in df.select_dtypes(include=['datetime']).columns:
+        date_stats[col] = {
+            "min": df[col].min().isoformat() if not df[col].isnull().all() else None,
+            "max": df[col].max().isoformat() if not df[col].isnull().all() else None,
+            "null_count": df[col].isnull().sum()
+        }
+    
+    return {
+        "numeric": numeric_stats,
+        "categorical": categorical_stats,
+        "date": date_stats,
+        "missing_values": df.isnull().sum().sum(),
+        "duplicate_rows": df.duplicated().sum()
+    }
+
+
+class DataProfile:
+    """
+    单个数据集的派生信息（列类型、数据样本、统计摘要），各项在首次使用时计算并缓存
+    
+    只与数据内容有关，内容相同的数据集共享同一个实例，见prepared_dataset.ProfileCache。
+    请求流水线在等待意图识别期间调用warm预先计算，选定的代理直接使用计算好的结果。
+    每项信息有独立的锁，代理读取列类型时不会被正在计算的统计摘要阻塞
+    """
+    
+    def __init__(self, df: pd.DataFrame):
+        """
+        初始化数据集信息
+        
+        Args:
+            df: 数据集
+        """
+        self.df = df
+        self._values: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+    
+    def _get(self, key: str, compute: Callable[[], Any]) -> Any:
+        if key in self._values:
+            return self._values[key]
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._values:
+                self._values[key] = compute()
+        return self._values[key]
+    
+    @property
+    def row_count(self) -> int:
+        return len(self.df)
+    
+    @property
+    def column_count(self) -> int:
+        return len(self.df.columns)
+    
+    @property
+    def columns(self) -> Dict[str, str]:
+        """列名到数据类型名称的映射"""
+        return self._get("columns", lambda: {col: str(dtype) for col, dtype in self.df.dtypes.items()})
+    
+    def sample_records(self) -> List[Dict[str, Any]]:
+        """前SAMPLE_ROWS行数据，按行组织"""
+        return self._get("sample_records", lambda: self.df.head(SAMPLE_ROWS).to_dict(orient="records"))
+    
+    def statistical_summary(self) -> Dict[str, Any]:
+        """统计摘要，见statistical_summary"""
+        return self._get("statistical_summary", lambda: statistical_summary(self.df))
+    
+    def warm(self) -> "DataProfile":
+        """预先计算所有派生信息，开销较小的先计算"""
+        self.columns
+        self.sample_records()
+        self.statistical_summary()
+        return self
@@ -0,0 +1,214 @@
+import ast
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+# 各类写法处理每行输入数据的大致耗时（秒），在10万行数据上测得，用于估算执行时间
+ROW_COSTS = {
+    "iterrows": 25e-6,
+    "itertuples": 1e-6,
+    "row_apply": 8e-6,
+    "index_loop": 10e-6,
+    "group_loop": 1e-6,
+    "concat_in_loop": 2e-6,
+}
+
+RULE_MESSAGES = {
+    "iterrows": "使用iterrows逐行遍历，应改为列运算",
+    "itertuples": "使用itertuples逐行遍历，应改为列运算",
+    "row_apply": "使用apply(axis=1)逐行计算，应改为列运算或np.where/np.select",
+    "index_loop": "按行号循环访问DataFrame，应改为列运算",
+    "group_loop": "在Python循环中逐组处理groupby结果，应改为groupby().agg/transform",
+    "concat_in_loop": "在循环中反复拼接DataFrame，应先收集到列表再一次性pd.concat，或改为向量化计算",
+}
+
+
+@dataclass(frozen=True)
+class SlowIdiom:
+    """分析代码中的一处低效写法"""
+    
+    rule: str
+    lineno: int
+    
+    @property
+    def message(self) -> str:
+        return RULE_MESSAGES[self.rule]
+
+
+def _is_method_call(node: ast.AST, *names: str) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in names
+
+
+def _is_row_apply(node: ast.AST) -> bool:
+    """是否为apply(..., axis=1)或apply(..., axis="columns")"""
+    if not _is_method_call(node, "apply"):
+        return False
+    for keyword in node.keywords:
+        if keyword.arg == "axis" and isinstance(keyword.value, ast.Constant):
+            return keyword.value.value in (1, "columns")
+    return False
+
+
+def _is_index_loop(node: ast.AST) -> bool:
+    """是否为for i in range(len(...))"""
+    if not isinstance(node, ast.For) or not isinstance(node.iter, ast.Call):
+        return False
+    func, args = node.iter.func, node.iter.args
+    return (isinstance(func, ast.Name) and func.id == "range" and len(args) == 1
+            and isinstance(args[0], ast.Call) and isinstance(args[0].func, ast.Name) and args[0].func.id == "len")
+
+
+def _iterates_groupby(node: ast.AST) -> bool:
+    """是否为for ... in df.groupby(...)，包括对分组结果取列之后的遍历"""
+    if not isinstance(node, ast.For):
+        return False
+    target = node.iter
+    while isinstance(target, ast.Subscript):
+        target = target.value
+    return _is_method_call(target, "groupby")
+
+
+def _is_concat(node: ast.AST) -> bool:
+    """是否为pd.concat(...)或concat(...)"""
+    if not isinstance(node, ast.Call):
+        return False
+    func = node.func
+    return (isinstance(func, ast.Attribute) and func.attr == "concat") or (isinstance(func, ast.Name) and func.id == "concat")
+
+
+def find_slow_idioms(source: str) -> List[SlowIdiom]:
+    """
+    查找分析代码中在大数据集上明显慢于向量化实现的pandas写法
+    
+    Args:
+        source: 分析代码
+    
+    Returns:
+        低效写法列表，按行号排序，同一行同一规则只报告一次；代码有语法错误时返回空列表
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+    
+    found = set()
+    for node in ast.walk(tree):
+        if _is_method_call(node, "iterrows"):
+            found.add(SlowIdiom("iterrows", node.lineno))
+        elif _is_method_call(node, "itertuples"):
+            found.add(SlowIdiom("itertuples", node.lineno))
+        elif _is_row_apply(node):
+            found.add(SlowIdiom("row_apply", node.lineno))
+        elif _is_index_loop(node):
+            found.add(SlowIdiom("index_loop", node.lineno))
+        
+        if isinstance(node, (ast.For, ast.While)):
+            if _iterates_groupby(node):
+                found.add(SlowIdiom("group_loop", node.lineno))
+            for child in ast.walk(ast.Module(body=node.body, type_ignores=[])):
+                if _is_concat(child):
+                    found.add(SlowIdiom("concat_in_loop", child.lineno))
+    return sorted(found, key=lambda idiom: (idiom.lineno, idiom.rule))
+
+
+def estimate_seconds(idioms: List[SlowIdiom], row_count: int) -> float:
+    """
+    按ROW_COSTS估算低效写法在输入数据上的执行时间，每条规则只计算一次
+    
+    Args:
+        idioms: find_slow_idioms的结果
+        row_count: 所有输入数据集的总行数
+    
+    Returns:
+        估算的执行时间（秒）
+    """
+    return sum(ROW_COSTS[rule] for rule in {idiom.rule for idiom in idioms}) * row_count
+
+
+def build_rewrite_messages(source: str, idioms: List[SlowIdiom]) -> List[Dict[str, str]]:
+    """
+    构建要求向量化改写的提示信息，只包含代码和问题列表，不再附带数据
+    
+    Args:
+        source: 分析代码
+        idioms: 代码中的低效写法
+    
+    Returns:
+        提示信息
+    """
+    issues = "\n".join(f"- 第{idiom.lineno}行: {idiom.message}" for idiom in idioms)
+    return [
+        {"role": "system", "content": "你是pandas性能优化专家。请把用户给出的analyze_data函数改写为向量化实现，"
+                                      "保持函数签名、返回的字典键和每个结果DataFrame的内容不变。请仅返回可执行的Python代码，不要包含任何解释。"},
+        {"role": "user", "content": f"## 低效写法\n{issues}\n\n## 代码\n```python\n{source}\n```"},
+    ]
+
+
+class SlowIdiomStats:
+    """
+    低效写法统计：各规则出现次数、改写结果，以及最近若干次执行的估算耗时和实际耗时
+    
+    实际耗时在API进程中测量，包括沙箱的数据传输；改写后的代码执行成功时实际耗时为改写后代码的耗时
+    """
+    
+    def __init__(self, max_samples: int = 50):
+        self._lock = threading.Lock()
+        self.max_samples = max_samples
+        self.reset()
+    
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._stats = {"checked": 0, "flagged": 0, "rewritten": 0, "rewrite_rejected": 0, "rewrite_failed": 0}
+            self._rules = {rule: 0 for rule in ROW_COSTS}
+            self._samples = deque(maxlen=self.max_samples)
+    
+    def record_check(self, idioms: List[SlowIdiom]):
+        with self._lock:
+            self._stats["checked"] += 1
+            if idioms:
+                self._stats["flagged"] += 1
+            for rule in {idiom.rule for idiom in idioms}:
+                self._rules[rule] += 1
+    
+    def record_run(self, idioms: List[SlowIdiom], row_count: int, estimated: float, actual: float, outcome: str):
+        """
+        记录一次含低效写法的代码的执行
+        
+        Args:
+            idioms: 原始代码中的低效写法
+            row_count: 输入数据总行数
+            estimated: 原始代码的估算耗时（秒）
+            actual: 实际耗时（秒）
+            outcome: flagged（未改写）、rewritten、rewrite_rejected（改写结果没有通过检查）或rewrite_failed（改写后的代码执行失败）
+        """
+        with self._lock:
+            if outcome != "flagged":
+                self._stats[outcome] += 1
+            self._samples.append({
+                "rules": sorted({idiom.rule for idiom in idioms}),
+                "row_count": row_count,
+                "estimated_seconds": round(estimated, 4),
+                "actual_seconds": round(actual, 4),
+                "outcome": outcome,
+            })
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+        
+        Returns:
+            计数、各规则出现次数、最近的执行样本，以及未改写样本的实际耗时/估算耗时中位数estimate_ratio
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["rules"] = dict(self._rules)
+            stats["samples"] = list(self._samples)
+        ratios = sorted(sample["actual_seconds"] / sample["estimated_seconds"] for sample in stats["samples"]
+                        if sample["outcome"] != "rewritten" and sample["estimated_seconds"] > 0)
+        stats["estimate_ratio"] = ratios[len(ratios) // 2] if ratios else None
+        return stats
+
+
+slow_idiom_stats = SlowIdiomStats()
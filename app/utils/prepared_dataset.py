@@ -0,0 +1,197 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from app.services.config_service import ConfigService
+from app.utils.data_loader import DataLoader
+from app.utils.data_profile import DataProfile
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """
+    计算DataFrame内容的指纹，列名、列类型、索引和数据都相同时指纹相同
+    
+    Args:
+        df: 输入的DataFrame
+    
+    Returns:
+        十六进制的SHA-1摘要
+    """
+    digest = hashlib.sha1()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode("utf-8"))
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=True)
+    except TypeError:
+        # 包含列表、字典等不可哈希的值时按字符串形式计算
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=True)
+    digest.update(row_hashes.values.tobytes())
+    return digest.hexdigest()
+
+
+class ProfileCache:
+    """
+    按内容指纹缓存数据集信息，同一数据集上的后续问题直接复用已经计算的列类型、样本和统计摘要
+    
+    缓存的数据集信息持有对应的DataFrame，按最近使用淘汰，条目数上限为max_entries
+    """
+    
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, DataProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    def get(self, fingerprint: str, df: pd.DataFrame) -> DataProfile:
+        """
+        获取指纹对应的数据集信息，不存在时为df创建
+        
+        Args:
+            fingerprint: df的内容指纹
+            df: 数据集
+        
+        Returns:
+            数据集信息
+        """
+        with self._lock:
+            profile = self._profiles.get(fingerprint)
+            if profile is not None:
+                self._profiles.move_to_end(fingerprint)
+                self._stats["hits"] += 1
+                return profile
+            self._stats["misses"] += 1
+            profile = DataProfile(df)
+            self._profiles[fingerprint] = profile
+            while len(self._profiles) > max(self.max_entries, 0):
+                self._profiles.popitem(last=False)
+                self._stats["evictions"] += 1
+            return profile
+    
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._profiles.clear()
+            self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存条目数和命中统计"""
+        with self._lock:
+            return {"entries": len(self._profiles), "max_entries": self.max_entries, **self._stats}
+
+
+_profile_cache: Optional[ProfileCache] = None
+_profile_cache_lock = threading.Lock()
+
+
+def get_profile_cache() -> ProfileCache:
+    """获取共享的数据集信息缓存，条目数上限来自配置data.profile_cache.max_entries"""
+    global _profile_cache
+    with _profile_cache_lock:
+        if _profile_cache is None:
+            _profile_cache = ProfileCache(ConfigService().get_config_value("data.profile_cache.max_entries", 16))
+        return _profile_cache
+
+
+@dataclass(frozen=True, eq=False)
+class PreparedDataset:
+    """
+    代理使用的数据集：DataFrame、名称、schema、内容指纹和数据集信息
+    
+    schema包含columns、row_count、column_count和sample_data，各代理按需选取其中的字段。
+    内容相同的数据集共享同一个profile，统计摘要只计算一次
+    """
+    
+    frame: pd.DataFrame
+    name: str
+    schema: Dict[str, Any]
+    fingerprint: str
+    profile: DataProfile
+
+
+def schema_fingerprint(datasets: List[PreparedDataset]) -> str:
+    """
+    计算数据集列表的schema指纹，只与数据集顺序、列名和列类型有关，与数据内容和数据集名称无关
+    
+    Args:
+        datasets: 准备好的数据集列表
+    
+    Returns:
+        十六进制的SHA-1摘要
+    """
+    canonical = json.dumps([list(dataset.schema["columns"].items()) for dataset in datasets], ensure_ascii=False, default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def prepare_dataset(df: pd.DataFrame, name: str) -> PreparedDataset:
+    """
+    计算数据集的内容指纹和schema，数据集信息从缓存获取
+    
+    Args:
+        df: 数据集
+        name: 数据集名称
+    
+    Returns:
+        准备好的数据集
+    """
+    fingerprint = dataframe_fingerprint(df)
+    profile = get_profile_cache().get(fingerprint, df)
+    schema = {
+        "columns": profile.columns,
+        "row_count": profile.row_count,
+        "column_count": profile.column_count,
+        "sample_data": profile.sample_records()
+    }
+    return PreparedDataset(frame=df, name=name, schema=schema, fingerprint=fingerprint, profile=profile)
+
+
+def prepare_frames(dfs: List[pd.DataFrame]) -> List[PreparedDataset]:
+    """
+    为DataFrame列表准备数据集，名称与代理处理DataFrame输入时一致，为df_0、df_1...
+    
+    Args:
+        dfs: DataFrame列表
+    
+    Returns:
+        准备好的数据集列表
+    """
+    return [prepare_dataset(df, f"df_{i}") for i, df in enumerate(dfs)]
+
+
+def prepare_inputs(inputs: List[Any]) -> List[PreparedDataset]:
+    """
+    将代理的输入转换为准备好的数据集列表
+    
+    Args:
+        inputs: 输入对象列表，可以是DataFrame、文件路径或PreparedDataset。
+            DataFrame命名为df_{序号}，文件使用不含扩展名的文件名
+    
+    Returns:
+        准备好的数据集列表
+    """
+    datasets = []
+    for i, input_obj in enumerate(inputs):
+        if isinstance(input_obj, PreparedDataset):
+            # 请求流水线已经准备好的数据集直接使用
+            datasets.append(input_obj)
+        elif isinstance(input_obj, pd.DataFrame):
+            datasets.append(prepare_dataset(input_obj, f"df_{i}"))
+        elif isinstance(input_obj, str):
+            # 如果输入是字符串，尝试作为文件路径加载
+            try:
+                df = DataLoader(input_obj).load_data()
+            except Exception as e:
+                raise ValueError(f"无法从路径加载数据: {input_obj}, 错误: {str(e)}")
+            # 使用文件名作为DataFrame名称
+            datasets.append(prepare_dataset(df, os.path.splitext(os.path.basename(input_obj))[0]))
+        else:
+            raise TypeError(f"不支持的输入类型: {type(input_obj)}")
+    
+    if not datasets:
+        raise ValueError("没有有效的输入数据")
+    
+    return datasets
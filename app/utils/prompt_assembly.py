@@ -0,0 +1,45 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+from app.utils.json_utils import JSONEncoder
+
+
+def canonical_json(value: Any) -> str:
+    """
+    规范化JSON序列化：键排序、紧凑分隔符，同样的数据总是得到逐字节相同的文本
+    
+    Args:
+        value: 待序列化的数据
+    
+    Returns:
+        JSON文本
+    """
+    try:
+        return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), cls=JSONEncoder)
+    except TypeError:
+        # 键类型混合（如整数列名和字符串列名）时无法排序，保持原有顺序，结果仍然是确定的
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), cls=JSONEncoder)
+
+
+def assemble_messages(system_prompt: str, blocks: List[Tuple[str, str]], question_title: str, question: str) -> List[Dict[str, str]]:
+    """
+    按固定布局构建消息，使请求之间共享尽可能长的前缀，便于服务端复用KV缓存
+    
+    布局依次为：只包含静态指令的系统消息、按固定顺序排列的数据块、最后是每次都不同的用户问题。
+    同一代理的请求共享整个系统消息，同一数据集上的不同问题还共享所有数据块
+    
+    Args:
+        system_prompt: 静态系统指令，不能包含任何随请求变化的内容
+        blocks: 按顺序排列的(标题, 内容)数据块，变化越少的块越靠前
+        question_title: 用户问题的标题
+        question: 用户问题
+    
+    Returns:
+        消息列表
+    """
+    parts = [f"## {title}\n{content}" for title, content in blocks]
+    parts.append(f"## {question_title}\n{question}")
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "\n\n".join(parts)}
+    ]
@@ -0,0 +1,334 @@
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.utils.json_utils import JSONEncoder
+from app.utils.prompt_assembly import canonical_json
+from app.utils.token_utils import estimate_tokens, estimate_message_tokens
+from app.utils.logger import setup_logger
+
+logger = setup_logger("prompt_budget")
+
+# 截断文本时追加的标记
+TRUNCATED_MARKER = "\n...(内容超出上下文预算，已截断)"
+
+
+def render_json(value: Any, indent: Optional[int] = 2) -> str:
+    """按提示词中使用的格式序列化为JSON，indent为None时输出紧凑格式"""
+    separators = None if indent is not None else (",", ":")
+    return json.dumps(value, ensure_ascii=False, indent=indent, separators=separators, cls=JSONEncoder)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    将文本截断到估算token数不超过max_tokens，截断时追加标记
+    
+    Args:
+        text: 输入文本
+        max_tokens: 最大token数
+    
+    Returns:
+        截断后的文本
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max(0, max_tokens - estimate_tokens(TRUNCATED_MARKER))
+    # 二分查找满足预算的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + TRUNCATED_MARKER
+
+
+class PromptSection:
+    """
+    提示词中可降级的一段内容
+    
+    levels按从完整到精简的顺序给出该段内容的多种渲染方式，预算管理器按顺序选择第一个放得下的级别。
+    渲染是惰性的，只有被考虑的级别才会执行；estimates可为代价高的级别提供不渲染即可得到的token估计
+    """
+    
+    def __init__(self, name: str, levels: List[Callable[[], str]], estimates: Optional[List[Optional[int]]] = None):
+        """
+        初始化提示词片段
+        
+        Args:
+            name: 片段名称，对应预算配置中的section_shares，如schema、stats、sample、history
+            levels: 各降级级别的渲染函数，第0级为完整内容
+            estimates: 各级别的token预估，None表示需要实际渲染后计算
+        """
+        self.name = name
+        self.levels = levels
+        self.estimates = estimates or [None] * len(levels)
+        self._rendered: Dict[int, str] = {}
+    
+    def render(self, level: int) -> str:
+        if level not in self._rendered:
+            self._rendered[level] = self.levels[level]()
+        return self._rendered[level]
+    
+    def tokens(self, level: int, budget: Optional[int] = None) -> int:
+        """
+        计算指定级别的token数；有预估值且明显超出预算时直接返回预估值，避免渲染大段内容
+        
+        Args:
+            level: 降级级别
+            budget: 当前可用预算
+        
+        Returns:
+            token数
+        """
+        estimate = self.estimates[level]
+        if level not in self._rendered and estimate is not None and budget is not None and estimate > budget * 2:
+            return estimate
+        return estimate_tokens(self.render(level))
+
+
+class PromptBudget:
+    """
+    提示词token预算管理器
+    
+    可用预算 = (上下文窗口 - 预留的输出token) * (1 - 安全余量) - 固定部分（系统提示、模板、用户需求）的token数。
+    可用预算按section_shares在各片段间分配，每个片段选择能放进自身份额的最完整级别；
+    剩余预算按片段顺序用于升级片段；仍然放不下时从最后一个片段开始截断。整个过程是确定的
+    """
+    
+    def __init__(self, context_window: int, output_reserve_tokens: int = 4096, safety_margin: float = 0.1,
+                 section_shares: Optional[Dict[str, float]] = None):
+        """
+        初始化预算管理器
+        
+        Args:
+            context_window: 模型上下文窗口（token）
+            output_reserve_tokens: 为模型输出预留的token数
+            safety_margin: 本地token估算误差的安全余量比例
+            section_shares: 各片段的预算份额，未列出的片段使用default份额
+        """
+        self.context_window = context_window
+        self.output_reserve_tokens = output_reserve_tokens
+        self.safety_margin = safety_margin
+        self.section_shares = section_shares or {"schema": 0.3, "stats": 0.2, "sample": 0.4, "history": 0.1, "default": 0.1}
+    
+    @property
+    def prompt_budget(self) -> int:
+        """提示词整体可用的token数"""
+        return int(max(0, self.context_window - self.output_reserve_tokens) * (1 - self.safety_margin))
+    
+    def fit(self, sections: List[PromptSection],
+            build_messages: Callable[[Dict[str, str]], List[Dict[str, str]]]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """
+        为各片段选择降级级别并构建消息
+        
+        Args:
+            sections: 按重要性从高到低排列的可降级片段
+            build_messages: 根据{片段名称: 渲染文本}构建消息列表的函数
+        
+        Returns:
+            (消息列表, 预算报告)
+        """
+        fixed_tokens = estimate_message_tokens(build_messages({section.name: "" for section in sections}))
+        available = max(0, self.prompt_budget - fixed_tokens)
+        
+        # 1. 按份额为每个片段选择放得下的最完整级别
+        total_share = sum(self._share(section.name) for section in sections) or 1.0
+        levels, tokens = {}, {}
+        for section in sections:
+            share_budget = int(available * self._share(section.name) / total_share)
+            level = len(section.levels) - 1
+            for candidate in range(len(section.levels)):
+                if section.tokens(candidate, share_budget) <= share_budget:
+                    level = candidate
+                    break
+            levels[section.name] = level
+            tokens[section.name] = section.tokens(level)
+        
+        # 2. 用剩余预算按片段顺序升级
+        for section in sections:
+            for candidate in range(levels[section.name]):
+                slack = available - sum(tokens.values())
+                extra = section.tokens(candidate, slack + tokens[section.name]) - tokens[section.name]
+                if extra <= slack:
+                    levels[section.name] = candidate
+                    tokens[section.name] += extra
+                    break
+        
+        # 3. 最精简的级别仍放不下时，从最不重要的片段开始截断
+        rendered = {section.name: section.render(levels[section.name]) for section in sections}
+        truncated = []
+        for section in reversed(sections):
+            overflow = sum(tokens.values()) - available
+            if overflow <= 0:
+                break
+            keep = max(0, tokens[section.name] - overflow)
+            rendered[section.name] = truncate_to_tokens(rendered[section.name], keep)
+            tokens[section.name] = estimate_tokens(rendered[section.name])
+            truncated.append(section.name)
+        
+        messages = build_messages(rendered)
+        report = {
+            "context_window": self.context_window,
+            "prompt_budget": self.prompt_budget,
+            "prompt_tokens": estimate_message_tokens(messages),
+            "fixed_tokens": fixed_tokens,
+            "sections": {
+                section.name: {
+                    "level": levels[section.name],
+                    "levels": len(section.levels),
+                    "tokens": tokens[section.name],
+                    "truncated": section.name in truncated
+                }
+                for section in sections
+            },
+            "degraded": any(levels[section.name] > 0 for section in sections) or bool(truncated)
+        }
+        return messages, report
+    
+    def _share(self, name: str) -> float:
+        return self.section_shares.get(name, self.section_shares.get("default", 0.1))
+
+
+def schema_section(df_names: List[str], schema_infos: List[Dict[str, Any]], max_columns: int = 50) -> PromptSection:
+    """
+    数据集schema片段，降级顺序：规范化JSON、每个数据集只保留前max_columns列
+    
+    schema使用键排序的紧凑JSON，同一数据集总是渲染为相同的文本，便于服务端复用提示词前缀缓存
+    
+    Args:
+        df_names: 数据集名称列表
+        schema_infos: 与名称对应的schema信息列表
+        max_columns: 最精简级别保留的列数
+    
+    Returns:
+        提示词片段
+    """
+    def _capped():
+        capped = []
+        for schema_info in schema_infos:
+            columns = schema_info.get("columns", {})
+            if len(columns) > max_columns:
+                schema_info = dict(schema_info)
+                schema_info["columns"] = dict(list(columns.items())[:max_columns])
+                schema_info["omitted_columns"] = len(columns) - max_columns
+            capped.append(schema_info)
+        return canonical_json(list(zip(df_names, capped)))
+    
+    value = list(zip(df_names, schema_infos))
+    return PromptSection("schema", [lambda: canonical_json(value), _capped])
+
+
+def stats_section(df_names: List[str], stat_summaries: List[Dict[str, Any]]) -> PromptSection:
+    """
+    统计摘要片段，降级顺序：缩进JSON、紧凑JSON、只保留数值列统计和整体缺失/重复信息
+    
+    Args:
+        df_names: 数据集名称列表
+        stat_summaries: 与名称对应的统计摘要列表
+    
+    Returns:
+        提示词片段
+    """
+    value = list(zip(df_names, stat_summaries))
+    numeric_only = [
+        (name, {key: summary[key] for key in ("numeric", "missing_values", "duplicate_rows") if key in summary})
+        for name, summary in value
+    ]
+    return PromptSection("stats", [
+        lambda: render_json(value),
+        lambda: render_json(value, indent=None),
+        lambda: render_json(numeric_only, indent=None)
+    ])
+
+
+def records_section(df_names: List[str], dfs: List[pd.DataFrame], name: str = "sample",
+                    row_limits: Tuple[int, ...] = (1000, 200, 50, 10, 3)) -> PromptSection:
+    """
+    数据行片段，降级顺序：全部数据的缩进JSON、全部数据的紧凑JSON、依次只保留前row_limits行
+    
+    全部数据级别的token数按前若干行外推预估，数据量明显超出预算时不会实际序列化全部数据
+    
+    Args:
+        df_names: 数据集名称列表
+        dfs: DataFrame列表
+        name: 片段名称
+        row_limits: 依次尝试的每个数据集保留行数
+    
+    Returns:
+        提示词片段
+    """
+    def _render(limit: Optional[int], indent: Optional[int]) -> Callable[[], str]:
+        def _inner():
+            records = [(df_name, (df if limit is None else df.head(limit)).to_dict(orient="records"))
+                       for df_name, df in zip(df_names, dfs)]
+            text = render_json(records, indent=indent)
+            total_rows = sum(len(df) for df in dfs)
+            if limit is not None and any(len(df) > limit for df in dfs):
+                text = f"（数据量超出上下文预算，每个数据集仅展示前{limit}行，共{total_rows}行）\n{text}"
+            return text
+        return _inner
+    
+    def _extrapolate(indent: Optional[int]) -> Optional[int]:
+        probe_rows = 20
+        total = 0
+        for df in dfs:
+            if len(df) <= probe_rows:
+                return None
+            probe = render_json(df.head(probe_rows).to_dict(orient="records"), indent=indent)
+            total += estimate_tokens(probe) * len(df) // probe_rows
+        return total
+    
+    levels = [_render(None, 2), _render(None, None)]
+    estimates = [_extrapolate(2), _extrapolate(None)]
+    for limit in row_limits:
+        levels.append(_render(limit, None))
+        estimates.append(None)
+    return PromptSection(name, levels, estimates)
+
+
+def text_section(name: str, text: str) -> PromptSection:
+    """只有一个级别的文本片段，如用户需求和对话历史，超出预算时会被截断"""
+    return PromptSection(name, [lambda: text])
+
+
+class PromptBudgetMetrics:
+    """按代理统计提示词大小和降级情况"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+    
+    def record(self, agent_id: str, report: Dict[str, Any]):
+        with self._lock:
+            stats = self._stats.setdefault(agent_id, {
+                "calls": 0, "degraded": 0, "truncated": 0, "total_prompt_tokens": 0, "max_prompt_tokens": 0,
+                "section_degradations": {}
+            })
+            stats["calls"] += 1
+            stats["total_prompt_tokens"] += report["prompt_tokens"]
+            stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], report["prompt_tokens"])
+            if report["degraded"]:
+                stats["degraded"] += 1
+            if any(section["truncated"] for section in report["sections"].values()):
+                stats["truncated"] += 1
+            for name, section in report["sections"].items():
+                if section["level"] > 0 or section["truncated"]:
+                    stats["section_degradations"][name] = stats["section_degradations"].get(name, 0) + 1
+        if report["degraded"]:
+            logger.info(f"代理{agent_id}的提示词已降级: {report['prompt_tokens']}/{report['prompt_budget']} tokens，片段: {report['sections']}")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for agent_id, stats in self._stats.items():
+                stats = dict(stats, section_degradations=dict(stats["section_degradations"]))
+                stats["avg_prompt_tokens"] = stats["total_prompt_tokens"] / stats["calls"] if stats["calls"] else 0
+                result[agent_id] = stats
+            return result
+
+
+prompt_budget_metrics = PromptBudgetMetrics()
@@ -0,0 +1,35 @@
+import re
+from typing import Optional
+
+# 完整的推理块
+_THINK_BLOCK_PATTERN = re.compile(r'<think>[\s\S]*?</think>', re.IGNORECASE)
+_THINK_OPEN_PATTERN = re.compile(r'<think>', re.IGNORECASE)
+_THINK_CLOSE_PATTERN = re.compile(r'</think>', re.IGNORECASE)
+
+
+def strip_reasoning(text: Optional[str]) -> str:
+    """
+    去除模型输出中的<think>推理块，只保留最终回答
+    
+    R1蒸馏等推理模型在部分服务端会把推理过程直接输出在content中，推理里常出现代码片段和JSON草稿，
+    必须先去除才能从回答中提取代码或JSON。支持三种情况：
+        完整的<think>...</think>块：整块去除
+        只有</think>：开始标签由对话模板预填而没有输出，结束标签之前都是推理
+        只有<think>：输出在推理过程中被截断，之后没有回答
+    
+    Args:
+        text: 模型输出的内容
+    
+    Returns:
+        去除推理块后的内容
+    """
+    if not text:
+        return ""
+    text = _THINK_BLOCK_PATTERN.sub("", text)
+    closes = list(_THINK_CLOSE_PATTERN.finditer(text))
+    if closes:
+        text = text[closes[-1].end():]
+    opening = _THINK_OPEN_PATTERN.search(text)
+    if opening:
+        text = text[:opening.start()]
+    return text.strip()
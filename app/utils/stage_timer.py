@@ -0,0 +1,58 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Iterator, Tuple
+
+
+class StageTimer:
+    """
+    记录一次请求中各阶段相对请求开始的起止时间，阶段之间可以并行重叠
+    
+    重叠时间等于各阶段耗时之和减去它们覆盖的总时长，反映并行执行节省的时间
+    """
+    
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._stages: Dict[str, Tuple[float, float]] = {}
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """记录代码块的执行时间，可以在线程池中使用"""
+        start = time.perf_counter() - self._origin
+        try:
+            yield
+        finally:
+            self._stages[name] = (start, time.perf_counter() - self._origin)
+    
+    async def measure(self, name: str, awaitable: Awaitable[Any]) -> Any:
+        """等待awaitable完成并记录耗时"""
+        with self.stage(name):
+            return await awaitable
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取各阶段耗时
+        
+        Returns:
+            {"stages": {"load": {"start": 0.0, "end": 0.12, "seconds": 0.12}, ...},
+             "wall_seconds": 0.8, "sequential_seconds": 0.9, "overlap_seconds": 0.1}
+        """
+        stages = dict(self._stages)
+        intervals = sorted(stages.values())
+        covered = 0.0
+        current_start = current_end = None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    covered += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            covered += current_end - current_start
+        sequential = sum(end - start for start, end in intervals)
+        return {
+            "stages": {name: {"start": start, "end": end, "seconds": end - start} for name, (start, end) in stages.items()},
+            "wall_seconds": time.perf_counter() - self._origin,
+            "sequential_seconds": sequential,
+            "overlap_seconds": sequential - covered
+        }
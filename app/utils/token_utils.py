@@ -0,0 +1,40 @@
+import re
+from typing import Dict, List
+
+# CJK字符、全角符号等通常每个字符对应约一个token
+_WIDE_CHAR_PATTERN = re.compile(r'[⺀-鿿가-힯豈-﫿＀-￯]')
+
+# 每条消息的格式开销（角色标记等）
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    在本地粗略估算文本的token数，不依赖具体模型的分词器
+
+    中文等宽字符按每字符1个token计算，其余字符按每4个字符1个token计算
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    wide_chars = len(_WIDE_CHAR_PATTERN.findall(text))
+    other_chars = len(text) - wide_chars
+    return wide_chars + (other_chars + 3) // 4
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    估算聊天消息列表的token数
+
+    Args:
+        messages: 消息列表，格式为[{"role": "user", "content": "你好"}]
+
+    Returns:
+        估算的token数
+    """
+    return sum(estimate_tokens(message.get("content") or "") + _MESSAGE_OVERHEAD_TOKENS for message in messages)
@@ -0,0 +1,87 @@
+"""
+对比每次调用新建连接（requests.post）与SiliconFlowService共享keep-alive连接池的耗时
+
+运行方式（项目根目录）:
+    python -m benchmarks.bench_http_pool --calls 200 --tls
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import List
+
+import requests
+
+from app.services.silicon_flow_service import SiliconFlowService
+from benchmarks.stub_llm_server import StubLLMServer
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+def _summary(name: str, latencies: List[float], connections: int) -> str:
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    mean = statistics.mean(latencies) * 1000
+    return f"{name:<28} mean={mean:7.2f}ms  p50={p50:7.2f}ms  p95={p95:7.2f}ms  新建连接数={connections}"
+
+
+def bench_requests_post(server: StubLLMServer, calls: int) -> List[float]:
+    """基线：与修改前一致，每次调用模块级requests.post"""
+    url = f"{server.api_base}/chat/completions"
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        response = requests.post(url, json={"model": "stub", "messages": MESSAGES},
+                                 headers={"Authorization": "Bearer bench"}, timeout=(10, 30))
+        response.raise_for_status()
+        response.json()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_pooled_service(server: StubLLMServer, calls: int, warmup: bool) -> List[float]:
+    """连接池：SiliconFlowService通过共享会话复用连接"""
+    service = SiliconFlowService(api_key="bench", api_base=server.api_base, model="stub")
+    if warmup:
+        service.warmup(connections=1)
+    server.reset_stats()
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        service.chat_completion(messages=MESSAGES)
+        latencies.append(time.perf_counter() - start)
+    service.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP连接池基准测试")
+    parser.add_argument("--calls", type=int, default=200, help="每种模式的调用次数")
+    parser.add_argument("--tls", action="store_true", help="启用TLS，以体现真实环境中的握手开销")
+    args = parser.parse_args()
+    
+    with StubLLMServer(tls=args.tls) as server:
+        if server.cert_file:
+            # 环境变量中的CA配置优先级高于会话配置，需要让自签名证书通过校验
+            os.environ["REQUESTS_CA_BUNDLE"] = server.cert_file
+            os.environ["CURL_CA_BUNDLE"] = server.cert_file
+        server.reset_stats()
+        baseline = bench_requests_post(server, args.calls)
+        baseline_connections = server.connections
+        
+        pooled_cold = bench_pooled_service(server, args.calls, warmup=False)
+        pooled_cold_connections = server.connections
+        
+        pooled_warm = bench_pooled_service(server, args.calls, warmup=True)
+        pooled_warm_connections = server.connections
+    
+    print(f"调用次数: {args.calls}，TLS: {args.tls}")
+    print(_summary("requests.post(每次新建连接)", baseline, baseline_connections))
+    print(_summary("连接池(未预热)", pooled_cold, pooled_cold_connections))
+    print(_summary("连接池(已预热)", pooled_warm, pooled_warm_connections))
+    print(f"首次调用耗时: 基线={baseline[0] * 1000:.2f}ms，未预热={pooled_cold[0] * 1000:.2f}ms，已预热={pooled_warm[0] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+在标注的提示集上离线评估本地意图分类器的准确率、覆盖率、置信度校准和延迟，并与原有的规则匹配对比
+
+覆盖率是置信度达到阈值、不需要调用LLM的提示占比；ECE（期望校准误差）衡量置信度与实际正确率的差距。
+关键词和默认校准参数是在调优集intent_prompts.jsonl上调整的，调优集上的结果是样本内结果；
+留出集intent_prompts_heldout.jsonl不参与调优，用于评估实际效果，调整关键词时不要参考其中的错误样本。
+--fit-calibration会在调优集上拟合Platt缩放参数并在留出集上评估，结果可写入config.json的intent.local_classifier.calibration。
+
+运行方式（项目根目录）:
+    python -m benchmarks.bench_intent_classifier --threshold 0.8
+    python -m benchmarks.bench_intent_classifier --fit-calibration
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from app.agents.user_intent_agent import UserIntentAgent
+from app.services.config_service import ConfigService
+from app.services.intent_classifier import LocalIntentClassifier, fit_calibration
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(__file__), "data", "intent_prompts.jsonl")
+DEFAULT_HELDOUT = os.path.join(os.path.dirname(__file__), "data", "intent_prompts_heldout.jsonl")
+
+
+def _load_dataset(path: str) -> List[Dict[str, str]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def _expected_calibration_error(confidences: List[float], correct: List[bool], bins: int = 10) -> float:
+    total = len(confidences)
+    error = 0.0
+    for index in range(bins):
+        lower, upper = index / bins, (index + 1) / bins
+        members = [i for i, c in enumerate(confidences) if lower < c <= upper or (index == 0 and c == 0)]
+        if members:
+            accuracy = sum(correct[i] for i in members) / len(members)
+            confidence = sum(confidences[i] for i in members) / len(members)
+            error += len(members) / total * abs(accuracy - confidence)
+    return error
+
+
+def _evaluate(rows: List[Dict[str, str]], predict: Callable[[str], Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    predictions, latencies = [], []
+    for row in rows:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            prediction = predict(row["prompt"])
+        latencies.append((time.perf_counter() - start) / repeat)
+        predictions.append(prediction)
+    return {
+        "predictions": predictions,
+        "correct": [p["agent_type"] == row["agent_type"] for p, row in zip(predictions, rows)],
+        "confidences": [float(p["confidence"]) for p in predictions],
+        "latencies": latencies
+    }
+
+
+def _report(name: str, result: Dict[str, Any], threshold: float):
+    correct, confidences = result["correct"], result["confidences"]
+    covered = [ok for ok, confidence in zip(correct, confidences) if confidence >= threshold]
+    latencies = result["latencies"]
+    print(f"\n[{name}]")
+    print(f"  准确率            {sum(correct) / len(correct):.3f}")
+    print(f"  覆盖率(>={threshold})    {len(covered) / len(correct):.3f}")
+    print(f"  覆盖部分准确率    {sum(covered) / len(covered):.3f}" if covered else "  覆盖部分准确率    -")
+    print(f"  ECE               {_expected_calibration_error(confidences, correct):.3f}")
+    print(f"  延迟              p50={_percentile(latencies, 50) * 1e6:.1f}us p95={_percentile(latencies, 95) * 1e6:.1f}us")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="本地意图分类器离线基准测试")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="调优用的标注提示集，每行{\"prompt\": ..., \"agent_type\": ...}")
+    parser.add_argument("--heldout", default=DEFAULT_HELDOUT, help="不参与调优的留出提示集，格式同上")
+    parser.add_argument("--threshold", type=float, default=None, help="置信度阈值，默认使用配置中的值")
+    parser.add_argument("--model", default=None, help="scikit-learn模型文件路径，默认只使用关键词")
+    parser.add_argument("--repeat", type=int, default=20, help="每个提示重复预测的次数，用于测量延迟")
+    parser.add_argument("--fit-calibration", action="store_true", help="在调优集上拟合Platt缩放参数")
+    args = parser.parse_args()
+    
+    settings = ConfigService().get_global_config().get("intent", {}).get("local_classifier", {})
+    threshold = args.threshold if args.threshold is not None else settings.get("threshold", 0.8)
+    rows = _load_dataset(args.dataset)
+    heldout = _load_dataset(args.heldout)
+    classifier = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES, calibration=settings.get("calibration"),
+                                       model_path=args.model, model_weight=settings.get("model_weight", 0.5))
+    agent = UserIntentAgent(service_type="replay")
+    print(f"调优集提示数: {len(rows)}，留出集提示数: {len(heldout)}，置信度阈值: {threshold}，"
+          f"校准参数: {classifier.calibration}，模型: {args.model or '无'}")
+    
+    local = _evaluate(rows, classifier.predict, args.repeat)
+    local_heldout = _evaluate(heldout, classifier.predict, args.repeat)
+    _report("本地分类器 - 调优集（样本内）", local, threshold)
+    _report("本地分类器 - 留出集", local_heldout, threshold)
+    _report("规则匹配（原有备选方案） - 留出集", _evaluate(heldout, agent._rule_based_intent_recognition, args.repeat), threshold)
+    
+    errors = [(row, p) for row, p, ok in zip(heldout, local_heldout["predictions"], local_heldout["correct"]) if not ok]
+    if errors:
+        print("\n本地分类器留出集错误样本:")
+        for row, prediction in errors:
+            print(f"  {row['prompt']}  标注={row['agent_type']} 预测={prediction['agent_type']} 置信度={prediction['confidence']:.2f}")
+    
+    if args.fit_calibration:
+        matched = [(p["margin"], ok) for p, ok in zip(local["predictions"], local["correct"]) if p["matched_keywords"]]
+        a, b = fit_calibration([margin for margin, _ in matched], [ok for _, ok in matched])
+        print(f"\n拟合的校准参数: [{a:.4f}, {b:.4f}]（样本数: {len(matched)}，平均得分差: {statistics.mean(m for m, _ in matched):.2f}）")
+        fitted = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES, calibration=(a, b),
+                                       model_path=args.model, model_weight=settings.get("model_weight", 0.5))
+        _report("拟合参数 - 留出集", _evaluate(heldout, fitted.predict, 1), threshold)
+
+if __name__ == "__main__":
+    main_cli()
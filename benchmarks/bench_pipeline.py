@@ -0,0 +1,207 @@
+"""
+使用replay服务在无网络环境下测量分析流水线各阶段（数据加载、数据集预计算、意图识别、代理执行、结果保存）的耗时，
+数据集加载和预计算与意图识别并行，overlap为并行节省的时间
+
+首次运行时由脚本内置的模拟服务生成录制文件，之后的迭代全部从录制文件回放，
+回放延迟由--profile指定的配置（config.json中llm.replay.profiles）模拟。
+
+--mode fused使用融合路由模式（一次LLM调用同时识别意图和生成），与默认的两次调用对比时应同时指定--llm-intent，
+否则本地分类器直接确定意图，两种模式都只调用一次LLM；数据集较大时融合调用的提示词超过intent.fused.max_prompt_tokens，
+同样回退到两次调用。llm_calls和prompt_tokens为每个请求的平均LLM调用次数和提示词token数
+
+--code-cache启用生成代码缓存（默认关闭），数据分析需求在第一次迭代之后直接执行缓存的代码，不再调用LLM
+
+运行方式（项目根目录）:
+    python -m benchmarks.bench_pipeline --rows 20000 --iterations 5 --profile siliconflow_32b
+    python -m benchmarks.bench_pipeline --rows 200 --profile siliconflow_32b --llm-intent --mode fused
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# 必须在导入应用模块之前设置，让所有代理使用replay服务
+os.environ["LLM_SERVICE_TYPE_OVERRIDE"] = "replay"
+
+from app.services.base_llm_service import BaseLLMService
+from app.services.config_service import ConfigService
+from app.services.llm_metrics import collect_usage
+from app.services.llm_service_factory import LLMServiceFactory
+from app.services.session_service import SessionService
+from app.services.speculation import speculation_stats
+from app.agents.fused_routing_agent import fused_routing_stats
+from app.utils.stage_timer import StageTimer
+from app.utils.token_utils import estimate_tokens
+import app.main as main
+
+PROMPTS = {
+    "data_analysis": "按地区统计销售额的总和和均值",
+    "data_visualization": "绘制各地区销售额的柱状图",
+    "data_analysis_plan": "给我一个销售数据的分析方案",
+    "data_analysis_conclusion": "总结销售数据的分析结论",
+}
+
+ANALYSIS_CODE = '''```python
+import pandas as pd
+
+def analyze_data(dfs):
+    df = dfs[0]
+    summary = df.groupby("region", as_index=False)["amount"].agg(["sum", "mean"]).reset_index()
+    monthly = df.groupby(df["order_date"].str[:7], as_index=False)["amount"].sum()
+    return {"各地区销售额": summary, "月度销售额": monthly}
+```'''
+
+VISUALIZATION_HTML = '''```html
+<!DOCTYPE html>
+<html><head><script src="https://cdn.jsdelivr.net/npm/echarts/dist/echarts.min.js"></script></head>
+<body><div id="chart" style="height:400px"></div>
+<script>echarts.init(document.getElementById("chart")).setOption({xAxis:{type:"category",data:["华东","华北"]},yAxis:{},series:[{type:"bar",data:[1,2]}]});</script>
+</body></html>
+```'''
+
+
+def _task_output(agent_type: str) -> str:
+    """各代理的模拟输出"""
+    if agent_type == "data_analysis":
+        return ANALYSIS_CODE
+    if agent_type == "data_visualization":
+        return VISUALIZATION_HTML
+    return "1. 数据概览：共三个地区。\n2. 关键发现：华东地区销售额最高。\n" * 20
+
+
+class ScriptedLLMService(BaseLLMService):
+    """根据系统提示和用户提示返回固定内容的模拟服务，只用于生成录制文件"""
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        system = messages[0]["content"]
+        user = messages[-1]["content"]
+        agent_type = next((t for t, p in PROMPTS.items() if p in user), "data_analysis")
+        if "<route>" in system:
+            header = json.dumps({"agent_type": agent_type, "confidence": 0.95, "explanation": "基准测试"}, ensure_ascii=False)
+            content = f"<route>{header}</route>\n{_task_output(agent_type)}"
+        elif "意图识别" in system:
+            content = json.dumps({"agent_type": agent_type, "confidence": 0.95, "explanation": "基准测试"}, ensure_ascii=False)
+        else:
+            # 按提示对应的任务返回内容，两种调用方式的生成长度一致
+            content = _task_output(agent_type)
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        return {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+
+def _make_dataset(rows: int, path: str):
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        "region": rng.choice(["华东", "华北", "华南"], rows),
+        "amount": rng.integers(100, 10000, rows),
+        "order_date": pd.date_range("2024-01-01", periods=rows, freq="h").strftime("%Y-%m-%d"),
+    }).to_csv(path, index=False)
+
+
+async def _run_pipeline(session_id: str, dataset_id: str, prompt: str) -> Dict[str, float]:
+    """按/api/analyze的流程执行一次分析，返回各阶段耗时、LLM调用次数和提示词token数"""
+    timer = StageTimer()
+    usage = []
+    with collect_usage(usage):
+        inputs, intent, agent, result = await main._run_analysis(session_id, prompt, [dataset_id], timer)
+    
+    agent_type = intent.get("agent_type")
+    with timer.stage("persist"):
+        await asyncio.to_thread(main._persist_agent_result, session_id, agent_type, agent, result)
+    total = timer.snapshot()["wall_seconds"]
+    
+    # 等待后台预计算结束，使profile阶段计入统计；总耗时不包含这段等待
+    await asyncio.gather(*main._background_tasks, return_exceptions=True)
+    snapshot = timer.snapshot()
+    timings = {name: stage["seconds"] for name, stage in snapshot["stages"].items()}
+    timings["total"] = total
+    timings["overlap"] = snapshot["overlap_seconds"]
+    timings["llm_calls"] = len(usage)
+    timings["prompt_tokens"] = sum(item.get("prompt_tokens", 0) for item in usage)
+    return timings
+
+
+def _summary(values: List[float]) -> str:
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return f"mean={statistics.mean(values) * 1000:8.1f}ms p95={p95 * 1000:8.1f}ms"
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="离线分析流水线基准测试")
+    parser.add_argument("--rows", type=int, default=20000, help="测试数据集行数")
+    parser.add_argument("--iterations", type=int, default=5, help="每个提示的回放次数")
+    parser.add_argument("--profile", default="instant", help="回放延迟配置名称")
+    parser.add_argument("--fixtures", default=None, help="录制文件目录，默认使用临时目录")
+    parser.add_argument("--cache", action="store_true", help="启用LLM响应缓存（默认关闭，避免缓存掩盖回放延迟）")
+    parser.add_argument("--rate-limit", action="store_true", help="启用按模型限流（默认关闭，避免TPM配额等待掩盖流水线耗时）")
+    parser.add_argument("--llm-intent", action="store_true", help="关闭本地意图分类器，意图识别总是调用LLM")
+    parser.add_argument("--speculate", action="store_true", help="意图识别总是调用LLM，同时推测执行本地分类器预测的代理")
+    parser.add_argument("--mode", choices=["two_call", "fused"], default="two_call", help="意图识别和代理生成的调用方式")
+    parser.add_argument("--code-cache", action="store_true", help="启用生成代码缓存（默认关闭，避免缓存掩盖代码生成耗时）")
+    args = parser.parse_args()
+    
+    # 只修改内存中的配置，不写回配置文件
+    config = ConfigService().get_global_config()
+    config.setdefault("llm", {}).setdefault("cache", {})["enabled"] = args.cache
+    config["llm"].setdefault("rate_limit", {})["enabled"] = args.rate_limit
+    local_classifier = config.setdefault("intent", {}).setdefault("local_classifier", {})
+    local_classifier["enabled"] = not args.llm_intent
+    config["intent"]["mode"] = args.mode
+    if args.speculate:
+        # 本地分类结果只用于推测，不直接采用
+        local_classifier["enabled"] = True
+        local_classifier["threshold"] = 1.01
+        config["intent"]["speculation"] = {"enabled": True, "min_confidence": 0.5}
+    
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    config.setdefault("analysis", {})["code_cache"] = {"enabled": args.code_cache, "path": os.path.join(work_dir, "code_cache.sqlite3")}
+    fixtures_dir = args.fixtures or os.path.join(work_dir, "fixtures")
+    LLMServiceFactory.register_service("scripted", ScriptedLLMService)
+    
+    # 预先创建各模型的replay服务，代理通过工厂获取时会复用这些实例
+    models = {agent.get("config", {}).get("model") for agent in ConfigService().get_agents_config().get("agents", [])}
+    for model in models:
+        LLMServiceFactory.get_service("replay", model, fixtures_dir=fixtures_dir, mode="auto",
+                                      profile=args.profile, record_service_type="scripted")
+    
+    main.session_service = SessionService(os.path.join(work_dir, "sessions"))
+    session_id = main.session_service.create_session("benchmark")["id"]
+    data_path = os.path.join(work_dir, "sales.csv")
+    _make_dataset(args.rows, data_path)
+    main.session_service.add_dataset(session_id, "sales", {"name": "sales.csv", "path": data_path, "type": "uploaded", "preview": []})
+    
+    print(f"数据行数: {args.rows}，每个提示迭代: {args.iterations}，回放延迟配置: {args.profile}，调用方式: {args.mode}，录制目录: {fixtures_dir}")
+    for agent_type, prompt in PROMPTS.items():
+        # 第一次执行生成录制文件，不计入统计
+        asyncio.run(_run_pipeline(session_id, "sales", prompt))
+        runs = [asyncio.run(_run_pipeline(session_id, "sales", prompt)) for _ in range(args.iterations)]
+        print(f"\n[{agent_type}] {prompt}")
+        for stage in ("load", "profile", "intent", "speculation", "fused", "agent", "persist", "total", "overlap"):
+            print(f"  {stage:<13} {_summary([run.get(stage, 0.0) for run in runs])}")
+        print(f"  {'llm_calls':<13} {statistics.mean(run['llm_calls'] for run in runs):.1f}")
+        print(f"  {'prompt_tokens':<13} {statistics.mean(run['prompt_tokens'] for run in runs):.0f}")
+    
+    if args.speculate:
+        print("\n推测执行统计:")
+        print(json.dumps(speculation_stats.snapshot(), ensure_ascii=False, indent=2))
+    if args.mode == "fused":
+        print("\n融合路由统计:")
+        print(json.dumps(fused_routing_stats.snapshot(), ensure_ascii=False, indent=2))
+    
+    print("\nLLM服务统计:")
+    print(json.dumps(LLMServiceFactory.get_stats(), ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main_cli()
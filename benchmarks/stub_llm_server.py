@@ -0,0 +1,162 @@
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """模拟硅基流动 /chat/completions 接口的请求处理器"""
+    
+    # 使用HTTP/1.1才能保持keep-alive连接
+    protocol_version = "HTTP/1.1"
+    # 响应头与响应体分两次写出，需关闭Nagle算法以免与客户端延迟ACK叠加产生约40ms的额外等待
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+    
+    def _send_stream(self, payload: Dict[str, Any]):
+        """以SSE分块方式逐字返回内容"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in self.server.content:
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            chunk = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+    
+    def do_GET(self):
+        self._send_json(200, {"object": "list", "data": []})
+    
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.stats_lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if payload.get("stream"):
+            self._send_stream(payload)
+            return
+        self._send_json(200, {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.server.content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+        })
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # 默认监听队列长度为5，并发基准测试时会导致连接排队
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class StubLLMServer:
+    """
+    本地LLM接口桩服务，用于离线基准测试
+    
+    Args:
+        tls: 是否启用TLS（使用openssl生成自签名证书），启用后握手开销与真实环境更接近
+        latency: 每个请求的模拟服务端处理耗时（秒）
+        content: 返回的消息内容
+        token_delay: 流式输出时每个字符之间的间隔（秒）
+    """
+    
+    def __init__(self, tls: bool = False, latency: float = 0.0, content: str = "ok", token_delay: float = 0.0):
+        self.tls = tls
+        self.cert_file: Optional[str] = None
+        self._tmp_dir = None
+        self.httpd = _StubHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.httpd.stats_lock = threading.Lock()
+        self.httpd.connections = 0
+        self.httpd.requests = 0
+        self.httpd.latency = latency
+        self.httpd.content = content
+        self.httpd.token_delay = token_delay
+        if tls:
+            self._wrap_tls()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    
+    def _wrap_tls(self):
+        """生成自签名证书并将监听socket包装为TLS"""
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.cert_file = os.path.join(self._tmp_dir.name, "cert.pem")
+        key_file = os.path.join(self._tmp_dir.name, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+             "-keyout", key_file, "-out", self.cert_file],
+            check=True, capture_output=True
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert_file, key_file)
+        self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+    
+    @property
+    def api_base(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self.httpd.server_address[1]}/v1"
+    
+    @property
+    def connections(self) -> int:
+        return self.httpd.connections
+    
+    @property
+    def requests(self) -> int:
+        return self.httpd.requests
+    
+    def reset_stats(self):
+        with self.httpd.stats_lock:
+            self.httpd.connections = 0
+            self.httpd.requests = 0
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
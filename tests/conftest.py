@@ -0,0 +1,34 @@
+import pytest
+
+from app.agents.data_analysis_agent import DataAnalysisAgent
+
+
+class ScriptedAnalysisAgent(DataAnalysisAgent):
+    """按顺序返回预设代码的分析代理，记录每次LLM调用的提示信息和参数"""
+    
+    def __init__(self, contents):
+        super().__init__(service_type="replay")
+        self.contents = list(contents)
+        self.prompts = []
+        self.options = []
+    
+    @property
+    def calls(self):
+        return len(self.prompts)
+    
+    def _chat_completion(self, messages, **kwargs):
+        self.prompts.append(messages)
+        self.options.append(kwargs)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": f"```python\n{self.contents.pop(0)}```"}}],
+            "usage": {"prompt_tokens": 150, "completion_tokens": 60},
+        }
+    
+    async def _achat_completion(self, messages, **kwargs):
+        return self._chat_completion(messages, **kwargs)
+
+
+@pytest.fixture
+def scripted_agent():
+    """创建ScriptedAnalysisAgent，参数为依次返回的代码列表"""
+    return ScriptedAnalysisAgent
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pandas as pd
+import pytest
+
+import app.main as main
+from app.utils.prepared_dataset import prepare_frames
+
+CODE = '''def analyze_data(dfs):
+    df = dfs[0]
+    return {"总额": df.groupby("region", as_index=False)["amount"].sum()}
+'''
+
+
+@pytest.fixture
+def stream_request(monkeypatch, scripted_agent):
+    """用预设的数据集、意图和代码执行流式分析请求，返回全部事件"""
+    async def recognize_intent(user_prompt, local_prediction=None):
+        return {"agent_type": "data_analysis", "confidence": 1.0}
+    
+    monkeypatch.setattr(main, "_load_prepared_inputs",
+                        lambda session_id, selected: prepare_frames([pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})]))
+    monkeypatch.setattr(main, "_recognize_intent", recognize_intent)
+    monkeypatch.setattr(main, "_record_user_message", lambda *args: None)
+    monkeypatch.setattr(main, "_save_analysis_results", lambda *args: [])
+    monkeypatch.setattr("app.agents.data_analysis_agent.get_code_cache", lambda: None)
+    monkeypatch.setitem(main.AGENT_CLASSES, "data_analysis", lambda: scripted_agent([CODE]))
+    
+    async def run(request):
+        response = await main.analyze_data_stream({"session_id": "s", "prompt": "按地区统计销售额", "selected_datasets": ["d"], **request})
+        events = []
+        async for chunk in response.body_iterator:
+            event, data = chunk.strip().split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+    
+    return lambda request: asyncio.run(run(request))
+
+
+def test_stream_returns_execution_profile_when_requested(stream_request):
+    event, result = stream_request({"profile": True})[-1]
+    
+    assert event == "result"
+    assert result["execution_profile"]["lines"]
+    
+    event, result = stream_request({})[-1]
+    assert event == "result"
+    assert "execution_profile" not in result
+
+
+def test_stream_generator_is_closed_when_client_disconnects():
+    closed = []
+    
+    async def events():
+        try:
+            for index in range(10):
+                yield f"event: token\ndata: {index}\n\n"
+        finally:
+            closed.append(True)
+    
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("client disconnected")
+    
+    async def disconnect():
+        response = main.ClosingStreamingResponse(events(), media_type="text/event-stream")
+        with pytest.raises(Exception):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, None, send)
+        # 在事件循环结束前检查，不依赖关闭事件循环时对异步生成器的清理
+        return list(closed)
+    
+    assert asyncio.run(disconnect()) == [True]
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+from app.services.base_llm_service import BaseLLMService
+
+
+class EchoService(BaseLLMService):
+    """按输入返回内容、可按内容失败的测试服务，记录最大并发数"""
+    
+    def __init__(self):
+        super().__init__(model="batch-model")
+        self._lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            content = messages[-1]["content"]
+            time.sleep(0.05 if content != "slow" else 0.2)
+            if content == "fail":
+                raise ValueError("模型调用失败")
+            return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def _requests(contents):
+    return [{"messages": [{"role": "user", "content": content}]} for content in contents]
+
+
+def test_batch_keeps_order_and_isolates_failures():
+    service = EchoService()
+    results = service.chat_completion_batch(_requests(["slow", "a", "fail", "b", "c", "d"]), max_parallel=3)
+    
+    assert [result["index"] for result in results] == list(range(6))
+    assert results[0]["response"]["choices"][0]["message"]["content"] == "slow"
+    assert results[2]["response"] is None
+    assert results[2]["error_type"] == "ValueError"
+    assert results[3]["error"] is None
+    assert results[0]["latency_seconds"] >= 0.2
+    assert service.max_active <= 3
+
+
+def test_async_batch_is_concurrent_and_bounded():
+    service = EchoService()
+    
+    start = time.perf_counter()
+    results = asyncio.run(service.achat_completion_batch(_requests([str(i) for i in range(8)]), max_parallel=4))
+    elapsed = time.perf_counter() - start
+    
+    assert [result["response"]["choices"][0]["message"]["content"] for result in results] == [str(i) for i in range(8)]
+    assert service.max_active <= 4
+    assert elapsed < 8 * 0.05
@@ -0,0 +1,85 @@
+import asyncio
+
+import pandas as pd
+
+from app.services.code_cache import GeneratedCodeCache, build_code_key, normalize_requirement
+
+CODE = '''def analyze_data(dfs):
+    df = dfs[0]
+    return {"总额": df.groupby("region", as_index=False)["amount"].sum()}
+'''
+
+
+def _use_cache(monkeypatch, tmp_path):
+    cache = GeneratedCodeCache(str(tmp_path / "code.sqlite3"))
+    monkeypatch.setattr("app.agents.data_analysis_agent.get_code_cache", lambda: cache)
+    return cache
+
+
+def test_requirement_normalization():
+    assert normalize_requirement("  按地区 统计\n销售额。") == normalize_requirement("按地区 统计 销售额")
+    assert normalize_requirement("ＴＯＰ５地区！") == "top5地区"
+    assert build_code_key("schema", "统计销售额") == build_code_key("schema", "统计销售额？")
+    assert build_code_key("schema", "统计销售额") != build_code_key("other", "统计销售额")
+
+
+def test_cached_code_runs_on_refreshed_data(monkeypatch, tmp_path, scripted_agent):
+    cache = _use_cache(monkeypatch, tmp_path)
+    agent = scripted_agent([CODE])
+    
+    first = agent.execute([pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})], "按地区统计销售额")
+    refreshed = pd.DataFrame({"region": ["东", "东", "西"], "amount": [5, 6, 7]})
+    second = asyncio.run(agent.aexecute([refreshed], "按地区统计销售额。"))
+    
+    assert agent.calls == 1
+    assert first["总额"]["amount"] == [1, 2]
+    assert second["总额"]["amount"] == [11, 7]
+    assert cache.stats()["hits"] == 1
+    
+    # schema变化时不使用缓存
+    agent.contents.append(CODE)
+    agent.execute([refreshed.assign(amount=refreshed["amount"].astype(float))], "按地区统计销售额")
+    assert agent.calls == 2
+
+
+def test_failing_code_is_not_cached_and_stale_code_is_repaired(monkeypatch, tmp_path, scripted_agent):
+    cache = _use_cache(monkeypatch, tmp_path)
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    broken = "def analyze_data(dfs):\n    raise ValueError('bad')\n"
+    
+    # 修复后的代码仍然失败
+    agent = scripted_agent([broken] * 3)
+    try:
+        agent.execute([df], "按地区统计销售额")
+    except ValueError:
+        pass
+    assert cache.stats()["entries"] == 0
+    
+    # 缓存的代码在新数据上执行失败时按错误信息修复，修复后的代码替换原来的缓存
+    key = agent._prepare_generation([df], "按地区统计销售额")["cache_key"]
+    cache.put(key, "def analyze_data(dfs):\n    return dfs[0]['missing']", "按地区统计销售额")
+    agent = scripted_agent([CODE])
+    result = asyncio.run(agent.aexecute([df], "按地区统计销售额"))
+    
+    assert agent.calls == 1
+    assert result["总额"]["amount"] == [1, 2]
+    assert cache.stats()["invalidations"] == 0
+    assert cache.get(key) == agent.generated_code
+
+
+def test_regeneration_after_invalidation_skips_response_cache(monkeypatch, tmp_path, scripted_agent):
+    cache = _use_cache(monkeypatch, tmp_path)
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    stale = "def analyze_data(dfs):\n    return dfs[0]['missing']"
+    key = scripted_agent([])._prepare_generation([df], "按地区统计销售额")["cache_key"]
+    
+    for run in (lambda agent: agent.execute([df], "按地区统计销售额"),
+                lambda agent: asyncio.run(agent.aexecute([df], "按地区统计销售额"))):
+        cache.put(key, stale, "按地区统计销售额")
+        # 两次修复都失败后删除缓存的代码并重新生成
+        agent = scripted_agent([stale] * 2 + [CODE])
+        result = run(agent)
+        
+        assert result["总额"]["amount"] == [1, 2]
+        assert agent.calls == 3
+        assert agent.options[-1] == {"use_cache": False}
@@ -0,0 +1,52 @@
+import re
+import traceback
+
+import pandas as pd
+import pytest
+
+from app.services.code_sandbox import run_analysis_code
+from app.agents.data_analysis_agent import DataAnalysisAgent
+from app.utils.code_compiler import FORBIDDEN_CALLS, FORBIDDEN_MODULES, CodeCheckError, CompiledCodeCache
+
+VALID = "import numpy as np\n\ndef analyze_data(dfs):\n    return {\"行数\": pd.DataFrame({\"n\": [len(dfs[0])]})}\n"
+
+
+@pytest.mark.parametrize("source, message", [
+    ("import os\ndef analyze_data(dfs):\n    return {}", "禁止使用的模块: os"),
+    ("from subprocess import run\ndef analyze_data(dfs):\n    return {}", "禁止使用的模块: subprocess"),
+    ("def analyze_data(dfs):\n    import urllib.request\n    return {}", "第2行导入了禁止使用的模块: urllib.request"),
+    ("def analyze_data(dfs):\n    return __import__('os')", "禁止使用的函数: __import__"),
+    ("def analyze_data(dfs):\n    return {\n", "第2行存在语法错误"),
+    ("def analyze(dfs):\n    return {}", "没有定义analyze_data函数"),
+])
+def test_pre_check_rejects_code_before_execution(source, message):
+    with pytest.raises(CodeCheckError, match=message):
+        CompiledCodeCache().compile(source)
+
+
+def test_compiled_code_is_cached_by_source():
+    cache = CompiledCodeCache(max_entries=1)
+    
+    assert cache.compile(VALID) is cache.compile(VALID)
+    cache.compile(VALID + "\n")
+    assert cache.get_stats() == {"entries": 1, "max_entries": 1, "hits": 1, "misses": 2}
+
+
+def test_runs_in_fresh_namespace_with_source_in_traceback():
+    source = "import pandas as pd\n\ndef analyze_data(dfs):\n    return {\"x\": dfs[0][\"missing\"].to_frame()}\n"
+    
+    with pytest.raises(KeyError) as excinfo:
+        run_analysis_code(source, [pd.DataFrame({"a": [1]})])
+    assert 'return {"x": dfs[0]["missing"].to_frame()}' in "".join(traceback.format_tb(excinfo.tb))
+    
+    # 每次执行使用新的命名空间，模块级状态不会在两次执行之间保留
+    counter = "import pandas as pd\ncount = 0\n\ndef analyze_data(dfs):\n    global count\n    count += 1\n    return {\"n\": pd.DataFrame({\"n\": [count]})}\n"
+    assert run_analysis_code(counter, [])["n"]["n"].tolist() == [1]
+    assert run_analysis_code(counter, [])["n"]["n"].tolist() == [1]
+
+
+def test_generation_prompt_lists_forbidden_names():
+    modules = re.search(r"禁止导入以下模块：(.*)；", DataAnalysisAgent.SYSTEM_PROMPT).group(1)
+    calls = re.search(r"禁止调用以下函数：(.*)。", DataAnalysisAgent.SYSTEM_PROMPT).group(1)
+    assert set(modules.split(", ")) == FORBIDDEN_MODULES
+    assert set(calls.split(", ")) == FORBIDDEN_CALLS
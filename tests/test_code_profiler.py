@@ -0,0 +1,57 @@
+import pandas as pd
+
+from app.services.code_sandbox import CodeSandbox, profile_analysis_code
+from app.utils.code_profiler import request_profiling
+
+CODE = '''import numpy as np
+import pandas as pd
+
+def analyze_data(dfs):
+    df = dfs[0]
+    big = pd.DataFrame({"x": np.arange(200000, dtype=np.int64)})
+    totals = []
+    for value in df["amount"]:
+        totals.append(value * 2)
+    summary = df.groupby("region", as_index=False)["amount"].sum()
+    return {"总额": summary}
+'''
+
+
+def test_profile_records_lines_memory_and_frames():
+    df = pd.DataFrame({"region": ["东", "西", "东"], "amount": [1, 2, 3]})
+    
+    result, profile = profile_analysis_code(CODE, [df])
+    
+    assert result["总额"]["amount"].tolist() == [4, 2]
+    lines = {line["line"]: line for line in profile["lines"]}
+    assert lines[9]["hits"] == 3 and lines[9]["code"] == "totals.append(value * 2)"
+    assert lines[6]["peak_memory_bytes"] >= 200000 * 8
+    frames = {frame["name"]: frame for frame in profile["frames"]}
+    assert (frames["big"]["line"], frames["big"]["rows"], frames["big"]["columns"]) == (6, 200000, 1)
+    assert frames["big"]["bytes"] >= 200000 * 8
+    assert (frames["summary"]["line"], frames["summary"]["rows"]) == (10, 2)
+
+
+def test_sandbox_returns_profile_from_worker():
+    sandbox = CodeSandbox(workers=1)
+    try:
+        df = pd.DataFrame({"region": ["东"], "amount": [1]})
+        result, profile = sandbox.run_profiled(CODE, [df])
+        assert result["总额"]["amount"].tolist() == [1]
+        assert profile["frames"][0]["name"] == "big"
+        assert sandbox.run(CODE, [df])["总额"]["amount"].tolist() == [1]
+    finally:
+        sandbox.shutdown()
+
+
+def test_agent_profiles_only_when_requested(monkeypatch, scripted_agent):
+    monkeypatch.setattr("app.agents.data_analysis_agent.get_code_cache", lambda: None)
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    agent = scripted_agent([CODE] * 2)
+    
+    agent.execute([df], "按地区统计销售额")
+    assert agent.execution_profile is None
+    
+    with request_profiling():
+        agent.execute([df], "按地区统计销售额")
+    assert agent.execution_profile["lines"]
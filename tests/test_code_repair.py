@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.agents.data_analysis_agent import DataAnalysisAgent
+from app.services.base_llm_service import BaseLLMService
+from app.services.code_sandbox import CodeSandbox, RemoteTraceback
+from app.services.llm_cache import CachedLLMService, LLMResponseCache
+from app.utils.code_repair import code_repair_stats, compact_traceback, relevant_columns
+from app.utils.token_utils import estimate_message_tokens
+
+BROKEN = '''import pandas as pd
+
+def analyze_data(dfs):
+    df = dfs[0]
+    return {"总额": df.groupby("region", as_index=False)["amt"].sum()}
+'''
+
+FIXED = BROKEN.replace('"amt"', '"amount"')
+
+
+def test_compact_traceback_keeps_analysis_frames_and_error():
+    sandbox = CodeSandbox(workers=1)
+    try:
+        with pytest.raises(KeyError) as excinfo:
+            sandbox.run(BROKEN, [pd.DataFrame({"region": ["东"], "amount": [1]})])
+    finally:
+        sandbox.shutdown()
+    assert isinstance(excinfo.value.__cause__, RemoteTraceback)
+    
+    compact = compact_traceback(excinfo.value.__cause__.tb)
+    
+    lines = compact.splitlines()
+    assert lines[0] == '第5行, in analyze_data: return {"总额": df.groupby("region", as_index=False)["amt"].sum()}'
+    assert lines[-1] == "KeyError: 'Column not found: amt'"
+    assert "pandas" not in compact and "code_sandbox" not in compact
+
+
+def test_relevant_columns_lists_dtypes_and_all_columns_for_unknown_names():
+    df = pd.DataFrame({"region": ["东", None], "amount": [1.0, np.nan], "other": [1, 2]})
+    
+    columns = relevant_columns(BROKEN, "KeyError: 'Column not found: amt'", [df])
+    assert columns.splitlines() == [
+        'dfs[0]["region"]: str，含缺失值',
+        "dfs[0]的全部列: region(str), amount(float64), other(int64)",
+    ]
+    assert relevant_columns(FIXED, "ZeroDivisionError: division by zero", [df]).splitlines() == [
+        'dfs[0]["region"]: str，含缺失值',
+        'dfs[0]["amount"]: float64，含缺失值',
+    ]
+
+
+def test_failing_code_is_repaired_with_compact_prompt(monkeypatch, scripted_agent):
+    monkeypatch.setattr("app.agents.data_analysis_agent.get_code_cache", lambda: None)
+    code_repair_stats.reset()
+    df = pd.DataFrame({"region": ["东", "西", "东"], "amount": [1, 2, 3]})
+    agent = scripted_agent([BROKEN, FIXED])
+    
+    result = agent.execute([df], "按地区统计销售额")
+    
+    assert result["总额"] == {"region": ["东", "西"], "amount": [4, 2]}
+    assert agent.generated_code.strip() == FIXED.strip()
+    generation_prompt, repair_prompt = agent.prompts
+    # 系统指令相同以复用前缀缓存，用户消息不再附带schema和数据
+    assert repair_prompt[0] == generation_prompt[0]
+    assert "KeyError: 'Column not found: amt'" in repair_prompt[1]["content"]
+    assert "数据信息" not in repair_prompt[1]["content"]
+    
+    # 两边使用同一估算方法，与响应中的usage无关
+    stats = code_repair_stats.snapshot()
+    assert (stats["attempts"], stats["repaired"], stats["success_rate"], stats["compared_calls"]) == (1, 1, 1.0, 1)
+    assert stats["repair_prompt_tokens"] == estimate_message_tokens(repair_prompt)
+    assert stats["regeneration_prompt_tokens"] == estimate_message_tokens(generation_prompt)
+    assert stats["tokens_saved"] == stats["regeneration_prompt_tokens"] - stats["repair_prompt_tokens"]
+
+
+def test_repair_is_bounded(monkeypatch, scripted_agent):
+    monkeypatch.setattr("app.agents.data_analysis_agent.get_code_cache", lambda: None)
+    code_repair_stats.reset()
+    agent = scripted_agent([BROKEN] * 3)
+    
+    with pytest.raises(KeyError):
+        agent.execute([pd.DataFrame({"region": ["东"], "amount": [1]})], "按地区统计销售额")
+    
+    assert len(agent.prompts) == 3
+    stats = code_repair_stats.snapshot()
+    assert (stats["attempts"], stats["failed"], stats["repair_calls"]) == (1, 1, 2)
+
+
+class QueuedService(BaseLLMService):
+    """按顺序返回预设代码的测试服务"""
+    
+    def __init__(self, contents):
+        super().__init__(model="test-model")
+        self.contents = list(contents)
+        self.calls = 0
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        self.calls += 1
+        return {"choices": [{"message": {"role": "assistant", "content": f"```python\n{self.contents.pop(0)}```"}}]}
+
+
+def test_repair_calls_bypass_response_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.agents.data_analysis_agent.get_code_cache", lambda: None)
+    inner = QueuedService([BROKEN, BROKEN, BROKEN, FIXED])
+    service = CachedLLMService(inner, LLMResponseCache(str(tmp_path / "cache.sqlite3")))
+    agent = DataAnalysisAgent(service_type="replay")
+    monkeypatch.setattr(agent, "get_llm_service", lambda: service)
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    
+    with pytest.raises(KeyError):
+        agent.execute([df], "按地区统计销售额")
+    assert inner.calls == 3
+    
+    # 重试时代码生成命中响应缓存，同样错误的修复请求仍然发给LLM
+    result = agent.execute([df], "按地区统计销售额")
+    assert result["总额"] == {"region": ["东", "西"], "amount": [1, 2]}
+    assert inner.calls == 4
@@ -0,0 +1,128 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.services.code_sandbox as code_sandbox
+from app.services.code_sandbox import CodeSandbox, RemoteTraceback, SandboxTimeoutError, SandboxWorkerError
+from app.utils.columnar import decode_frame, encode_frame
+
+
+def _analysis(body):
+    return "import numpy as np\n\ndef analyze_data(dfs):\n" + "".join(f"    {line}\n" for line in body.splitlines())
+
+
+@pytest.fixture
+def sandbox():
+    sandbox = CodeSandbox(workers=1, timeout_seconds=10, cpu_seconds=2, memory_mb=512)
+    yield sandbox
+    sandbox.shutdown()
+
+
+def test_columnar_round_trip():
+    df = pd.DataFrame({
+        "amount": [1.5, np.nan, 2.0],
+        "region": ["东", None, "东"],
+        "mixed": pd.Series(["a", 1, None], dtype=object),
+        "level": pd.Categorical(["低", "高", "低"]),
+        "count": pd.array([1, None, 3], dtype="Int64"),
+        "date": pd.date_range("2024-01-01", periods=3, tz="Asia/Shanghai"),
+        "tags": [["a"], [], ["b"]],
+    }, index=[10, 11, 12])
+    
+    meta, buffers = encode_frame(df)
+    # 字符串和分类列只传输整数编码
+    assert sum(buffer.nbytes for buffer in buffers) == 3 * 8 + 2 * 3 * 4
+    
+    restored = decode_frame(pickle.loads(pickle.dumps(meta)), [bytearray(buffer) for buffer in buffers])
+    pd.testing.assert_frame_equal(restored, df)
+
+
+def test_columnar_keeps_mixed_object_values():
+    df = pd.DataFrame({
+        "mixed": pd.Series([1, True, "1", None], dtype=object),
+    })
+    
+    meta, buffers = encode_frame(df)
+    restored = decode_frame(pickle.loads(pickle.dumps(meta)), [bytearray(buffer) for buffer in buffers])
+    
+    assert meta["specs"][0]["kind"] == "object"
+    assert restored["mixed"].tolist() == [1, True, "1", None]
+    assert [type(value) for value in restored["mixed"]] == [int, bool, str, type(None)]
+
+
+def test_columnar_dictionary_encodes_strings_with_missing_values():
+    df = pd.DataFrame({"names": pd.Series(["a", np.nan, "b", None, "a"], dtype=object)})
+    
+    meta, buffers = encode_frame(df)
+    restored = decode_frame(pickle.loads(pickle.dumps(meta)), [bytearray(buffer) for buffer in buffers])
+    
+    # 字符串对象列即使含缺失值也只传输整数编码，缺失值按原来的None或NaN还原
+    assert meta["specs"][0]["kind"] == "dict"
+    assert sum(buffer.nbytes for buffer in buffers) == 5 * 4
+    values = restored["names"].tolist()
+    assert restored["names"].dtype == object
+    assert (values[0], values[2], values[3], values[4]) == ("a", "b", None, "a")
+    assert isinstance(values[1], float) and np.isnan(values[1])
+    pd.testing.assert_frame_equal(restored, df)
+
+
+def test_runs_code_in_worker_and_returns_frames(sandbox):
+    df = pd.DataFrame({"region": ["东", "西", "东"], "amount": [1, 2, 3]})
+    code = _analysis('dfs[0]["amount"] *= 10\nreturn {"总额": dfs[0].groupby("region", as_index=False)["amount"].sum()}')
+    
+    result = sandbox.run(code, [df])
+    
+    assert result["总额"].to_dict(orient="list") == {"region": ["东", "西"], "amount": [40, 20]}
+    # 工作进程中的修改不影响API进程中的数据
+    assert df["amount"].tolist() == [1, 2, 3]
+
+
+def test_errors_keep_type_and_remote_traceback(sandbox):
+    with pytest.raises(KeyError) as excinfo:
+        sandbox.run(_analysis('return {"x": dfs[0]["missing"]}'), [pd.DataFrame({"a": [1]})])
+    
+    assert isinstance(excinfo.value.__cause__, RemoteTraceback)
+    assert "analyze_data" in str(excinfo.value.__cause__)
+
+
+def test_limits_are_enforced_and_pool_recovers(sandbox):
+    df = pd.DataFrame({"a": [1, 2]})
+    
+    with pytest.raises(SandboxTimeoutError):
+        sandbox.run(_analysis("while True:\n    pass"), [df])
+    with pytest.raises(MemoryError):
+        sandbox.run(_analysis("block = np.ones(2 * 1024 ** 3, dtype=np.uint8)\nreturn {}"), [df])
+    
+    # 墙钟超时时终止工作进程，之后的任务使用新的工作进程
+    sandbox.timeout_seconds = 1
+    with pytest.raises(SandboxTimeoutError):
+        sandbox.run(_analysis("import time\ntime.sleep(30)"), [df])
+    
+    sandbox.timeout_seconds = 10
+    assert sandbox.run(_analysis('return {"a": dfs[0]}'), [df])["a"]["a"].tolist() == [1, 2]
+    stats = sandbox.stats()
+    assert (stats["timeouts"], stats["errors"], stats["workers_started"]) == (2, 1, 2)
+
+
+def test_partial_transfer_replaces_worker(sandbox, monkeypatch):
+    encode_frames = code_sandbox._encode_frames
+    
+    def corrupt_first_frame(frames):
+        metas, buffers = encode_frames(frames)
+        metas[0] = dict(metas[0], specs=[dict(metas[0]["specs"][0], dtype="no-such-dtype")])
+        return metas, buffers
+    
+    # 工作进程还原第一个DataFrame时失败，第二个DataFrame的缓冲区还留在管道中
+    monkeypatch.setattr(code_sandbox, "_encode_frames", corrupt_first_frame)
+    frames = [pd.DataFrame({"a": [1, 2]}), pd.DataFrame({"b": [3, 4]})]
+    with pytest.raises(SandboxWorkerError) as excinfo:
+        sandbox.run(_analysis('return {"a": dfs[0]}'), frames)
+    assert isinstance(excinfo.value.__cause__, RemoteTraceback)
+    
+    monkeypatch.setattr(code_sandbox, "_encode_frames", encode_frames)
+    result = sandbox.run(_analysis('return {"b": dfs[1]}'), frames)
+    assert result["b"]["b"].tolist() == [3, 4]
+    stats = sandbox.stats()
+    assert (stats["crashes"], stats["workers_started"]) == (1, 2)
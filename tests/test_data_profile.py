@@ -0,0 +1,75 @@
+import time
+
+import pandas as pd
+
+from app.agents.data_analysis_conclusion_agent import DataAnalysisConclusionAgent
+from app.agents.data_analysis_plan_agent import DataAnalysisPlanAgent
+from app.utils.data_profile import DataProfile
+from app.utils.prepared_dataset import ProfileCache, dataframe_fingerprint, get_profile_cache, prepare_frames, prepare_inputs
+from app.utils.stage_timer import StageTimer
+
+
+def test_profile_values_are_computed_once():
+    profile = DataProfile(pd.DataFrame({"region": ["东", "西", "东"], "amount": [1, 2, 3]}))
+    
+    summary = profile.warm().statistical_summary()
+    
+    assert profile.statistical_summary() is summary
+    assert list(profile.columns) == ["region", "amount"]
+    assert profile.columns["amount"] == "int64"
+    assert summary["categorical"]["region"]["top_values"] == {"东": 2, "西": 1}
+
+
+def test_agent_uses_precomputed_datasets():
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    datasets = prepare_frames([df])
+    agent = DataAnalysisPlanAgent(service_type="replay")
+    
+    df_names, schema_infos, messages = agent._prepare_messages(datasets, "给我一个分析方案")
+    _, raw_schema_infos, raw_messages = agent._prepare_messages([df], "给我一个分析方案")
+    
+    assert df_names == ["df_0"]
+    assert schema_infos[0]["sample_data"] is datasets[0].profile.sample_records()
+    assert (schema_infos, messages) == (raw_schema_infos, raw_messages)
+
+
+def test_same_content_shares_profile():
+    get_profile_cache().clear()
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    
+    first = prepare_inputs([df])[0]
+    first.profile.warm()
+    second = prepare_inputs([df.copy()])[0]
+    changed = prepare_inputs([df.assign(amount=[1, 3])])[0]
+    
+    assert second is not first and second.fingerprint == first.fingerprint
+    assert second.profile is first.profile
+    assert changed.fingerprint != first.fingerprint
+    assert get_profile_cache().get_stats()["hits"] == 1
+    # 各代理从同一份schema中选取自己需要的字段
+    assert list(DataAnalysisConclusionAgent(service_type="replay")._get_schema_info(second)) == ["columns", "row_count", "column_count"]
+
+
+def test_fingerprint_handles_unhashable_values_and_cache_evicts():
+    df = pd.DataFrame({"tags": [["a"], ["b"]]})
+    assert dataframe_fingerprint(df) == dataframe_fingerprint(df.copy())
+    
+    cache = ProfileCache(max_entries=1)
+    cache.get("a", df)
+    cache.get("b", df)
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.get("b", df) is cache.get("b", df)
+
+
+def test_stage_timer_reports_overlap():
+    timer = StageTimer()
+    timer._stages = {"load": (0.0, 0.2), "intent": (0.0, 1.0), "agent": (1.0, 3.0)}
+    
+    timings = timer.snapshot()
+    
+    assert timings["sequential_seconds"] == 3.2
+    assert abs(timings["overlap_seconds"] - 0.2) < 1e-9
+    
+    with timer.stage("persist"):
+        time.sleep(0.01)
+    assert timer.snapshot()["stages"]["persist"]["seconds"] >= 0.01
@@ -0,0 +1,70 @@
+import asyncio
+
+import pandas as pd
+
+from app.agents.data_analysis_plan_agent import DataAnalysisPlanAgent
+from app.agents.fused_routing_agent import FusedRoutingAgent, fused_routing_stats
+from app.utils.prepared_dataset import prepare_frames
+
+
+def _response(content):
+    return {
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+    }
+
+
+def test_envelope_splits_intent_and_task_output():
+    fused_routing_stats.reset()
+    agent = FusedRoutingAgent(service_type="replay")
+    content = '<think>先判断任务</think><route>{"agent_type": "data_analysis_plan", "confidence": 0.9}</route>\n1. 数据理解'
+    
+    routed = agent._parse_envelope(_response(content), "给我一个分析方案")
+    
+    assert routed["intent"]["agent_type"] == "data_analysis_plan"
+    assert routed["intent"]["source"] == "fused"
+    assert routed["response"]["choices"][0]["message"]["content"] == "1. 数据理解"
+    assert routed["response"]["usage"]["prompt_tokens"] == 100
+    
+    # 交给对应代理完成后续处理，结果与两次调用时一致
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    datasets = prepare_frames([df])
+    plan_agent = DataAnalysisPlanAgent(service_type="replay")
+    result = asyncio.run(plan_agent.afinish(plan_agent.build_generation(datasets, "给我一个分析方案", routed["response"])))
+    assert result["plan"] == "1. 数据理解"
+    assert result["data_info"]["dataset_names"] == ["df_0"]
+
+
+def test_invalid_envelope_is_rejected():
+    fused_routing_stats.reset()
+    agent = FusedRoutingAgent(service_type="replay")
+    
+    assert agent._parse_envelope(_response("1. 数据理解"), "方案") is None
+    assert agent._parse_envelope(_response('<route>{"agent_type": "unknown"}</route>\n内容'), "方案") is None
+    assert agent._parse_envelope(_response('<route>{"agent_type": "data_analysis"}</route>'), "方案") is None
+    assert agent._parse_envelope(_response('<route>{agent_type}</route>\n内容'), "方案") is None
+    stats = fused_routing_stats.snapshot()
+    assert (stats["rejected"], stats["accept_rate"]) == (4, 0.0)
+
+
+def test_fused_prompt_includes_every_task_instruction():
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    agent = FusedRoutingAgent(service_type="replay")
+    
+    messages = agent._prepare_messages(prepare_frames([df]), "画一个柱状图")
+    
+    for agent_type in ("data_analysis", "data_visualization", "data_analysis_plan", "data_analysis_conclusion"):
+        assert f"## {agent_type} - " in messages[0]["content"]
+    assert "## 统计摘要" in messages[1]["content"]
+    assert messages[1]["content"].endswith("画一个柱状图")
+    
+
+def test_large_prompt_skips_fused_call(monkeypatch):
+    fused_routing_stats.reset()
+    monkeypatch.setattr("app.services.config_service.ConfigService.get_config_value",
+                        lambda self, key, default=None: 100 if key == "intent.fused.max_prompt_tokens" else default)
+    df = pd.DataFrame({"region": ["东", "西"] * 50, "amount": range(100)})
+    
+    # 超出上限时不调用LLM，replay服务没有录制文件，调用会失败
+    assert FusedRoutingAgent(service_type="replay").execute(prepare_frames([df]), "画一个柱状图") is None
+    assert fused_routing_stats.snapshot()["skipped"] == 1
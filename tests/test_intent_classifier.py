@@ -0,0 +1,126 @@
+import asyncio
+import math
+import os
+
+import pytest
+
+from app.agents.user_intent_agent import UserIntentAgent
+from app.services.config_service import ConfigService
+from app.services.intent_classifier import AhoCorasick, LocalIntentClassifier, collect_history_samples, fit_calibration
+from app.utils.file_utils import get_project_root
+
+
+def test_aho_corasick_finds_overlapping_matches():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    
+    matches = sorted(automaton.iter_matches("ushers"))
+    
+    assert matches == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+
+def test_longer_keyword_wins_over_generic_one():
+    classifier = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES)
+    
+    prediction = classifier.predict("这份数据应该怎么分析")
+    
+    assert prediction["agent_type"] == "data_analysis_plan"
+    assert prediction["matched_keywords"] == ["怎么分析"]
+
+
+def test_clear_prompt_is_confident_and_ambiguous_prompt_is_not():
+    classifier = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES)
+    
+    clear = classifier.predict("画一个各地区销售额的柱状图")
+    ambiguous = classifier.predict("给出数据的建议和结论")
+    unknown = classifier.predict("你好")
+    
+    assert clear["agent_type"] == "data_visualization"
+    assert clear["confidence"] >= 0.8
+    assert ambiguous["confidence"] < 0.8
+    assert unknown["confidence"] == 0.0
+
+
+def test_single_generic_keyword_is_not_accepted_locally():
+    classifier = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES)
+    
+    # 只命中通用的“分析”，交给LLM识别
+    generic = classifier.predict("应该用什么方法分析销售下滑的原因")
+    # 命中两个关键词或一个较长的关键词时可以直接采用
+    two_hits = classifier.predict("统计各地区的销售额汇总")
+    long_keyword = classifier.predict("各地区销售额的柱状图")
+    
+    assert generic["matched_keywords"] == ["分析"]
+    assert generic["confidence"] < 0.8
+    assert (two_hits["agent_type"], two_hits["confidence"] >= 0.8) == ("data_analysis", True)
+    assert (long_keyword["agent_type"], long_keyword["confidence"] >= 0.8) == ("data_visualization", True)
+
+
+def test_rule_fallback_uses_only_base_keywords():
+    agent = UserIntentAgent(service_type="replay")
+    
+    # 本地分类器的补充关键词不参与规则匹配
+    assert agent._rule_based_intent_recognition("各品类的占比排名") == {
+        "agent_type": "data_analysis", "confidence": 0.5, "explanation": "未找到明确的意图指示，默认使用数据分析代理"
+    }
+    # 得分按keywords的数量归一化：可视化2/10高于分析1/11
+    result = agent._rule_based_intent_recognition("统计销量并绘制图表")
+    assert (result["agent_type"], result["confidence"]) == ("data_visualization", 0.2)
+
+
+def test_fit_calibration_orders_confidence_by_margin():
+    margins = [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+    correct = [False, True, False, False, True, False, True, True, True, True, True, True, True, True]
+    
+    a, b = fit_calibration(margins, correct)
+    
+    assert a > 0
+    assert 1 / (1 + math.exp(-b)) < 0.5
+
+
+def test_collect_history_samples_uses_llm_labels_only():
+    history = [
+        {"role": "user", "content": "画饼图", "intent": {"agent_type": "data_visualization", "source": "llm"}},
+        {"role": "user", "content": "统计销量", "intent": {"agent_type": "data_analysis", "source": "local"}},
+        {"role": "assistant", "content": "结果"},
+    ]
+    
+    assert collect_history_samples([history]) == [("画饼图", "data_visualization")]
+
+
+def test_trained_model_is_blended(tmp_path):
+    pytest.importorskip("sklearn")
+    classifier = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES, model_path=str(tmp_path / "model.pkl"))
+    samples = [("画饼图", "data_visualization"), ("画柱状图", "data_visualization"),
+               ("统计销量", "data_analysis"), ("计算均值", "data_analysis")] * 5
+    
+    classifier.train_model(samples)
+    reloaded = LocalIntentClassifier(UserIntentAgent.AGENT_TYPES, model_path=str(tmp_path / "model.pkl"))
+    
+    assert reloaded.stats()["model_loaded"]
+    assert reloaded.predict("帮我画饼图")["agent_type"] == "data_visualization"
+
+
+def test_confident_prompt_skips_llm(monkeypatch):
+    agent = UserIntentAgent(service_type="replay")
+    
+    async def no_llm(*args, **kwargs):
+        raise AssertionError("本地置信度足够时不应调用LLM")
+    
+    monkeypatch.setattr(agent, "_achat_completion", no_llm)
+    result = asyncio.run(agent.aexecute([], "绘制月度销售趋势折线图"))
+    
+    assert result["agent_type"] == "data_visualization"
+    assert result["source"] == "local"
+
+
+def test_relative_model_path_is_resolved_from_project_root(monkeypatch, tmp_path):
+    original = ConfigService.get_config_value
+    settings = {"enabled": True, "model_path": "data/intent_model.pkl"}
+    monkeypatch.setattr(ConfigService, "get_config_value",
+                        lambda self, key, default=None: settings if key == "intent.local_classifier" else original(self, key, default))
+    monkeypatch.setattr(UserIntentAgent, "_local_classifier", None)
+    monkeypatch.chdir(tmp_path)
+    
+    classifier = UserIntentAgent.get_local_classifier()
+    
+    assert classifier.model_path == os.path.join(get_project_root(), "data", "intent_model.pkl")
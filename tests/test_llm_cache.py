@@ -0,0 +1,108 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+from app.services.base_llm_service import BaseLLMService
+from app.services.llm_cache import LLMResponseCache, CachedLLMService, build_request_key
+
+
+class CountingService(BaseLLMService):
+    """记录调用次数的测试服务，返回内容为调用序号"""
+    
+    def __init__(self):
+        super().__init__(model="test-model")
+        self.calls = []
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        self.calls.append(kwargs)
+        return {"choices": [{"message": {"role": "assistant", "content": f"answer-{len(self.calls)}"}}]}
+
+
+def test_request_key_is_canonical():
+    messages = [{"role": "user", "content": "你好"}]
+    key1 = build_request_key("m", messages, {"temperature": 0.1, "max_tokens": 10})
+    key2 = build_request_key("m", messages, {"max_tokens": 10, "temperature": 0.1})
+    assert key1 == key2
+    assert key1 != build_request_key("m", messages, {"max_tokens": 10, "temperature": 0.2})
+    assert key1 != build_request_key("other", messages, {"max_tokens": 10, "temperature": 0.1})
+
+
+def test_cached_service_hits_and_opt_out(tmp_path):
+    inner = CountingService()
+    service = CachedLLMService(inner, LLMResponseCache(str(tmp_path / "cache.sqlite3")))
+    messages = [{"role": "user", "content": "统计一下"}]
+    
+    first = service.chat_completion(messages)
+    second = service.chat_completion(messages)
+    third = asyncio.run(service.achat_completion(messages))
+    assert first == second == third
+    assert len(inner.calls) == 1
+    
+    # use_cache=False时跳过缓存，且不会传递给被包装的服务
+    service.chat_completion(messages, use_cache=False)
+    assert len(inner.calls) == 2
+    assert "use_cache" not in inner.calls[-1]
+    
+    stats = service.get_stats()["cache"]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_lru_eviction_and_ttl(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60, max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, {"choices": []})
+        time.sleep(0.01)
+    # 访问a后b成为最久未使用的条目
+    assert cache.get("a") is not None
+    cache.put("c", {"choices": []})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+    
+    cache.ttl_seconds = 0.01
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_hits_batch_access_time_updates(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMResponseCache(path)
+    cache.put("a", {"choices": []})
+    reader = sqlite3.connect(path)
+    written = reader.execute("SELECT accessed_at FROM llm_responses WHERE key = 'a'").fetchone()[0]
+    
+    time.sleep(0.01)
+    assert cache.get("a") is not None
+    # 命中时不立即提交访问时间
+    assert reader.execute("SELECT accessed_at FROM llm_responses WHERE key = 'a'").fetchone()[0] == written
+    
+    cache.put("b", {"choices": []})
+    assert reader.execute("SELECT accessed_at FROM llm_responses WHERE key = 'a'").fetchone()[0] > written
+
+
+def test_async_calls_use_cache_off_the_event_loop(tmp_path):
+    inner = CountingService()
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"))
+    service = CachedLLMService(inner, cache)
+    threads = []
+    original_get = cache.get
+    
+    def recording_get(key):
+        threads.append(threading.get_ident())
+        return original_get(key)
+    
+    cache.get = recording_get
+    messages = [{"role": "user", "content": "统计一下"}]
+    
+    async def run():
+        first = await service.achat_completion(messages)
+        chunks = [chunk async for chunk in service.astream_chat_completion(messages)]
+        return first, chunks
+    
+    first, chunks = asyncio.run(run())
+    assert chunks[0]["choices"][0]["delta"]["content"] == first["choices"][0]["message"]["content"]
+    assert len(inner.calls) == 1
+    assert threads and threading.get_ident() not in threads
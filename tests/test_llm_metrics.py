@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+import requests
+
+from app.services.base_llm_service import BaseLLMService
+from app.services.llm_metrics import Histogram, MetricsLLMService, llm_metrics
+from app.services.rate_limiter import RateLimitedLLMService
+
+USAGE = {"prompt_tokens": 120, "completion_tokens": 40, "total_tokens": 160, "prompt_cache_hit_tokens": 90,
+         "completion_tokens_details": {"reasoning_tokens": 25}}
+
+
+class UsageService(BaseLLMService):
+    """返回固定usage的测试服务，content为fail时返回429错误"""
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        assert "agent_id" in kwargs
+        if messages[-1]["content"] == "fail":
+            response = requests.Response()
+            response.status_code = 429
+            raise requests.exceptions.HTTPError("429 Error", response=response)
+        return {"choices": [{"message": {"role": "assistant", "content": "ok"}}], "usage": USAGE}
+
+
+def test_histogram_percentiles_stay_within_observed_range():
+    histogram = Histogram((1, 2, 5))
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["buckets"] == {"1": 1, "2": 2, "5": 1, "+Inf": 1}
+    assert 1 <= snapshot["p50"] <= 2
+    assert snapshot["p99"] <= 10
+    assert Histogram((1,)).percentile(50) is None
+
+
+def test_calls_are_recorded_per_agent_and_model():
+    service = RateLimitedLLMService(MetricsLLMService(UsageService(model="metrics-model")))
+    messages = [{"role": "user", "content": "hi"}]
+    
+    service.chat_completion(messages, agent_id="metrics_agent")
+    list(service.stream_chat_completion(messages, agent_id="metrics_agent"))
+    asyncio.run(service.achat_completion(messages, agent_id="metrics_agent"))
+    with pytest.raises(requests.exceptions.HTTPError):
+        service.chat_completion([{"role": "user", "content": "fail"}], agent_id="metrics_agent")
+    
+    [entry] = llm_metrics.snapshot(agent_id="metrics_agent", model="metrics-model")
+    assert entry["calls"] == 4
+    assert entry["errors"] == 1
+    assert entry["error_classes"] == {"HTTPError:429": 1}
+    assert entry["queue_wait_seconds"]["count"] == 4
+    assert entry["ttft_seconds"]["count"] == 1
+    assert entry["prompt_tokens"]["sum"] == 360
+    assert entry["reasoning_tokens"]["sum"] == 75
+    assert entry["prompt_cache_hit_ratio"] == 0.75
+    assert entry["tokens_per_second"]["count"] == 3
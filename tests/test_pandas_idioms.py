@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from app.services.config_service import ConfigService
+from app.utils.pandas_idioms import estimate_seconds, find_slow_idioms, slow_idiom_stats
+
+SLOW = '''import pandas as pd
+
+def analyze_data(dfs):
+    df = dfs[0]
+    totals = pd.DataFrame()
+    for region, group in df.groupby("region"):
+        totals = pd.concat([totals, pd.DataFrame({"region": [region], "amount": [group["amount"].sum()]})])
+    df["double"] = df.apply(lambda row: row["amount"] * 2, axis=1)
+    for i in range(len(df)):
+        df.loc[i, "flag"] = df.loc[i, "amount"] > 1
+    rows = [row["amount"] for _, row in df.iterrows()]
+    return {"总额": totals.reset_index(drop=True)}
+'''
+
+FAST = '''import pandas as pd
+
+def analyze_data(dfs):
+    df = dfs[0]
+    return {"总额": df.groupby("region", as_index=False)["amount"].sum()}
+'''
+
+
+def test_finds_slow_idioms_with_line_numbers():
+    idioms = find_slow_idioms(SLOW)
+    
+    assert [(idiom.rule, idiom.lineno) for idiom in idioms] == [
+        ("group_loop", 6), ("concat_in_loop", 7), ("row_apply", 8), ("index_loop", 9), ("iterrows", 11)
+    ]
+    assert find_slow_idioms(FAST) == []
+    assert find_slow_idioms("def analyze_data(dfs):\n    return df.apply(len)") == []
+    assert estimate_seconds(idioms, 100000) == pytest.approx(4.6)
+
+
+def _configure(monkeypatch, **overrides):
+    original = ConfigService.get_config_value
+    values = {"analysis.code_cache.enabled": False, **{f"analysis.slow_idioms.{key}": value for key, value in overrides.items()}}
+    monkeypatch.setattr(ConfigService, "get_config_value",
+                        lambda self, key, default=None: values[key] if key in values else original(self, key, default))
+
+
+def test_records_estimated_and_actual_runtime(monkeypatch, scripted_agent):
+    _configure(monkeypatch, rewrite=False)
+    slow_idiom_stats.reset()
+    df = pd.DataFrame({"region": ["东", "西", "东"], "amount": [1, 2, 3]})
+    
+    result = scripted_agent([SLOW]).execute([df], "按地区统计销售额")
+    
+    assert result["总额"] == {"region": ["东", "西"], "amount": [4, 2]}
+    stats = slow_idiom_stats.snapshot()
+    assert (stats["checked"], stats["flagged"], stats["rules"]["iterrows"]) == (1, 1, 1)
+    sample = stats["samples"][0]
+    assert (sample["outcome"], sample["row_count"]) == ("flagged", 3)
+    assert sample["actual_seconds"] > 0
+
+
+def test_rewrites_slow_code_with_minimal_prompt(monkeypatch, scripted_agent):
+    _configure(monkeypatch, rewrite=True, rewrite_min_estimated_seconds=0)
+    slow_idiom_stats.reset()
+    df = pd.DataFrame({"region": ["东", "西", "东"], "amount": [1, 2, 3]})
+    agent = scripted_agent([SLOW, FAST])
+    
+    result = agent.execute([df], "按地区统计销售额")
+    
+    assert result["总额"] == {"region": ["东", "西"], "amount": [4, 2]}
+    assert agent.generated_code.strip() == FAST.strip()
+    # 改写请求只包含代码和问题列表，不再附带数据
+    rewrite_prompt = agent.prompts[1][1]["content"]
+    assert "第11行: 使用iterrows逐行遍历" in rewrite_prompt and "数据信息" not in rewrite_prompt
+    assert slow_idiom_stats.snapshot()["rewritten"] == 1
+    
+    # 改写结果仍然低效时使用原始代码
+    agent = scripted_agent([SLOW, SLOW])
+    agent.execute([df], "按地区统计销售额")
+    assert agent.generated_code.strip() == SLOW.strip()
+    assert slow_idiom_stats.snapshot()["rewrite_rejected"] == 1
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from app.agents.data_analysis_conclusion_agent import DataAnalysisConclusionAgent
+from app.agents.user_intent_agent import UserIntentAgent
+from app.utils.prompt_assembly import canonical_json
+
+
+def _shared_prefix(first: str, second: str) -> int:
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+def test_canonical_json_ignores_key_order():
+    assert canonical_json({"b": 1, "a": {"d": 2, "c": 3}}) == canonical_json({"a": {"c": 3, "d": 2}, "b": 1})
+    assert canonical_json({"b": 1, "a": 2}) == '{"a":2,"b":1}'
+
+
+def test_questions_on_same_dataset_share_data_prefix():
+    df = pd.DataFrame({"region": ["华东", "华北", "华南"] * 20, "amount": range(60)})
+    agent = DataAnalysisConclusionAgent(service_type="replay")
+    
+    first = agent._prepare_messages([df], "总结各地区销售额")
+    second = agent._prepare_messages([df], "哪个地区增长最快")
+    
+    assert first[0] == second[0]
+    question_start = first[1]["content"].index("## 分析需求")
+    assert _shared_prefix(first[1]["content"], second[1]["content"]) >= question_start
+    assert first[1]["content"].endswith("总结各地区销售额")
+
+
+def test_intent_prompt_keeps_user_input_last():
+    agent = UserIntentAgent(service_type="replay")
+    
+    first = agent._build_messages("画一个柱状图")
+    second = agent._build_messages("总结一下结论")
+    
+    assert first[0] == second[0]
+    assert first[1]["content"].endswith("画一个柱状图")
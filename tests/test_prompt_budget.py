@@ -0,0 +1,52 @@
+import pandas as pd
+
+from app.utils.prompt_budget import PromptBudget, records_section, schema_section, text_section, TRUNCATED_MARKER
+from app.utils.token_utils import estimate_tokens
+
+
+def _build(sections):
+    return [
+        {"role": "system", "content": "你是一个数据分析专家"},
+        {"role": "user", "content": f"数据信息：\n{sections['schema']}\n数据：\n{sections['sample']}"}
+    ]
+
+
+def _sections(df):
+    schema = {"columns": {col: str(df[col].dtype) for col in df.columns}, "row_count": len(df)}
+    return [schema_section(["sales"], [schema]), records_section(["sales"], [df])]
+
+
+def test_small_prompt_is_not_degraded():
+    df = pd.DataFrame({"region": ["东", "西"], "amount": [1, 2]})
+    messages, report = PromptBudget(context_window=32768, output_reserve_tokens=1024).fit(_sections(df), _build)
+    
+    assert not report["degraded"]
+    assert report["sections"]["sample"]["level"] == 0
+    assert '"region": "东"' in messages[1]["content"]
+
+
+def test_large_data_is_degraded_deterministically():
+    df = pd.DataFrame({"region": ["华东地区"] * 5000, "amount": range(5000)})
+    budget = PromptBudget(context_window=8192, output_reserve_tokens=1024)
+    
+    messages, report = budget.fit(_sections(df), _build)
+    again, _ = budget.fit(_sections(df), _build)
+    
+    assert report["degraded"]
+    assert report["sections"]["sample"]["level"] > 1
+    assert report["sections"]["schema"]["level"] == 0
+    assert report["prompt_tokens"] <= budget.prompt_budget
+    assert "仅展示前" in messages[1]["content"]
+    assert messages == again
+
+
+def test_oversized_text_is_truncated():
+    question = "分析销售额" * 2000
+    budget = PromptBudget(context_window=2048, output_reserve_tokens=512)
+    
+    messages, report = budget.fit([text_section("question", question)],
+                                  lambda sections: [{"role": "user", "content": sections["question"]}])
+    
+    assert report["sections"]["question"]["truncated"]
+    assert messages[0]["content"].endswith(TRUNCATED_MARKER)
+    assert estimate_tokens(messages[0]["content"]) <= budget.prompt_budget
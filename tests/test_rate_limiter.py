@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from contextlib import aclosing
+
+import pytest
+
+from app.services.base_llm_service import BaseLLMService, LLMServiceWrapper
+from app.services.rate_limiter import ModelRateLimiter, RateLimitedLLMService, RateLimitTimeoutError
+
+
+def test_concurrency_limit_and_fifo_order():
+    limiter = ModelRateLimiter("test-model", max_concurrency=1)
+    first = limiter.acquire()
+    order = []
+    
+    def worker(index):
+        permit = limiter.acquire()
+        order.append(index)
+        permit.release()
+    
+    threads = []
+    for index in range(5):
+        thread = threading.Thread(target=worker, args=(index,))
+        thread.start()
+        threads.append(thread)
+        # 等待线程进入队列，保证入队顺序确定
+        while limiter.queue_depth < index + 1:
+            time.sleep(0.001)
+    
+    assert limiter.stats()["active"] == 1
+    first.release()
+    for thread in threads:
+        thread.join(timeout=2)
+    
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.queue_depth == 0
+
+
+def test_token_bucket_reconciles_actual_usage():
+    limiter = ModelRateLimiter("test-model", tpm=600, max_queue_wait=0.05)
+    permit = limiter.acquire(tokens=100)
+    # 实际消耗的token远超预估，令牌桶被扣成负数，后续请求需要等待补充
+    permit.release(actual_tokens=700)
+    
+    with pytest.raises(RateLimitTimeoutError):
+        limiter.acquire(tokens=10)
+    assert limiter.stats()["timeouts"] == 1
+    assert limiter.queue_depth == 0
+
+
+def test_async_waiters_share_queue_with_sync_callers():
+    limiter = ModelRateLimiter("test-model", max_concurrency=1)
+    held = limiter.acquire()
+    
+    async def main():
+        task = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.02)
+        assert limiter.queue_depth == 1
+        threading.Timer(0.02, held.release).start()
+        permit = await asyncio.wait_for(task, 1)
+        assert permit.wait_seconds > 0
+        permit.release()
+    
+    asyncio.run(main())
+    assert limiter.stats()["active"] == 0
+
+
+class ChunkService(BaseLLMService):
+    """逐块返回数据的流式测试服务，记录流是否被关闭"""
+    
+    def __init__(self):
+        super().__init__(model="test-model")
+        self.closed = False
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        raise NotImplementedError
+    
+    async def astream_chat_completion(self, messages, model=None, **kwargs):
+        try:
+            for index in range(10):
+                await asyncio.sleep(0)
+                yield {"choices": [{"index": 0, "delta": {"content": str(index)}}]}
+        finally:
+            self.closed = True
+
+
+def test_abandoned_stream_releases_permit(monkeypatch):
+    limiter = ModelRateLimiter("test-model", max_concurrency=1)
+    inner = ChunkService()
+    rate_limited = RateLimitedLLMService(inner)
+    monkeypatch.setattr(rate_limited, "_limiter", lambda model: limiter)
+    service = LLMServiceWrapper(rate_limited)
+    
+    async def consume():
+        async with aclosing(service.astream_chat_completion([{"role": "user", "content": "hi"}])) as stream:
+            async for chunk in stream:
+                await asyncio.Event().wait()
+    
+    async def main():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        assert limiter.stats()["active"] == 1
+        # 模拟客户端断开：消费者在两个数据块之间被取消，各层包装应立即关闭内层流
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert inner.closed
+        assert limiter.stats()["active"] == 0
+        
+        permit = await asyncio.wait_for(limiter.aacquire(), 1)
+        permit.release()
+    
+    asyncio.run(main())
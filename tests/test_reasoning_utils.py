@@ -0,0 +1,33 @@
+from app.agents.user_intent_agent import UserIntentAgent
+from app.services.config_service import ConfigService
+from app.utils.reasoning_utils import strip_reasoning
+
+
+def test_strip_reasoning_handles_complete_dangling_and_truncated_blocks():
+    assert strip_reasoning('<think>先写{"a": 1}草稿</think>\n{"agent_type": "data_analysis"}') == '{"agent_type": "data_analysis"}'
+    assert strip_reasoning('草稿```python\nprint(1)\n```</think>\n```python\nprint(2)\n```') == '```python\nprint(2)\n```'
+    assert strip_reasoning('<THINK>推理过程被截断') == ''
+    assert strip_reasoning(None) == ''
+    assert strip_reasoning('没有推理块') == '没有推理块'
+
+
+def test_intent_json_is_not_taken_from_reasoning():
+    agent = UserIntentAgent(service_type="replay")
+    content = ('<think>也许是{"agent_type": "data_visualization", "confidence": 0.3}？不对</think>\n'
+               '{"agent_type": "data_analysis", "confidence": 0.9, "explanation": "统计"}')
+    
+    result = agent._parse_response({"choices": [{"message": {"content": content}}]}, "统计销售额")
+    
+    assert result["agent_type"] == "data_analysis"
+
+
+def test_thinking_params_are_only_sent_to_supported_models(monkeypatch):
+    agent = UserIntentAgent(service_type="replay")
+    options = agent._get_llm_options()
+    assert options["max_tokens"] == 2048
+    assert "enable_thinking" not in options
+    
+    monkeypatch.setitem(ConfigService().get_global_config()["llm"], "generation", {"thinking_models": [agent.model]})
+    options = agent._get_llm_options()
+    assert options["enable_thinking"] is False
+    assert options["thinking_budget"] == 512
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.base_llm_service import BaseLLMService, assemble_stream_response
+from app.services.llm_service_factory import LLMServiceFactory
+from app.services.replay_service import ReplayLLMService, ReplayMissError
+
+
+class RecordingUpstream(BaseLLMService):
+    """录制时被调用的测试服务"""
+    
+    calls = 0
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        RecordingUpstream.calls += 1
+        return {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "各地区销售额汇总"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30}
+        }
+
+
+LLMServiceFactory.register_service("replay_test_upstream", RecordingUpstream)
+
+MESSAGES = [{"role": "user", "content": "按地区汇总销售额"}]
+
+
+def _service(tmp_path, mode, profile="instant"):
+    return ReplayLLMService(model="replay-model", fixtures_dir=str(tmp_path), mode=mode, profile=profile,
+                            record_service_type="replay_test_upstream")
+
+
+def test_record_then_replay_without_upstream(tmp_path):
+    recorded = _service(tmp_path, "auto").chat_completion(MESSAGES, temperature=0.1)
+    calls = RecordingUpstream.calls
+    
+    replay = _service(tmp_path, "replay")
+    assert replay.chat_completion(MESSAGES, temperature=0.1, use_cache=False) == recorded
+    assert RecordingUpstream.calls == calls
+    assert replay.get_stats()["replay"]["replayed"] == 1
+    
+    # 采样参数不同视为不同请求
+    with pytest.raises(ReplayMissError):
+        replay.chat_completion(MESSAGES, temperature=0.7)
+
+
+def test_stream_replay_follows_latency_profile(tmp_path):
+    _service(tmp_path, "record").chat_completion(MESSAGES)
+    replay = _service(tmp_path, "replay", profile={"ttft_seconds": 0.05, "tokens_per_second": 200})
+    
+    async def collect():
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in replay.astream_chat_completion(MESSAGES)]
+        return chunks, time.perf_counter() - start
+    
+    chunks, elapsed = asyncio.run(collect())
+    response = assemble_stream_response(chunks)
+    
+    assert response["choices"][0]["message"]["content"] == "各地区销售额汇总"
+    assert response["usage"]["total_tokens"] == 30
+    assert len(chunks) > 2
+    assert elapsed >= 0.05 + (len(chunks) - 1) / 200
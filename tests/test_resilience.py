@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from app.services.base_llm_service import BaseLLMService
+from app.services.resilience import ResilientLLMService, RetryPolicy, CircuitBreaker
+
+
+def _http_error(status_code: int) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code} Error", response=response)
+
+
+class FlakyService(BaseLLMService):
+    """按预设的错误序列失败，之后返回固定内容的测试服务"""
+    
+    def __init__(self, model: str, errors=(), delay: float = 0.0):
+        super().__init__(model=model)
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        time.sleep(self.delay)
+        return {"choices": [{"message": {"role": "assistant", "content": model or self.model}}]}
+
+
+def _resilient(service, fallbacks=(), **kwargs):
+    return ResilientLLMService(
+        service, "test", fallback_resolver=lambda: list(fallbacks),
+        retry_policy=RetryPolicy(max_retries=2, base_delay=0.001, max_delay=0.01), **kwargs
+    )
+
+
+def test_retries_transient_errors_then_succeeds():
+    inner = FlakyService("retry-model", errors=[_http_error(429), _http_error(503)])
+    service = _resilient(inner)
+    
+    response = service.chat_completion([{"role": "user", "content": "hi"}])
+    
+    assert response["choices"][0]["message"]["content"] == "retry-model"
+    assert inner.calls == 3
+    assert service.get_stats()["resilience"]["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    inner = FlakyService("bad-request-model", errors=[_http_error(400)])
+    service = _resilient(inner)
+    
+    with pytest.raises(requests.exceptions.HTTPError):
+        service.chat_completion([{"role": "user", "content": "hi"}])
+    assert inner.calls == 1
+
+
+def test_falls_back_and_skips_open_circuit():
+    primary = FlakyService("primary-model", errors=[_http_error(502)] * 10)
+    fallback = FlakyService("fallback-model")
+    service = _resilient(primary, fallbacks=[("test", "fallback-model", fallback)], failure_threshold=3)
+    
+    response = service.chat_completion([{"role": "user", "content": "hi"}])
+    assert response["choices"][0]["message"]["content"] == "fallback-model"
+    assert primary.calls == 3
+    
+    # 主服务已熔断，后续调用直接走降级服务
+    asyncio.run(service.achat_completion([{"role": "user", "content": "hi"}]))
+    assert primary.calls == 3
+    assert fallback.calls == 2
+    stats = service.get_stats()["resilience"]
+    assert stats["circuit_breaker"]["state"] == CircuitBreaker.OPEN
+    assert stats["short_circuited"] == 1
+
+
+def test_hedged_request_cuts_tail_latency():
+    inner = FlakyService("hedge-model")
+    service = _resilient(inner, hedge_enabled=True, hedge_min_samples=1, hedge_min_delay=0.05)
+    service._tracker("hedge-model").record(0.05)
+    
+    # 第一次调用很慢，超过对冲阈值后发起的第二个请求先返回
+    original = inner.chat_completion
+    slow_calls = [0.5]
+    
+    def chat_completion(messages, model=None, **kwargs):
+        delay = slow_calls.pop() if slow_calls else 0.0
+        time.sleep(delay)
+        return original(messages, model, **kwargs)
+    
+    inner.chat_completion = chat_completion
+    start = time.monotonic()
+    service.chat_completion([{"role": "user", "content": "hi"}])
+    
+    assert time.monotonic() - start < 0.4
+    stats = service.get_stats()["resilience"]
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
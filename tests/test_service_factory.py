@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+
+from app.services.base_llm_service import BaseLLMService
+from app.services.config_service import ConfigService
+from app.services.llm_service_factory import LLMServiceFactory
+from app.services.silicon_flow_service import SiliconFlowService
+
+
+class CountingService(BaseLLMService):
+    """记录创建和关闭次数的测试服务，创建较慢以便暴露并发竞争"""
+    
+    created = 0
+    closed = []
+    release = None
+    
+    def __init__(self, model=None):
+        super().__init__(model=model)
+        time.sleep(0.01)
+        CountingService.created += 1
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        if CountingService.release is not None:
+            CountingService.release.wait(5)
+        return {"choices": [{"message": {"role": "assistant", "content": "ok"}}]}
+    
+    def close(self):
+        CountingService.closed.append(self.model)
+
+
+LLMServiceFactory.register_service("factory_test", CountingService)
+
+
+@pytest.fixture(autouse=True)
+def isolated_factory(monkeypatch):
+    llm_config = ConfigService().get_global_config().setdefault("llm", {})
+    monkeypatch.setitem(llm_config, "cache", {"enabled": False})
+    monkeypatch.setitem(llm_config, "service_cache", {"max_instances": 2})
+    monkeypatch.setattr(LLMServiceFactory, "_service_instances", OrderedDict())
+    monkeypatch.setattr(LLMServiceFactory, "_upstream_instances", OrderedDict())
+    CountingService.created = 0
+    CountingService.closed = []
+    CountingService.release = None
+
+
+def test_concurrent_get_service_shares_one_instance():
+    services = []
+    threads = [threading.Thread(target=lambda: services.append(LLMServiceFactory.get_service("factory_test", "model-a")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    # 服务在锁外创建，竞争失败的线程关闭自己创建的重复实例
+    assert CountingService.created - len(CountingService.closed) == 1
+    assert len({id(service) for service in services}) == 1
+    assert LLMServiceFactory.get_service("factory_test", "model-a").chat_completion([])["choices"]
+    
+    LLMServiceFactory.get_service("factory_test", "model-b")
+    LLMServiceFactory.get_service("factory_test", "model-c")
+    assert CountingService.closed.count("model-a") == CountingService.created - 2
+
+
+def test_slow_construction_does_not_block_other_services(monkeypatch):
+    started, proceed = threading.Event(), threading.Event()
+    
+    class SlowService(CountingService):
+        def __init__(self, model=None):
+            started.set()
+            proceed.wait(5)
+            super().__init__(model=model)
+    
+    monkeypatch.setitem(LLMServiceFactory._service_classes, "factory_slow", SlowService)
+    slow = threading.Thread(target=LLMServiceFactory.get_service, args=("factory_slow", "model-a"))
+    slow.start()
+    try:
+        assert started.wait(5)
+        assert LLMServiceFactory.get_service("factory_test", "model-b").model == "model-b"
+    finally:
+        proceed.set()
+        slow.join()
+
+
+def test_least_recently_used_service_is_evicted_and_closed():
+    first = LLMServiceFactory.get_service("factory_test", "model-a")
+    LLMServiceFactory.get_service("factory_test", "model-b")
+    assert LLMServiceFactory.get_service("factory_test", "model-a") is first
+    
+    LLMServiceFactory.get_service("factory_test", "model-c")
+    
+    assert CountingService.closed == ["model-b"]
+    assert list(LLMServiceFactory.get_stats()) == ["factory_test_model-a", "factory_test_model-c"]
+
+
+def test_evicted_service_closes_after_in_flight_call():
+    service = LLMServiceFactory.get_service("factory_test", "model-a")
+    CountingService.release = threading.Event()
+    call = threading.Thread(target=service.chat_completion, args=([{"role": "user", "content": "hi"}],))
+    call.start()
+    
+    LLMServiceFactory.get_service("factory_test", "model-b")
+    LLMServiceFactory.get_service("factory_test", "model-c")
+    assert "factory_test_model-a" not in LLMServiceFactory.get_stats()
+    assert CountingService.closed == []
+    
+    CountingService.release.set()
+    call.join()
+    assert CountingService.closed == ["model-a"]
+
+
+def test_fallback_chain_keeps_evicted_upstream_open():
+    service = LLMServiceFactory.get_service("factory_test", "model-a")
+    upstream = LLMServiceFactory.get_upstream_service("factory_test", "model-b")
+    
+    LLMServiceFactory.get_service("factory_test", "model-c")
+    LLMServiceFactory.get_service("factory_test", "model-d")
+    assert CountingService.closed == ["model-a"]
+    
+    # 降级链等持有者释放引用后才关闭
+    upstream.close()
+    assert CountingService.closed == ["model-a", "model-b"]
+    service.close()
+    assert CountingService.closed == ["model-a", "model-b"]
+
+
+def test_shared_connection_pool_closes_with_last_reference():
+    first = SiliconFlowService(api_key="test", api_base="http://pool.test", model="model-a")
+    second = SiliconFlowService(api_key="test", api_base="http://pool.test", model="model-b")
+    assert first.session is second.session
+    
+    first.close()
+    first.close()
+    assert first._session_key in SiliconFlowService._sessions
+    
+    second.close()
+    assert first._session_key not in SiliconFlowService._sessions
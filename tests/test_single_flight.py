@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.base_llm_service import BaseLLMService
+from app.services.single_flight import SingleFlightLLMService
+
+
+class SlowService(BaseLLMService):
+    """每次调用耗时固定的测试服务"""
+    
+    def __init__(self, delay: float = 0.2):
+        super().__init__(model="test-model")
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return {"choices": [{"message": {"role": "assistant", "content": messages[-1]["content"]}}]}
+    
+    async def achat_completion(self, messages, model=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"choices": [{"message": {"role": "assistant", "content": messages[-1]["content"]}}]}
+
+
+def test_concurrent_identical_requests_share_one_call():
+    inner = SlowService()
+    service = SingleFlightLLMService(inner)
+    messages = [{"role": "user", "content": "相同的问题"}]
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: service.chat_completion(messages), range(8)))
+    
+    assert inner.calls == 1
+    assert all(result == results[0] for result in results)
+    assert service.get_stats()["single_flight"]["coalesced"] == 7
+
+
+def test_async_and_sync_callers_coalesce():
+    inner = SlowService()
+    service = SingleFlightLLMService(inner)
+    messages = [{"role": "user", "content": "相同的问题"}]
+    other = [{"role": "user", "content": "不同的问题"}]
+    
+    async def run():
+        sync_call = asyncio.to_thread(service.chat_completion, messages)
+        return await asyncio.gather(
+            service.achat_completion(messages),
+            service.achat_completion(messages),
+            sync_call,
+            service.achat_completion(other),
+        )
+    
+    results = asyncio.run(run())
+    assert inner.calls == 2
+    assert results[0] == results[1] == results[2]
+    assert results[3]["choices"][0]["message"]["content"] == "不同的问题"
+    assert service.get_stats()["single_flight"]["in_flight"] == 0
@@ -0,0 +1,98 @@
+import asyncio
+
+from app.agents.base_agent import BaseAgent
+from app.services.base_llm_service import BaseLLMService
+from app.services.llm_metrics import MetricsLLMService
+from app.services.speculation import SpeculativeGeneration, speculation_stats, start_speculation
+
+USAGE = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+
+
+class SlowService(BaseLLMService):
+    """等待指定时间后返回固定usage的测试服务"""
+    
+    def __init__(self, delay):
+        super().__init__(model="slow-model")
+        self.delay = delay
+    
+    def chat_completion(self, messages, model=None, **kwargs):
+        raise NotImplementedError
+    
+    async def achat_completion(self, messages, model=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return {"choices": [{"message": {"role": "assistant", "content": "ok"}}], "usage": USAGE}
+
+
+class StagedAgent:
+    """只实现分阶段执行接口的测试代理"""
+    
+    def __init__(self, delay=0.0):
+        self.service = MetricsLLMService(SlowService(delay))
+        self.finished = False
+    
+    async def agenerate(self, inputs, prompt):
+        response = await self.service.achat_completion([{"role": "user", "content": prompt}], agent_id="staged")
+        return {"response": response}
+    
+    async def afinish(self, generation):
+        self.finished = True
+        return generation["response"]["choices"][0]["message"]["content"]
+
+
+def test_hit_returns_generation_without_waste():
+    speculation_stats.reset()
+    
+    async def run():
+        speculation = SpeculativeGeneration("data_analysis", StagedAgent(), [], "统计销售额")
+        generation = await speculation.resolve("data_analysis")
+        return await speculation.agent.afinish(generation)
+    
+    assert asyncio.run(run()) == "ok"
+    stats = speculation_stats.snapshot()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 0, 1.0)
+    assert stats["wasted_prompt_tokens"] == 0
+
+
+def test_miss_cancels_generation_and_counts_wasted_tokens():
+    speculation_stats.reset()
+    
+    async def run():
+        finished = SpeculativeGeneration("data_analysis", StagedAgent(), [], "统计销售额")
+        in_flight = SpeculativeGeneration("data_analysis", StagedAgent(delay=10), [], "统计销售额")
+        await asyncio.sleep(0.05)
+        assert await finished.resolve("data_visualization") is None
+        assert await in_flight.resolve("data_visualization") is None
+        await asyncio.sleep(0)
+        assert in_flight._task.cancelled()
+        assert not in_flight.agent.finished
+    
+    asyncio.run(run())
+    stats = speculation_stats.snapshot()
+    assert (stats["misses"], stats["hit_rate"]) == (2, 0.0)
+    assert stats["wasted_calls"] == 2
+    # 完成的调用按usage计数，被取消的调用按提示词估算
+    assert stats["wasted_completion_tokens"] == 20
+    assert stats["wasted_prompt_tokens"] > 100
+
+
+def test_speculation_requires_config_and_mid_confidence(monkeypatch):
+    settings = {"intent.speculation": {"enabled": True, "min_confidence": 0.5}, "intent.local_classifier.threshold": 0.8}
+    monkeypatch.setattr("app.services.config_service.ConfigService.get_config_value",
+                        lambda self, key, default=None: settings.get(key, default))
+    
+    class Agent(StagedAgent, BaseAgent):
+        def __init__(self):
+            StagedAgent.__init__(self)
+    
+    async def start(confidence):
+        prediction = {"agent_type": "data_analysis", "confidence": confidence}
+        speculation = start_speculation(prediction, {"data_analysis": Agent}, [], "统计销售额")
+        if speculation is not None:
+            speculation.cancel()
+        return speculation is not None
+    
+    assert asyncio.run(start(0.6))
+    assert not asyncio.run(start(0.3))
+    assert not asyncio.run(start(0.9))
+    settings["intent.speculation"]["enabled"] = False
+    assert not asyncio.run(start(0.6))